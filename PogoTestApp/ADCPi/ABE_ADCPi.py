@@ -24,6 +24,7 @@ class ADCPi:
     __conversionmode = 1 # Conversion Mode
     __pga = float(0.5)  # current pga setting
     __lsb = float(0.0000078125)  # default lsb value for 18 bit
+    poll_count = 0  # number of reads needed for the last conversion to be ready
 
     # create byte array and fill with initial values to define size
     __adcreading = bytearray()
@@ -138,8 +139,9 @@ class ADCPi:
                 self._bus.write_byte(address, config)
                 config = self.__updatebyte(config, 7, 0)
         # keep reading the adc data until the conversion result is ready
+        self.poll_count = 0
         while True:
-            
+            self.poll_count += 1
             __adcreading = self._bus.read_i2c_block_data(address, config, 4)
             if self.__bitrate == 18:
                 h = __adcreading[0]
@@ -0,0 +1,73 @@
+"Background acquisition of every analogue and digital reading for display"
+
+import time
+import queue
+import threading
+
+from ATE import adc, digio, instrument
+
+class Acquisition(object):
+    "Reads all ADC channels and GPIO pins on its own thread every period seconds and publishes each snapshot to a queue for the GUI."
+
+    # Seconds between snapshots.
+    period = 0.5
+
+    def __init__(self, period = None):
+        if period is not None:
+            self.period = period
+
+        # Only the newest snapshot is useful to the display, so the queue holds one and older ones are replaced.
+        self.snapshots = queue.Queue(maxsize = 1)
+
+        # Functions called with (sequence, timestamp, readings) from the acquisition thread after each snapshot.
+        self.subscribers = []
+
+        self.sequence = 0
+        self.latest = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    @instrument.timed("Acquisition.read", category = "acquisition")
+    def read(self):
+        "Returns a dictionary of every reading keyed by the names used on MainForm, e.g. AD1, DIP3, DOP11"
+        readings = adc.read_all_voltages()
+        readings.update(digio.read_all_inputs())
+        readings.update(digio.read_all_outputs())
+        return readings
+
+    def publish(self, readings):
+        "Makes readings the latest snapshot, replacing any the GUI hasn't collected yet, and notifies subscribers"
+        self.sequence += 1
+        timestamp = time.time()
+        self.latest = (self.sequence, timestamp, readings)
+
+        try:
+            self.snapshots.get_nowait()
+        except queue.Empty:
+            pass
+        self.snapshots.put_nowait(readings)
+
+        for subscriber in self.subscribers:
+            subscriber(self.sequence, timestamp, readings)
+
+    def start(self):
+        "Starts reading on a background thread"
+        self._stop.clear()
+        self._thread = threading.Thread(target = self._loop, name = "Acquisition", daemon = True)
+        self._thread.start()
+
+    def stop(self):
+        "Stops the background thread after its current snapshot"
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            started = time.monotonic()
+            try:
+                self.publish(self.read())
+            except Exception as e:
+                print("Acquisition failed: %s" % e)
+
+            self._stop.wait(max(0, self.period - (time.monotonic() - started)))
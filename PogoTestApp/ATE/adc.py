@@ -1,6 +1,10 @@
 # Import our required modules and methods
+import time as _time
 from time import sleep
 from ATE import const
+from ATE import datalog
+from ATE import instrument
+from ATE import fixtures
 
 # Try loading the ADC modules. If not, enable simulation mode.
 # Simulation mode doesn't read any values from the ADC, instead it just returns the value of whatever is set by Channel.set_simulation_voltage()
@@ -13,40 +17,88 @@ except:
     print("ADC libraries could not be loaded, simulation mode enabled. VOLTAGES WILL NOT BE READ FROM HARDWARE!")
     simulation_mode = True
 
+# The ADC driver keeps the selected channel in its state, so only one thread may use the bus at a time.
+# When several fixtures share the controller the bus is handed to them in turn.
+bus_lock = fixtures.FairLock()
+
+# I2C addresses of the two ADC chips. Channels 1 to 4 are on the first and 5 to 8 on the second.
+addresses = (0x68, 0x69)
+
 if not simulation_mode:
     _i2c_helper = ABEHelpers()
     _bus = _i2c_helper.get_smbus()
-    adc = ADCPi(_bus, 0x68, 0x69, 12)
-
-def read_all_voltages():
-    "Reads the voltages from all defined analogue channels"
-    def read(channel):
-        return round(Channel(channel).read_voltage(), 2)
-
-    return {
-        "AD1": read(const.AD1_V_pogo),
-        "AD2": read(const.AD2_V_5V_pwr),
-        "AD3": read(const.AD3_V_in),
-        "AD4": read(const.AD4_V_TP13_NTC),
-        "AD5": read(const.AD5_V_bat),
-        "AD6": read(const.AD6_V_sense),
-        "AD7": read(const.AD7_V_sys_out),
-        "AD8": read(const.AD8_V_out)
-    }
+    adc = ADCPi(_bus, addresses[0], addresses[1], 12)
 
-def get_all_channels():
-    "Returns a dictionary of all channels"
+    # Time every conversion and count how many times the driver polled for it to be ready.
+    # ADCPi.read_voltage calls self.read_raw so replacing it on the instance covers every read.
+    def _instrument_read_raw(read_raw):
+        timed_read_raw = instrument.timed("ADCPi.read_raw")(read_raw)
+
+        def wrapper(channel):
+            raw = timed_read_raw(channel)
+            if instrument.enabled:
+                instrument.count("ADCPi.read_raw polls", adc.poll_count)
+            return raw
+
+        return wrapper
+
+    adc.read_raw = _instrument_read_raw(adc.read_raw)
+
+# Input range of the ADC Pi at PGA x1 in volts, as returned by ADCPi.read_voltage(): the MCP3424's 2.048V
+# reference scaled by the board's input divider. PGA x2, x4 and x8 divide it by their gain.
+full_scale = 2.048 * 2.471
+
+# PGA gains tried by auto-ranging, highest first.
+gains = (8, 4, 2, 1)
+
+# Fraction of a gain's range a reading must stay below for that gain to be chosen, leaving room for noise.
+autorange_headroom = 0.9
+
+# Fraction of a gain's range at which a reading is taken to have clipped.
+overrange = 0.98
 
-    return {
-        "AD1": Channel(const.AD1_V_pogo),
-        "AD2": Channel(const.AD2_V_5V_pwr),
-        "AD3": Channel(const.AD3_V_in),
-        "AD4": Channel(const.AD4_V_TP13_NTC),
-        "AD5": Channel(const.AD5_V_bat),
-        "AD6": Channel(const.AD6_V_sense),
-        "AD7": Channel(const.AD7_V_sys_out),
-        "AD8": Channel(const.AD8_V_out)
-    }
+# The PGA gain the driver is set to. ADCPi.set_pga sets it for both chips, so it is switched before each
+# conversion which needs a different gain.
+_gain = 1
+
+def choose_gain(voltage):
+    "Returns the highest PGA gain whose range holds voltage, read at PGA x1, with autorange_headroom to spare"
+    for gain in gains:
+        if voltage < full_scale / gain * autorange_headroom:
+            return gain
+    return 1
+
+def _read_at_gain(channel, gain):
+    "Reads channel from the driver at gain. The caller must hold bus_lock"
+    global _gain
+    if gain != _gain:
+        adc.set_pga(gain)
+        _gain = gain
+    return adc.read_voltage(channel)
+
+def probe(address):
+    "Returns True if an ADC chip acknowledges at address on the I2C bus. Always True in simulation mode"
+    if simulation_mode:
+        return True
+
+    with bus_lock:
+        try:
+            _bus.read_byte(address)
+        except IOError:
+            return False
+    return True
+
+# Channel number of each analogue reading, by the name used on MainForm.
+channel_numbers = {
+    "AD1": const.AD1_V_pogo,
+    "AD2": const.AD2_V_5V_pwr,
+    "AD3": const.AD3_V_in,
+    "AD4": const.AD4_V_TP13_NTC,
+    "AD5": const.AD5_V_bat,
+    "AD6": const.AD6_V_sense,
+    "AD7": const.AD7_V_sys_out,
+    "AD8": const.AD8_V_out
+}
 
 # Contains a dictionary of channel: factor values.
 # If a channel is loaded matching the key, all readings will be multiplied by factor.
@@ -55,20 +107,87 @@ conversion_factors = {}
 # The overall conversion factor for all channels if not defined in the conversion_factors list
 global_conversion_factor = 1.0
 
+# Seconds a conversion is reused by read_voltage() on each channel, by name. Channels not listed use read_ttl.
+read_ttl = 0.0
+read_ttls = {}
+
+# ATE.filters Pipeline applied to each reading of a channel, by name. Channels not listed read a single conversion.
+channel_filters = {}
+
+# Names of the channels which choose their PGA gain. The others always read at PGA x1.
+autorange_channels = ()
+
+# The Channel for each name, created once by configure() or the first get_channel() or get_all_channels().
+_channels = None
+
+def configure(global_factor = None, factors = None, ttl = None, ttls = None, filters = None, autorange = None):
+    """
+    Sets the conversion factors, read cache lifetimes, filter pipelines and auto-ranging channels and creates the channels from them.
+    Channels already handed out are replaced, so call this before any test or thread reads a channel.
+    """
+    global global_conversion_factor, conversion_factors, read_ttl, read_ttls, channel_filters, autorange_channels, _channels
+
+    if global_factor is not None:
+        global_conversion_factor = global_factor
+    if factors is not None:
+        conversion_factors = factors
+    if ttl is not None:
+        read_ttl = ttl
+    if ttls is not None:
+        read_ttls = ttls
+    if filters is not None:
+        channel_filters = filters
+    if autorange is not None:
+        autorange_channels = tuple(autorange)
+
+    _channels = {}
+    for name, number in channel_numbers.items():
+        _channels[name] = Channel(number, ttl = read_ttls.get(name, read_ttl), pipeline = channel_filters.get(name), autorange = name in autorange_channels)
+
+def get_channel(name):
+    "Returns the channel for a name such as AD1"
+    if _channels is None:
+        configure()
+    return _channels[name]
+
+def read_all_voltages(fresh = False):
+    "Reads the voltages from all defined analogue channels. Unless fresh is True, conversions within each channel's TTL are reused"
+    return dict((name, round(channel.read_voltage(fresh = fresh), 2)) for name, channel in get_all_channels().items())
+
+def get_all_channels():
+    "Returns a dictionary of all channels"
+    if _channels is None:
+        configure()
+    return dict(_channels)
+
 class Channel(object):
     "Represents an analogue channel on an analogue to digital converter"
 
-    index = None # the number of the channel this instance reads from
+    __slots__ = ("index", "ttl", "pipeline", "autorange", "gain", "_simulation_mode", "_simulation_voltage", "_conversion_factor", "_last")
+
+    def __init__(self, channel, conversion_factor = 1.0, ttl = 0.0, pipeline = None, autorange = False):
+        self.index = channel # the number of the channel this instance reads from
+
+        # Seconds read_voltage() returns the last conversion for instead of reading again. 0 reads every time.
+        self.ttl = ttl
+
+        # ATE.filters Pipeline which turns a block of conversions into each fresh reading. None, or a cached read, takes a single conversion.
+        self.pipeline = pipeline
+
+        # Whether the channel reads at the highest PGA gain its signal allows, and the gain chosen.
+        # The gain is chosen by the first conversion and kept until a conversion overranges.
+        self.autorange = autorange
+        self.gain = None
+
+        # Simulation variables used for testing when ADC is not available.
+        self._simulation_mode = False
+        self._simulation_voltage = 0.0
 
-    # Simulation variables used for testing when ADC is not available.
-    _simulation_mode = False
-    _simulation_voltage = 0.0
-    
-    # Value to adjust the voltage read by on this channel.
-    _conversion_factor = 1.0
+        # Value to adjust the voltage read by on this channel.
+        self._conversion_factor = 1.0
 
-    def __init__(self, channel, conversion_factor = 1.0):
-        self.index = channel
+        # (voltage, time.time(), time.monotonic()) of the last conversion.
+        self._last = None
 
         # If there is a global conversion factor set other than the default 1.0
         if global_conversion_factor != 1.0:
@@ -97,17 +216,73 @@ class Channel(object):
     def set_simulation_voltage(self, value):
         "Sets the voltage which will be returned by read_voltage() if the class instance is in simulation mode"
         self._simulation_voltage = value
+        self._last = None
 
     def set_conversion_factor(self, factor):
         "Sets the conversion factor for this channel. The factor is added to whichever readings are returned from the ADC"
         self._conversion_factor = factor
 
-    def read_voltage(self, decimal_places = 4):
-        "Reads a single voltage value from the A/D converter or the _simulation_voltage var if in simulation mode"
+    @instrument.timed("Channel.read_voltage")
+    def read_voltage(self, decimal_places = 4, fresh = False):
+        "Reads a single voltage value from the A/D converter or the _simulation_voltage var if in simulation mode. Returns the last conversion instead if it is less than ttl seconds old, unless fresh is True"
+        return round(self.read(fresh)[0], decimal_places)
+
+    def read(self, fresh = False):
+        "Returns (voltage, timestamp) of a new conversion, or of the last one if it is less than ttl seconds old and fresh is False"
+        last = self._last
+        if not fresh and last is not None and _time.monotonic() - last[2] < self.ttl:
+            return last[0], last[1]
+
+        # Only measurements are filtered. The display's cached reads take a single conversion so they hold the bus briefly.
+        if fresh and self.pipeline is not None:
+            voltage = self.pipeline.run(self.convert)
+        else:
+            voltage = self.convert()
+
+        self._last = (voltage, _time.time(), _time.monotonic())
+        datalog.log("read_voltage", "AD%d" % self.index, voltage)
+        return voltage, self._last[1]
+
+    def convert(self, locked = False):
+        """
+        Returns a single conversion from the A/D converter, or the simulation voltage, without filtering or caching it.
+        Pass locked = True when the caller already holds bus_lock, as it isn't reentrant.
+        """
         if self._simulation_mode:
             return self._simulation_voltage
+
+        # The lock is taken for each conversion so a filtered read doesn't hold up other threads for its whole block.
+        if locked:
+            voltage = self._convert()
         else:
-            return round(adc.read_voltage(self.index) * self._conversion_factor, decimal_places)
+            with bus_lock:
+                voltage = self._convert()
+
+        return voltage * self._conversion_factor
+
+    def _convert(self):
+        # Called with bus_lock held.
+        if not self.autorange:
+            return _read_at_gain(self.index, 1)
+
+        if self.gain is not None and self.gain != 1:
+            voltage = _read_at_gain(self.index, self.gain)
+            if voltage < full_scale / self.gain * overrange:
+                return voltage
+            if instrument.enabled:
+                instrument.count("Channel.convert overrange")
+
+        # Choose the gain from a conversion at PGA x1 and convert again at it if it is higher.
+        voltage = _read_at_gain(self.index, 1)
+        self.gain = choose_gain(voltage)
+        if self.gain != 1:
+            voltage = _read_at_gain(self.index, self.gain)
+        return voltage
+
+    def last_reading(self):
+        "Returns (voltage, timestamp) of the last conversion, or None if the channel hasn't been read"
+        last = self._last
+        return (last[0], last[1]) if last is not None else None
 
     def read_voltage_range(self, sample_size = 1, tolerance = 0.01, sleep = 0.1):
         "Reads voltage sample_size times with a sleep seconds delay and returns (voltage, True, readings) if all readings are within tolerance, or (voltage, False, readings) if a reading is not in tolerance"
@@ -116,7 +291,7 @@ class Channel(object):
         valid = True
 
         while loop < sample_size:
-            readings.append(self.read_voltage())
+            readings.append(self.read_voltage(fresh = True))
             loop += 1
            
         for reading in readings:
@@ -129,16 +304,18 @@ class Channel(object):
         
     def zero_voltage(self):
         "Returns True if less than 1 volt is read from the channel, or False for any other value."
-        return self.read_voltage() < 1.0
+        return self.read_voltage(fresh = True) < 1.0
 
     def voltage_between(self, lower, upper, tolerance):
         "Reads voltage from the channel and returns bool (is between lower and upper) and voltage read"
-        v = self.read_voltage()
-        return ((self.isclose(lower, v, tolerance) or v >= lower) and (self.isclose(upper, v, tolerance) or v <= upper)), v
+        v = self.read_voltage(fresh = True)
+        between = (self.isclose(lower, v, tolerance) or v >= lower) and (self.isclose(upper, v, tolerance) or v <= upper)
+        datalog.log("voltage_between", "AD%d" % self.index, v, "%s..%s %s" % (lower, upper, between))
+        return between, v
 
     def voltage_near(self, target, relative_tolerance, absolute_tolerance = 0.0):
         "Reads voltage from the channel and returns true if target is within tolerance, false if not"
-        return self.isclose(target, self.read_voltage(), relative_tolerance, absolute_tolerance)
+        return self.isclose(target, self.read_voltage(fresh = True), relative_tolerance, absolute_tolerance)
 
     def await_voltage(self, target, tolerance, timeout = 10):
         "Waits for the specified voltage within tolerance, returning true if matched or false if timeout seconds pass"
@@ -0,0 +1,219 @@
+"Incremental process capability (SPC) and yield statistics per measurement"
+
+import math
+import threading
+
+# NumPy is optional. It is only used to speed up recomputing statistics from the results history.
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+class Series(object):
+    "Running statistics for one (variant, measurement) series. Uses constant memory however many values are added."
+
+    # Weight given to each new value in the exponentially weighted moving average.
+    alpha = 0.1
+
+    def __init__(self, variant, name, alpha = None):
+        self.variant = variant
+        self.name = name
+        if alpha is not None:
+            self.alpha = alpha
+
+        self.count = 0
+        self.passes = 0
+        self.judged = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+        self.minimum = None
+        self.maximum = None
+        self.ewma = None
+        self.lower = None
+        self.upper = None
+
+    def add(self, value, lower = None, upper = None, passed = None):
+        "Adds a single value using Welford's algorithm. The most recent limits given are the ones Cp/Cpk are judged against"
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+
+        self.minimum = value if self.minimum is None else min(self.minimum, value)
+        self.maximum = value if self.maximum is None else max(self.maximum, value)
+        self.ewma = value if self.ewma is None else self.ewma + self.alpha * (value - self.ewma)
+
+        if lower is not None:
+            self.lower = lower
+        if upper is not None:
+            self.upper = upper
+
+        if passed is not None:
+            self.judged += 1
+            if passed:
+                self.passes += 1
+
+    def merge(self, count, mean, m2, minimum, maximum, ewma, passes = 0, judged = 0):
+        "Combines statistics calculated elsewhere (e.g. by batch_statistics) into this series, oldest first"
+        if count == 0:
+            return
+
+        total = self.count + count
+        delta = mean - self.mean
+        self._m2 += m2 + delta * delta * self.count * count / total
+        self.mean += delta * count / total
+        self.count = total
+
+        self.minimum = minimum if self.minimum is None else min(self.minimum, minimum)
+        self.maximum = maximum if self.maximum is None else max(self.maximum, maximum)
+        # The merged values are newer than anything already added, so their EWMA is the current one.
+        self.ewma = ewma
+        self.passes += passes
+        self.judged += judged
+
+    @property
+    def variance(self):
+        "Sample variance of the values added so far"
+        if self.count < 2:
+            return 0.0
+        return self._m2 / (self.count - 1)
+
+    @property
+    def stddev(self):
+        return math.sqrt(self.variance)
+
+    @property
+    def cp(self):
+        "Process capability (USL - LSL) / 6 sigma, or None if there are no limits or no spread yet"
+        if self.lower is None or self.upper is None or self.stddev == 0:
+            return None
+        return (self.upper - self.lower) / (6 * self.stddev)
+
+    @property
+    def cpk(self):
+        "Process capability allowing for centring, min(USL - mean, mean - LSL) / 3 sigma, or None"
+        if self.stddev == 0:
+            return None
+
+        margins = []
+        if self.upper is not None:
+            margins.append(self.upper - self.mean)
+        if self.lower is not None:
+            margins.append(self.mean - self.lower)
+
+        if not margins:
+            return None
+        return min(margins) / (3 * self.stddev)
+
+    @property
+    def drift(self):
+        "Position of the EWMA within the limits: 0 is centred, -1 is at the lower limit and 1 is at the upper limit. None without both limits"
+        if self.ewma is None or self.lower is None or self.upper is None or self.upper == self.lower:
+            return None
+        half_width = (self.upper - self.lower) / 2
+        return (self.ewma - (self.lower + half_width)) / half_width
+
+    @property
+    def yield_rate(self):
+        "Fraction of judged values which passed, or None if none were judged"
+        if self.judged == 0:
+            return None
+        return self.passes / self.judged
+
+def batch_statistics(values, alpha = Series.alpha):
+    "Returns (count, mean, m2, minimum, maximum, ewma) for a list of values, oldest first. Vectorised when NumPy is available"
+    count = len(values)
+    if count == 0:
+        return 0, 0.0, 0.0, None, None, None
+
+    if numpy is not None:
+        data = numpy.asarray(values, dtype = float)
+        mean = float(data.mean())
+        m2 = float(((data - mean) ** 2).sum())
+
+        # The EWMA seeded with the first value is a weighted sum: the first value has weight (1 - a)^(n-1)
+        # and value k (k >= 1) has weight a(1 - a)^(n-1-k).
+        weights = alpha * numpy.power(1 - alpha, numpy.arange(count - 1, -1, -1, dtype = float))
+        weights[0] = (1 - alpha) ** (count - 1)
+        ewma = float((weights * data).sum())
+
+        return count, mean, m2, float(data.min()), float(data.max()), ewma
+
+    series = Series(None, None, alpha)
+    for value in values:
+        series.add(value)
+    return series.count, series.mean, series._m2, series.minimum, series.maximum, series.ewma
+
+class Analytics(object):
+    "Collection of Series keyed by (variant, measurement name). Safe to update from test threads while the GUI reads it."
+
+    def __init__(self, alpha = Series.alpha):
+        self.alpha = alpha
+        self.series = {}
+        self._lock = threading.Lock()
+
+    def _get(self, variant, name):
+        key = (variant, name)
+        if key not in self.series:
+            self.series[key] = Series(variant, name, self.alpha)
+        return self.series[key]
+
+    def update(self, variant, name, value, lower = None, upper = None, passed = None):
+        "Adds a single measurement as it arrives"
+        with self._lock:
+            self._get(variant, name).add(value, lower, upper, passed)
+
+    def backfill(self, store, since = None):
+        "Recomputes every series from the measurements in an ATE.results.ResultsStore, in one batch per series"
+        grouped = {}
+        for row in store.measurements(since = since):
+            if row["value"] is not None:
+                grouped.setdefault((row["variant"], row["name"]), []).append(row)
+
+        with self._lock:
+            for (variant, name), rows in grouped.items():
+                series = self._get(variant, name)
+                judged = [row["passed"] for row in rows if row["passed"] is not None]
+                series.merge(*batch_statistics([row["value"] for row in rows], self.alpha), passes = sum(judged), judged = len(judged))
+
+                # Judge against the limits in force for the newest measurement.
+                for row in reversed(rows):
+                    if row["lower"] is not None or row["upper"] is not None:
+                        series.lower = row["lower"]
+                        series.upper = row["upper"]
+                        break
+
+    def summary(self, variant = None):
+        "Returns a list of dictionaries of statistics for each series, optionally only for one variant"
+        with self._lock:
+            return [{
+                "variant": series.variant,
+                "name": series.name,
+                "count": series.count,
+                "mean": series.mean,
+                "stddev": series.stddev,
+                "minimum": series.minimum,
+                "maximum": series.maximum,
+                "lower": series.lower,
+                "upper": series.upper,
+                "cp": series.cp,
+                "cpk": series.cpk,
+                "ewma": series.ewma,
+                "drift": series.drift,
+                "yield": series.yield_rate
+            } for key, series in sorted(self.series.items(), key = lambda item: (str(item[0][0]), str(item[0][1]))) if variant is None or series.variant == variant]
+
+    def format_summary(self, variant = None):
+        "Returns the summary as a fixed width text table"
+        def fmt(value, places = 3):
+            if value is None:
+                return "-"
+            return "%.*f" % (places, value)
+
+        lines = ["{:<15} {:<5} {:>5} {:>7} {:>7} {:>6} {:>6} {:>7} {:>6} {:>6}".format("Variant", "Name", "N", "Mean", "StdDev", "Cp", "Cpk", "EWMA", "Drift", "Yield")]
+        for row in self.summary(variant):
+            lines.append("{:<15} {:<5} {:>5} {:>7} {:>7} {:>6} {:>6} {:>7} {:>6} {:>6}".format(
+                str(row["variant"]), str(row["name"]), row["count"], fmt(row["mean"]), fmt(row["stddev"]), fmt(row["cp"], 2), fmt(row["cpk"], 2),
+                fmt(row["ewma"]), fmt(row["drift"], 2), fmt(row["yield"] * 100 if row["yield"] is not None else None, 1)))
+
+        return "\n".join(lines)
@@ -0,0 +1,163 @@
+"""
+Triggered capture of analogue channels, for measuring how quickly rails come up and in what order.
+
+A Capture converts its channels in turn for a fixed window after a trigger: an output it sets, or an input edge it
+waits for. Each conversion's time (seconds after the trigger) and voltage go into buffers allocated before the
+trigger, so nothing is allocated while sampling. The Trace for each channel then gives rise time, overshoot and
+when a threshold was first crossed.
+
+At the 12 bit rate the ADC converts about 240 times a second, shared between the channels captured, so capture
+only the channels the measurement needs.
+"""
+
+from array import array
+from time import perf_counter
+
+from ATE import adc
+from ATE import digio
+from ATE import datalog
+from ATE import instrument
+
+class Trace(object):
+    "Samples of one channel from a capture: times in seconds after the trigger and voltages"
+
+    # Volts the final voltage must differ from the initial one by for the trace to have a rise time.
+    minimum_step = 0.1
+
+    def __init__(self, name, times, values):
+        self.name = name
+        self.times = times
+        self.values = values
+
+    def __len__(self):
+        return len(self.values)
+
+    def initial(self):
+        "Voltage before the trigger, or the first sample if none were taken before it"
+        before = [value for time, value in zip(self.times, self.values) if time < 0]
+        return sum(before) / len(before) if before else self.values[0]
+
+    def final(self, fraction = 0.1):
+        "Settled voltage: the mean of the last fraction of the samples"
+        count = max(1, int(len(self.values) * fraction))
+        return sum(self.values[-count:]) / count
+
+    def crossing(self, threshold, rising = True):
+        "Seconds after the trigger the voltage first reached threshold, interpolated between samples, or None if it didn't"
+        previous_time = previous_value = None
+        for time, value in zip(self.times, self.values):
+            if (value >= threshold) if rising else (value <= threshold):
+                if previous_value is None or time <= 0 or value == previous_value:
+                    return max(time, 0.0)
+                return previous_time + (threshold - previous_value) * (time - previous_time) / (value - previous_value)
+            previous_time, previous_value = time, value
+        return None
+
+    def rise_time(self, low = 0.1, high = 0.9):
+        "Seconds taken to go from low to high fractions of the way from the initial to the final voltage, or None if it didn't step by minimum_step or cross them"
+        start, end = self.initial(), self.final()
+        if abs(end - start) < self.minimum_step:
+            return None
+        rising = end >= start
+        low_time = self.crossing(start + (end - start) * low, rising)
+        high_time = self.crossing(start + (end - start) * high, rising)
+        if low_time is None or high_time is None:
+            return None
+        return high_time - low_time
+
+    def overshoot(self):
+        "Fraction by which the voltage went past its final value in the direction of the step, 0 if it didn't"
+        start, end = self.initial(), self.final()
+        if end == start:
+            return 0.0
+        peak = max(self.values) if end > start else min(self.values)
+        return max(0.0, (peak - end) / (end - start))
+
+class Capture(object):
+    "Samples the named channels (e.g. AD1) for window seconds after a trigger"
+
+    # Maximum conversions per channel. The ADC can't fill more than about 240 a second between all the channels.
+    max_samples = 512
+
+    # Seconds sampled before the trigger, giving each trace its initial voltage.
+    pretrigger = 0.02
+
+    def __init__(self, channels, window = 0.25):
+        self.names = list(channels)
+        self.window = window
+        self.traces = {}
+
+    @instrument.timed("Capture.fire", category = "capture")
+    def fire(self, pin, high = True):
+        "Sets output pin high (or low) and captures. Returns {name: Trace}"
+        def trigger():
+            if high:
+                digio.set_high(pin)
+            else:
+                digio.set_low(pin)
+            return True
+        return self._capture(trigger)
+
+    @instrument.timed("Capture.on_edge", category = "capture")
+    def on_edge(self, pin, high = True, timeout = 1.0):
+        "Waits up to timeout seconds for input pin to read high (or low) and captures. Returns {name: Trace}, or None if it didn't"
+        def trigger():
+            deadline = perf_counter() + timeout
+            while perf_counter() < deadline:
+                if bool(digio.read(pin)) == high:
+                    return True
+            return False
+        return self._capture(trigger)
+
+    def _capture(self, trigger):
+        channels = [adc.get_channel(name) for name in self.names]
+        count = len(channels)
+        times = [array("d", bytes(8 * self.max_samples)) for channel in channels]
+        values = [array("d", bytes(8 * self.max_samples)) for channel in channels]
+        filled = [0] * count
+
+        def sample(index):
+            before = perf_counter()
+            voltage = channels[index].convert(locked = True)
+            times[index][filled[index]] = (before + perf_counter()) / 2
+            values[index][filled[index]] = voltage
+            filled[index] += 1
+
+        # The bus is held for the whole capture so the acquisition thread and other fixtures can't take conversions
+        # out of the window and leave gaps in the traces.
+        with adc.bus_lock:
+            # Sample before the trigger so each trace starts from the voltage it was at, using at most a quarter of the buffers.
+            index = 0
+            start = perf_counter()
+            while (perf_counter() - start < self.pretrigger and filled[-1] < self.max_samples // 4) or index % count:
+                sample(index % count)
+                index += 1
+
+            if not trigger():
+                return None
+            triggered = perf_counter()
+
+            index = 0
+            while perf_counter() - triggered < self.window and filled[index] < self.max_samples:
+                sample(index)
+                index = (index + 1) % count
+
+        self.traces = {}
+        for position, name in enumerate(self.names):
+            relative = array("d", (time - triggered for time in times[position][:filled[position]]))
+            self.traces[name] = Trace(name, relative, values[position][:filled[position]])
+            datalog.log("capture", name, len(self.traces[name]))
+        return self.traces
+
+    def order(self, thresholds):
+        "Returns [(name, seconds)] of the channels in the order they reached their thresholds ({name: volts}). Channels which didn't are left out"
+        times = [(name, self.traces[name].crossing(threshold)) for name, threshold in thresholds.items()]
+        return sorted([(name, time) for name, time in times if time is not None], key = lambda item: item[1])
+
+    def delay(self, first, second, thresholds):
+        "Seconds between channel first and channel second reaching their thresholds, or None if either didn't"
+        first_time = self.traces[first].crossing(thresholds[first])
+        second_time = self.traces[second].crossing(thresholds[second])
+        if first_time is None or second_time is None:
+            return None
+        return second_time - first_time
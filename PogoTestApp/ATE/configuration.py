@@ -0,0 +1,182 @@
+"Cached, validated suite and limits configuration from tests.ini and limits.ini, reloaded when either file changes"
+
+import os
+import configparser
+
+from ATE import registry as test_registry
+
+class ConfigError(ValueError):
+    "Raised when tests.ini or the limits file is invalid. The message lists every problem found."
+    pass
+
+class SuiteConfig(object):
+    "One suite from tests.ini: its index, name, product variant, test procedure names and measurement limits"
+
+    def __init__(self, index, name, tests, limits = None, registry = None):
+        self.index = str(index)
+        self.name = name
+        self.tests = list(tests)
+        self.limits = limits or {}
+        self.registry = registry or test_registry.default
+
+    @property
+    def variant(self):
+        "Part number of the product variant, from the start of the suite name"
+        return self.name.split()[0]
+
+    def test_classes(self):
+        "Returns the TestProcedure classes for the suite's tests, in order. Only the modules defining them are imported"
+        return [self.registry.resolve(name) for name in self.tests]
+
+def suite_from_parser(config, index, limits = None, registry = None):
+    "Returns the SuiteConfig for index from a ConfigParser of tests.ini. limits is an optional ConfigParser of the limits file"
+    name = config["suites"][str(index)]
+    section = "suite%d" % int(index)
+    tests = list(config[section].values()) if config.has_section(section) else []
+    return SuiteConfig(index, name, tests, parse_limits(limits, name.split()[0]) if limits is not None else None, registry)
+
+def plugin_modules(config):
+    "Returns the module names listed in the [plugins] modules key of a ConfigParser of tests.ini"
+    return config.get("plugins", "modules", fallback = "").replace(",", " ").split()
+
+def parse_limits(limits, variant):
+    "Returns {measurement: (lower, upper)} for variant from a ConfigParser of the limits file. A section named after the variant overrides [default]"
+    result = {}
+    for section in ("default", variant):
+        if limits.has_section(section):
+            for name, value in limits[section].items():
+                lower, upper = [float(part) for part in value.split(",")]
+                result[name] = (lower, upper)
+    return result
+
+class ConfigService(object):
+    """
+    Parses tests.ini and the limits file into SuiteConfig objects once and keeps them until either file changes.
+    Call reload() periodically to pick up edits; it only checks the files' modification times unless they have changed.
+    An invalid edit raises ConfigError and the previous configuration stays in use.
+    """
+
+    def __init__(self, tests_path = "tests.ini", limits_path = "limits.ini", manifest_path = None):
+        self.tests_path = tests_path
+        self.limits_path = limits_path
+
+        # Cache of which module defines each test procedure, next to tests.ini unless given.
+        self.manifest_path = manifest_path or os.path.splitext(tests_path)[0] + ".manifest.json"
+        self.registry = None
+
+        # Incremented every time a changed configuration is loaded.
+        self.generation = 0
+
+        self.suites = {}
+        self.selected = None
+        self._stamps = None
+
+        self.reload()
+
+    def _stamp(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def reload(self):
+        "Loads the files if they have changed since they were last loaded. Returns True if they were"
+        stamps = (self._stamp(self.tests_path), self._stamp(self.limits_path))
+        if stamps == self._stamps:
+            return False
+
+        suites, selected, registry = self._parse()
+        self.suites = suites
+        self.registry = registry
+        self.selected = selected
+        self._stamps = stamps
+        self.generation += 1
+        return True
+
+    def _parse(self):
+        errors = []
+
+        config = configparser.ConfigParser()
+        if not config.read(self.tests_path):
+            raise ConfigError("%s could not be read" % self.tests_path)
+
+        # Measurement names are case sensitive.
+        limits = configparser.ConfigParser()
+        limits.optionxform = str
+        try:
+            limits.read(self.limits_path)
+        except configparser.Error as e:
+            raise ConfigError("%s: %s" % (self.limits_path, e))
+
+        for section in limits.sections():
+            for name, value in limits[section].items():
+                try:
+                    lower, upper = [float(part) for part in value.split(",")]
+                except ValueError:
+                    errors.append("%s [%s] %s: expected lower, upper but found '%s'" % (self.limits_path, section, name, value))
+                    continue
+                if lower > upper:
+                    errors.append("%s [%s] %s: lower limit %s is above upper limit %s" % (self.limits_path, section, name, lower, upper))
+
+        if not config.has_section("suites"):
+            raise ConfigError("%s has no [suites] section" % self.tests_path)
+
+        registry = test_registry.Registry(["ATE.tests"] + plugin_modules(config), self.manifest_path)
+        try:
+            registry.locations()
+        except Exception as e:
+            raise ConfigError("%s [plugins]: %s" % (self.tests_path, e))
+
+        suites = {}
+        for index, name in config["suites"].items():
+            if not index.isdigit():
+                errors.append("%s [suites]: index '%s' is not a number" % (self.tests_path, index))
+                continue
+            if not name.strip():
+                errors.append("%s [suites] %s: no name" % (self.tests_path, index))
+                continue
+
+            suite = suite_from_parser(config, index, registry = registry)
+            for test in suite.tests:
+                if test not in registry:
+                    errors.append("%s [suite%s]: %s is not a test procedure" % (self.tests_path, index, test))
+            suites[index] = suite
+
+        if errors:
+            raise ConfigError("\n".join(errors))
+
+        for suite in suites.values():
+            suite.limits = parse_limits(limits, suite.variant)
+
+        selected = config.get("settings", "selected_suite", fallback = None)
+        if selected not in suites:
+            selected = min(suites, key = int) if suites else None
+
+        return suites, selected, registry
+
+    def suite(self, index = None):
+        "Returns the SuiteConfig for index, or the selected suite"
+        return self.suites[str(index if index is not None else self.selected)]
+
+    def names(self):
+        "Returns [(index, name)] of every suite in index order"
+        return [(index, self.suites[index].name) for index in sorted(self.suites, key = int)]
+
+    def select(self, index):
+        "Makes index the selected suite and saves it to tests.ini so it is selected the next time the application starts"
+        index = str(index)
+        if index not in self.suites:
+            raise ConfigError("There is no suite %s" % index)
+
+        config = configparser.ConfigParser()
+        config.read(self.tests_path)
+        if not config.has_section("settings"):
+            config.add_section("settings")
+        config["settings"]["selected_suite"] = index
+        with open(self.tests_path, "w") as f:
+            config.write(f)
+
+        # Our own write isn't a change to reload.
+        self.selected = index
+        self._stamps = (self._stamp(self.tests_path), self._stamps[1])
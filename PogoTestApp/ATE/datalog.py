@@ -0,0 +1,149 @@
+"Non-blocking per-measurement trace log"
+
+import os
+import gzip
+import json
+import shutil
+import threading
+import queue
+import time
+
+# The logger in use. When None (the default) log() returns immediately.
+active = None
+
+def log(kind, name, value = None, detail = None):
+    "Queues a record on the active logger, if there is one. Never blocks in the default drop mode"
+    if active is not None:
+        active.record(kind, name, value, detail)
+
+class DataLogger(object):
+    "Puts compact records on a bounded queue. A background thread writes them in batches to rotating CSV or JSONL files."
+
+    # Names of the fields in each record, in order.
+    fields = ("timestamp", "thread", "kind", "name", "value", "detail")
+
+    # Maximum number of records written per batch before the file is flushed.
+    batch_size = 500
+
+    def __init__(self, path = "measurements.csv", max_bytes = 10 * 1024 * 1024, backups = 5, compress = False, queue_size = 10000, block_timeout = None):
+        """
+        path: file to write. A .jsonl extension writes JSON lines, anything else writes CSV.
+        max_bytes: the file is rotated to path.1, path.2 etc. when it grows beyond this size.
+        backups: number of rotated files kept.
+        compress: gzip rotated files.
+        queue_size: maximum number of records waiting to be written.
+        block_timeout: None to drop records when the queue is full (counted in dropped), or seconds to wait for space.
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.compress = compress
+        self.block_timeout = block_timeout
+        self.jsonl = path.endswith(".jsonl")
+
+        self.dropped = 0
+        self.written = 0
+
+        # Records are dropped on the callers' threads, so the count is updated under a lock.
+        self._dropped_lock = threading.Lock()
+
+        self._queue = queue.Queue(queue_size)
+        self._file = None
+        self._writer = threading.Thread(target = self._write_loop, name = "DataLogger", daemon = True)
+        self._writer.start()
+
+    def record(self, kind, name, value = None, detail = None):
+        "Queues a record. If the queue is full the record is dropped (or waits block_timeout seconds) rather than stalling the caller"
+        item = (time.time(), threading.get_ident(), kind, name, value, detail)
+        try:
+            if self.block_timeout is None:
+                self._queue.put_nowait(item)
+            else:
+                self._queue.put(item, timeout = self.block_timeout)
+        except queue.Full:
+            with self._dropped_lock:
+                self.dropped += 1
+
+    def flush(self):
+        "Blocks until every queued record has been written"
+        self._queue.join()
+
+    def close(self):
+        "Writes outstanding records and stops the writer thread"
+        if self._writer.is_alive():
+            self._queue.put(None)
+            self._writer.join()
+
+    def _open(self):
+        new = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        self._file = open(self.path, "a", newline = "")
+        if new and not self.jsonl:
+            self._file.write(",".join(self.fields) + "\r\n")
+
+    def _format(self, item):
+        if self.jsonl:
+            return json.dumps(dict(zip(self.fields, item))) + "\n"
+
+        def csv_field(value):
+            if value is None:
+                return ""
+            value = str(value)
+            if any(c in value for c in ",\"\r\n"):
+                return "\"" + value.replace("\"", "\"\"") + "\""
+            return value
+
+        return ",".join(csv_field(value) for value in item) + "\r\n"
+
+    def _rotate(self):
+        "Shifts path.N to path.N+1, dropping the oldest, and moves the current file to path.1"
+        self._file.close()
+        suffix = ".gz" if self.compress else ""
+
+        for index in range(self.backups - 1, 0, -1):
+            source = "%s.%d%s" % (self.path, index, suffix)
+            if os.path.exists(source):
+                os.replace(source, "%s.%d%s" % (self.path, index + 1, suffix))
+
+        if self.compress:
+            with open(self.path, "rb") as source, gzip.open(self.path + ".1.gz", "wb") as destination:
+                shutil.copyfileobj(source, destination)
+            os.remove(self.path)
+        else:
+            os.replace(self.path, self.path + ".1")
+
+        self._open()
+
+    def _write_loop(self):
+        "Writer thread. Waits for a record then writes everything else already queued with it in one go."
+        self._open()
+        running = True
+
+        while running:
+            batch = [self._queue.get()]
+            try:
+                while len(batch) < self.batch_size:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+
+            # Look for close()'s None before writing, so a failed write earlier in the batch can't hide it.
+            running = None not in batch
+
+            try:
+                for item in batch:
+                    if item is None:
+                        continue
+                    self._file.write(self._format(item))
+                    self.written += 1
+
+                self._file.flush()
+
+                if self._file.tell() >= self.max_bytes:
+                    self._rotate()
+            except (OSError, ValueError) as e:
+                print("Data logger write failed: %s" % e)
+            finally:
+                for item in batch:
+                    self._queue.task_done()
+
+        self._file.close()
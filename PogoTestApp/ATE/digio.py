@@ -3,6 +3,8 @@
 import time as time
 import atexit
 from ATE.const import *
+from ATE import datalog
+from ATE import instrument
 
 # Attempt to load the Raspberry Pi's GPIO module.
 # If this fails, we fall back to a dummy version which doesn't actually do anything.
@@ -13,6 +15,7 @@ except ImportError:
     print("GPIO libraries could not be loaded. NO HARDWARE INTERACTION WILL TAKE PLACE.")
     import RPiDummy.GPIODummy as GPIO
 
+@instrument.timed("digio.setup")
 def setup():
     "Set the GPIO pins to how we want them for the application"
     GPIO.setmode(GPIO.BCM)
@@ -66,23 +69,40 @@ def cleanup():
     "Clean up any of the configuation we've done to the pins"
     GPIO.cleanup()
 
+@instrument.timed("digio.set_input")
 def set_input(pin, pull_up_down = GPIO.PUD_OFF):
     GPIO.setup(pin, GPIO.IN, pull_up_down)
 
+@instrument.timed("digio.set_output")
 def set_output(pin):
     GPIO.setup(pin, GPIO.OUT)
 
+@instrument.timed("digio.set_high")
 def set_high(pin):
     "Set the specified pin to high or on"
     GPIO.output(pin, GPIO.HIGH)
+    datalog.log("set", pin, 1)
 
+@instrument.timed("digio.set_low")
 def set_low(pin):
     "Set the specified pin to low or off"
     GPIO.output(pin, GPIO.LOW)
+    datalog.log("set", pin, 0)
 
+@instrument.timed("digio.write")
+def write(states):
+    "Sets each pin in states ({pin: level}) with as little time between them as possible"
+    for pin, level in states.items():
+        GPIO.output(pin, GPIO.HIGH if level else GPIO.LOW)
+    for pin, level in states.items():
+        datalog.log("set", pin, 1 if level else 0)
+
+@instrument.timed("digio.read")
 def read(pin):
     "Returns True if the pin is high or False if the pin is low"
-    return GPIO.input(pin)
+    value = GPIO.input(pin)
+    datalog.log("read", pin, value)
+    return value
 
 def await_high(pin, timeout = 10):
     "Waits timeout seconds for pin to go high. Returns True if pin did go high, or False if timeout reached"
@@ -0,0 +1,118 @@
+"""
+Oversampling and digital filtering of analogue readings, for channels whose limits are narrow compared to their noise.
+
+A Pipeline takes a block of conversions from a channel, passes it through its stages in order and returns the mean
+of what is left, so a Pipeline with no stages simply oversamples and decimates. Stages take a block of values and
+return a block:
+
+    Median(n)           median of each n sample window, removing spikes
+    MovingAverage(n)    mean of each n sample window
+    LowPass(alpha)      first order IIR low-pass seeded with the first sample, reduced to its final output
+
+Blocks are NumPy arrays when NumPy is installed and lists otherwise.
+"""
+
+# NumPy is optional. It is only used to filter each block in one operation rather than sample by sample.
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+def _median(values):
+    ordered = sorted(values)
+    middle = len(ordered) // 2
+    if len(ordered) % 2:
+        return ordered[middle]
+    return (ordered[middle - 1] + ordered[middle]) / 2.0
+
+def _windows(block, size):
+    "Returns a 2D array of every size sample window of block"
+    if hasattr(numpy.lib, "stride_tricks") and hasattr(numpy.lib.stride_tricks, "sliding_window_view"):
+        return numpy.lib.stride_tricks.sliding_window_view(block, size)
+    return numpy.stack([block[index:len(block) - size + index + 1] for index in range(size)], axis = 1)
+
+class Median(object):
+    "Median of each window of size samples. Blocks shorter than size give the median of the whole block"
+
+    def __init__(self, size = 5):
+        self.size = size
+
+    def apply(self, block):
+        size = min(self.size, len(block))
+        if numpy is not None:
+            return numpy.median(_windows(numpy.asarray(block, dtype = float), size), axis = 1)
+        return [_median(block[index:index + size]) for index in range(len(block) - size + 1)]
+
+    def __repr__(self):
+        return "Median(%d)" % self.size
+
+class MovingAverage(object):
+    "Mean of each window of size samples. Blocks shorter than size give the mean of the whole block"
+
+    def __init__(self, size = 4):
+        self.size = size
+
+    def apply(self, block):
+        size = min(self.size, len(block))
+        if numpy is not None:
+            sums = numpy.cumsum(numpy.concatenate(([0.0], numpy.asarray(block, dtype = float))))
+            return (sums[size:] - sums[:-size]) / size
+        return [float(sum(block[index:index + size])) / size for index in range(len(block) - size + 1)]
+
+    def __repr__(self):
+        return "MovingAverage(%d)" % self.size
+
+class LowPass(object):
+    "First order IIR low-pass, y = alpha * x + (1 - alpha) * y, seeded with the first sample. Returns its final output"
+
+    def __init__(self, alpha = 0.25):
+        if not 0.0 < alpha <= 1.0:
+            raise ValueError("alpha must be above 0 and at most 1")
+        self.alpha = alpha
+
+    def apply(self, block):
+        count = len(block)
+        if numpy is not None:
+            # The output after the last sample is a weighted sum: the first sample has weight (1 - a)^(n-1)
+            # and sample k (k >= 1) has weight a(1 - a)^(n-1-k).
+            weights = self.alpha * numpy.power(1 - self.alpha, numpy.arange(count - 1, -1, -1, dtype = float))
+            weights[0] = (1 - self.alpha) ** (count - 1)
+            return numpy.array([(weights * numpy.asarray(block, dtype = float)).sum()])
+
+        output = block[0]
+        for value in block[1:]:
+            output = self.alpha * value + (1 - self.alpha) * output
+        return [output]
+
+    def __repr__(self):
+        return "LowPass(%g)" % self.alpha
+
+class Pipeline(object):
+    "Reads samples conversions, applies each stage to them in turn and returns the mean of the result"
+
+    def __init__(self, samples = 1, stages = ()):
+        if samples < 1:
+            raise ValueError("samples must be at least 1")
+        self.samples = samples
+        self.stages = list(stages)
+
+    def filter(self, block):
+        "Returns the filtered value of a block of readings"
+        for stage in self.stages:
+            block = stage.apply(block)
+        if numpy is not None:
+            return float(numpy.mean(block))
+        return float(sum(block)) / len(block)
+
+    def run(self, convert):
+        "Calls convert() samples times and returns the filtered value of the readings"
+        if numpy is not None:
+            block = numpy.empty(self.samples)
+            for index in range(self.samples):
+                block[index] = convert()
+        else:
+            block = [convert() for index in range(self.samples)]
+        return self.filter(block)
+
+    def __repr__(self):
+        return "Pipeline(%d, %r)" % (self.samples, self.stages)
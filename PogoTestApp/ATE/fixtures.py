@@ -0,0 +1,135 @@
+"""
+Support for running two or more fixtures from one controller, so one board's automated stages run while the
+operator loads or sets up the board in another fixture.
+
+Each fixture has its own TestSuite with its fixture name set. The suites' test threads share the ADC through
+FairLock, which hands the bus to the fixtures in turn rather than to whichever thread asks first, so a fixture
+reading a long filtered block can't hold the other off. A Station tracks which fixtures are waiting for the
+operator and tells its listeners which one to attend to next.
+
+Until the digital I/O and analogue channels are mapped per fixture this is only exercised by the unit tests and by
+Headless.py run --fixtures in simulation. The GUI runs a single fixture without a Station.
+"""
+
+import time
+import threading
+from collections import deque
+
+_local = threading.local()
+
+def set_current(name):
+    "Sets the fixture the calling thread works for"
+    _local.fixture = name
+
+def current():
+    "Returns the fixture the calling thread works for, or None"
+    return getattr(_local, "fixture", None)
+
+class FairLock(object):
+    """
+    Lock granted to fixtures in turn. Threads of the same fixture (or of none) are granted in the order they asked.
+    With one fixture it behaves like threading.Lock with first come, first served ordering.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition(threading.Lock())
+        self._held = False
+        self._waiting = {}
+        self._owners = []
+        self._last = None
+        self._granted = None
+
+        # Number of times each fixture has been granted the lock.
+        self.grants = {}
+
+    def acquire(self):
+        owner = current()
+        with self._condition:
+            if owner not in self.grants:
+                self.grants[owner] = 0
+                self._owners.append(owner)
+
+            if not self._held:
+                self._held = True
+                self._grant(owner)
+                return True
+
+            ticket = object()
+            self._waiting.setdefault(owner, deque()).append(ticket)
+            while self._granted is not ticket:
+                self._condition.wait()
+            self._granted = None
+            return True
+
+    def release(self):
+        with self._condition:
+            if not self._held:
+                raise RuntimeError("release unlocked lock")
+
+            # The next fixture after the last holder with a thread waiting gets the lock.
+            count = len(self._owners)
+            start = self._owners.index(self._last) + 1 if self._last in self._owners else 0
+            for offset in range(count):
+                owner = self._owners[(start + offset) % count]
+                queue = self._waiting.get(owner)
+                if queue:
+                    self._granted = queue.popleft()
+                    self._grant(owner)
+                    self._condition.notify_all()
+                    return
+
+            self._held = False
+
+    def _grant(self, owner):
+        self._last = owner
+        self.grants[owner] += 1
+
+    def locked(self):
+        return self._held
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+class Station(object):
+    """
+    Tracks what each fixture is doing: "idle" (waiting for a board), "manual" (waiting for the operator) or
+    "automatic" (running on its own). The fixture which has waited longest for the operator is the one to attend.
+    """
+
+    def __init__(self):
+        self.states = {}
+        self._lock = threading.Lock()
+        self._attention = None
+
+        # Functions called with the fixture to attend to (or None) whenever it changes.
+        self.listeners = []
+
+    def update(self, fixture, state):
+        "Records fixture's state and notifies the listeners if the fixture to attend to has changed"
+        with self._lock:
+            previous = self.states.get(fixture)
+            if previous is None or previous[0] != state:
+                self.states[fixture] = (state, time.monotonic())
+
+            attention = self._choose()
+            changed = attention != self._attention
+            self._attention = attention
+
+        if changed:
+            for listener in self.listeners:
+                listener(attention)
+
+    def _choose(self):
+        waiting = [(since, fixture) for fixture, (state, since) in self.states.items() if state in ("manual", "idle")]
+        if not waiting:
+            return None
+        return min(waiting, key = lambda item: item[0])[1]
+
+    def attention(self):
+        "Returns the fixture which has waited longest for the operator, or None if every fixture is running"
+        with self._lock:
+            return self._choose()
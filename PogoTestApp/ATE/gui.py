@@ -1,21 +1,74 @@
 import tkinter as tk
 import tkinter.constants as tkc
 from tkinter import messagebox
+from tkinter import simpledialog
 from tkinter.messagebox import WARNING, ABORTRETRYIGNORE
 from ATE.const import *
+from ATE import instrument
+from ATE import trend
 import os
 import os.path
 import sys
+import time
+import queue
+import threading
 import configparser
+import collections
 #import tkmessagebox
 
+class ImageCache(object):
+    "Decodes each image file once and keeps the most recently used ones, evicting the least recently used when full."
+
+    def __init__(self, capacity = 16, loader = None):
+        self.capacity = capacity
+        self._loader = loader or (lambda path: tk.PhotoImage(file = path))
+        self._images = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._images)
+
+    def get(self, path):
+        "Returns the decoded image for path, or None if the file doesn't exist"
+        if path in self._images:
+            self._images.move_to_end(path)
+            return self._images[path]
+
+        if not os.path.exists(path):
+            return None
+
+        image = self._loader(path)
+        self._images[path] = image
+        if len(self._images) > self.capacity:
+            self._images.popitem(last = False)
+        return image
+
+    def preload(self, paths):
+        "Decodes each image in paths ahead of its first use"
+        for path in paths:
+            if self.get(path) is None:
+                print("Image file ""%s"" not found" % path)
+
+
 class MainForm(tk.Frame):
     
     reset_action = None
     abort_action = None
+    stats_action = None
+    suite_action = None
     selected_suite_index = None
 
     _reading_rows = None
+    _displayed_readings = None
+    _pending_readings = None
+
+    # Analogue channels shown on the trend panel, and how many samples of history each keeps.
+    trend_channels = ["AD1", "AD2", "AD3", "AD4", "AD5", "AD6", "AD7", "AD8"]
+    trend_history = 3600
+    trend_panel = None
+
+    # The information box keeps at most this many lines, discarding the oldest.
+    info_max_lines = 500
+    _info_lines = 0
     _stage_template = "Test Stage: {description}"
     _counting = False
     _count = 0
@@ -30,6 +83,8 @@ class MainForm(tk.Frame):
         master.title("X231 PCB Tester")
 
         self.root = master
+        self.images = ImageCache()
+        self.histories = dict((key, trend.History(self.trend_history)) for key in self.trend_channels)
         self.pack()
         self.create_widgets()
 
@@ -57,6 +112,9 @@ class MainForm(tk.Frame):
         self.popup = tk.Menu(self.root, tearoff = 0)
         self.popup.add_command(label = "RESET", command = self.handle_reset)
         self.popup.add_command(label = "ABORT", command = self.handle_abort)
+        self.popup.add_command(label = "STATS", command = self.handle_stats)
+        self.popup.add_command(label = "TRENDS", command = self.handle_trends)
+        self.popup.add_command(label = "SUITE", command = self.handle_suite)
         self.popup.add_separator()
         self.popup.add_command(label = "OFF", command = self.handle_shutdown)
         self.popup["font"] = btn_font
@@ -90,7 +148,7 @@ class MainForm(tk.Frame):
 
         # Member of info container
         self.info_label = tk.Text(info_container)
-        self.info_label.images = []
+        self.info_label.images = {}
         #self.info_label["text"] = "Ready. Press RESET to begin tests."
         self.info_label["bg"] = "white"
         self.info_label["fg"] = "black"
@@ -248,32 +306,46 @@ class MainForm(tk.Frame):
 
     def set_text(self, text):
         "Sets the information text to the specified string"
-        self.info_label.images = []
+        self.info_label.images = {}
         self.info_label["state"] = tkc.NORMAL
         self.info_label.delete(0.0, tkc.END)
         self.info_label.insert(tkc.END, text)
         self.info_label["state"] = tkc.DISABLED
-        self.update()
+        self._info_lines = text.count("\n") + 1
+        self._trim_info()
 
     def append_text_line(self, text):
         "Appends the specified text to the existing information string"
         self.info_label["state"] = tkc.NORMAL
         self.info_label.insert(tkc.END, "\n" + text)
         self.info_label["state"] = tkc.DISABLED
-        self.update()
+        self._info_lines += text.count("\n") + 1
+        self._trim_info()
 
     def append_image(self, path):
         "Takes a path to a gif image and appends it on a new line to the info box."
-        if os.path.exists(path):
-            img = tk.PhotoImage(file = path)
-            self.info_label.images.append(img)
+        img = self.images.get(path)
+        if img is not None:
+            # Keep a reference while the image is shown, in case the cache evicts it.
+            self.info_label.images[path] = img
             self.info_label["state"] = tkc.NORMAL
             self.info_label.insert(tkc.END, "\n")
-            self.info_label.image_create(tkc.END, image = self.info_label.images[len(self.info_label.images) -1])
+            self.info_label.image_create(tkc.END, image = img)
             self.info_label["state"] = tkc.DISABLED
+            self._info_lines += 1
+            self._trim_info()
         else:
             print("Image file ""%s"" not found" % path)
 
+    def _trim_info(self):
+        "Deletes the oldest lines of the information box beyond info_max_lines"
+        excess = self._info_lines - self.info_max_lines
+        if excess > 0:
+            self.info_label["state"] = tkc.NORMAL
+            self.info_label.delete("1.0", "%d.0" % (excess + 1))
+            self.info_label["state"] = tkc.DISABLED
+            self._info_lines = self.info_max_lines
+
     def update_current_test(self, test):
         "Updates the test stage label with the details of the current test"
         self.test_stage["text"] = self._stage_template.format(description = test.description)
@@ -346,13 +418,67 @@ class MainForm(tk.Frame):
         "Asks the user if they want to abort testing and reset the ATE"
         return messagebox.askyesno("ABORT", "Do you want to abort testing? This will finish the test session and show the summary.", icon = WARNING)
 
+    def resume_dialogue(self, serial, description):
+        "Asks the user if they want to resume an interrupted run of board serial at the step described"
+        return messagebox.askyesno("RESUME", "Testing of board {} was interrupted.\n\nDo you want to resume at \"{}\"? Make sure the same board is in the jig.".format(serial or "(no serial)", description), icon = WARNING)
+
+    def serial_dialogue(self):
+        "Asks the user for the serial number of the board about to be tested. Returns None if cancelled"
+        return simpledialog.askstring("Board Serial", "Scan or enter the serial number of the board under test.", parent = self.root)
+
     def set_reading_value(self, key, value):
         self._reading_rows[key]["value"].set(value)
 
-    def update_readings(self, voltages):
+        # Forget what was displayed so the next update shows the reading again.
+        if self._displayed_readings is not None:
+            self._displayed_readings.pop(key, None)
 
-        for reading in voltages.items():
-            self.set_reading_value(reading[0], reading[1])
+    @instrument.timed("MainForm.update_readings", category = "gui")
+    def update_readings(self, voltages):
+        "Sets the readings which have changed since they were last displayed"
+        if self._displayed_readings is None:
+            self._displayed_readings = {}
+
+        for key, value in voltages.items():
+            if self._displayed_readings.get(key) != value:
+                self._displayed_readings[key] = value
+                self._reading_rows[key]["value"].set(value)
+
+    def watch_readings(self, snapshots, interval = 100):
+        "Checks the queue of reading snapshots every interval ms. New readings are applied together in one idle callback"
+        latest = None
+        try:
+            while True:
+                latest = snapshots.get_nowait()
+        except queue.Empty:
+            pass
+
+        if latest is not None:
+            self.record_trends(latest)
+
+            if self._pending_readings is None:
+                self._pending_readings = {}
+                self.after_idle(self._apply_pending_readings)
+            self._pending_readings.update(latest)
+
+        self.root.after(interval, self.watch_readings, snapshots, interval)
+
+    def record_trends(self, readings):
+        "Adds analogue readings to their history and to the trend panel if it is open"
+        for key, history in self.histories.items():
+            if isinstance(readings.get(key), float):
+                history.append(readings[key])
+
+        if self.trend_panel is not None:
+            if self.trend_panel.winfo_exists():
+                self.trend_panel.add(readings)
+            else:
+                self.trend_panel = None
+
+    def _apply_pending_readings(self):
+        pending = self._pending_readings
+        self._pending_readings = None
+        self.update_readings(pending)
 
     def handle_abort(self):
         self.abort_action()
@@ -360,6 +486,22 @@ class MainForm(tk.Frame):
     def handle_reset(self):
         self.reset_action()
 
+    def handle_stats(self):
+        if self.stats_action:
+            self.stats_action()
+
+    def handle_suite(self):
+        if self.suite_action:
+            self.suite_action()
+
+    def handle_trends(self):
+        if self.trend_panel is not None and self.trend_panel.winfo_exists():
+            self.trend_panel.lift()
+            return
+
+        names = dict((key, self._reading_rows[key]["name"]) for key in self.trend_channels)
+        self.trend_panel = trend.TrendPanel(self.root, self.histories, self.trend_channels, names)
+
     def handle_menu(self):
         x, y = (self.menu_btn.winfo_rootx(), self.menu_btn.winfo_rooty() - self.popup.winfo_reqheight())
         self.popup.post(x, y)
@@ -374,6 +516,7 @@ class MainForm(tk.Frame):
                     os.system("/sbin/shutdown -h now")
 
 
+    @instrument.timed("MainForm.update_duration", category = "gui")
     def update_duration(self):
 
         if self._counting:
@@ -382,6 +525,11 @@ class MainForm(tk.Frame):
 
         self.root.after(1000, self.update_duration)
 
+    @property
+    def duration(self):
+        "Seconds counted since the duration was reset"
+        return self._count
+
     def reset_duration(self):
         self._count = 0
 
@@ -395,11 +543,264 @@ class MainForm(tk.Frame):
         self._duration_count.set("Test Duration: N/A")
 
 
+class FormProxy(object):
+    """
+    Thread-safe facade for MainForm. Tests call it from their own threads; calls are queued and
+    applied on the Tk thread in one batch per frame. Queued calls made redundant by a later one
+    (e.g. set_text replacing earlier text, or a button enabled then disabled) are dropped.
+    Calls made on the Tk thread itself apply the queue and then run straight away, so dialogues can return their answer.
+    """
+
+    # Milliseconds between batches.
+    frame = 16
+
+    # Group of each coalescing method. A queued call is dropped when a call in a group which replaces its group is queued.
+    _groups = {
+        "set_text": "text",
+        "set_info_pass": "info",
+        "set_info_fail": "info",
+        "set_info_default": "info",
+        "set_stage_text": "stage",
+        "update_current_test": "stage",
+        "enable_pass_button": "pass",
+        "disable_pass_button": "pass",
+        "enable_fail_button": "fail",
+        "disable_fail_button": "fail",
+        "enable_reset_button": "reset",
+        "disable_reset_button": "reset",
+        "enable_abort_button": "abort",
+        "disable_abort_button": "abort"
+    }
+
+    _replaces = {
+        "text": ("text", "append")
+    }
+
+    # Methods which add to the text. They are never dropped for each other, only when set_text replaces the text.
+    _appends = ("append_text_line", "append_image")
+
+    # Methods which are queued as the single-button calls they make, so each button coalesces independently.
+    _composites = {
+        "enable_test_buttons": ("enable_pass_button", "enable_fail_button"),
+        "disable_test_buttons": ("disable_pass_button", "disable_fail_button"),
+        "enable_control_buttons": ("enable_reset_button", "enable_abort_button"),
+        "disable_control_buttons": ("disable_reset_button", "disable_abort_button"),
+        "enable_all_buttons": ("enable_pass_button", "enable_fail_button", "enable_reset_button", "enable_abort_button"),
+        "disable_all_buttons": ("disable_pass_button", "disable_fail_button", "disable_reset_button", "disable_abort_button")
+    }
+
+    def __init__(self, form):
+        # Must be created on the Tk thread.
+        object.__setattr__(self, "_form", form)
+        object.__setattr__(self, "_pending", [])
+        object.__setattr__(self, "_lock", threading.Lock())
+        object.__setattr__(self, "_tk_thread", threading.get_ident())
+        form.root.after(self.frame, self._pump)
+
+    def __getattr__(self, name):
+        attribute = getattr(self._form, name)
+        if not callable(attribute):
+            return attribute
+
+        def call(*args, **kwargs):
+            return self._call(name, args, kwargs)
+        return call
+
+    def __setattr__(self, name, value):
+        setattr(self._form, name, value)
+
+    def update(self):
+        "Redrawing happens once per frame on the Tk thread, so this does nothing when called from elsewhere"
+        if threading.get_ident() == self._tk_thread:
+            self.flush()
+            self._form.update()
+
+    def _call(self, name, args, kwargs):
+        if threading.get_ident() == self._tk_thread:
+            self.flush()
+            return getattr(self._form, name)(*args, **kwargs)
+
+        with self._lock:
+            for method in self._composites.get(name, (name,)):
+                group = self._groups.get(method)
+                if group:
+                    replaced = self._replaces.get(group, (group,))
+                    self._pending[:] = [item for item in self._pending if item[0] not in replaced]
+                elif method in self._appends:
+                    group = "append"
+                self._pending.append((group, method, args, kwargs))
+
+    def flush(self):
+        "Applies every queued call. Only call from the Tk thread"
+        with self._lock:
+            pending = self._pending[:]
+            del self._pending[:]
+
+        for group, method, args, kwargs in pending:
+            getattr(self._form, method)(*args, **kwargs)
+
+    @instrument.timed("FormProxy.flush", category = "gui")
+    def _pump(self):
+        if self._pending:
+            self.flush()
+        self._form.root.after(self.frame, self._pump)
+
+
+class HeadlessForm(object):
+    "Stands in for MainForm when running without a display. Text is optionally echoed to the console and dialogues answer yes."
+
+    reset_action = None
+    abort_action = None
+    stats_action = None
+
+    _count = 0
+
+    def __init__(self, echo = True, serial = None):
+        self.echo = echo
+        self.serial = serial
+        self.text = ""
+        self.stage = ""
+        self.attention = None
+        self.buttons = {}
+        self._started = None
+
+    def _print(self, text):
+        if self.echo:
+            print(text)
+
+    def set_info_pass(self):
+        pass
+
+    def set_info_fail(self):
+        pass
+
+    def set_info_default(self):
+        pass
+
+    def set_text(self, text):
+        self.text = text
+        self._print(text)
+
+    def append_text_line(self, text):
+        self.text += "\n" + text
+        self._print(text)
+
+    def append_image(self, path):
+        pass
+
+    def update_current_test(self, test):
+        self.set_stage_text("Test Stage: {}".format(test.description))
+
+    def set_stage_text(self, text):
+        self.stage = text
+        self._print("== {} ==".format(text))
+
+    def set_attention(self, fixture):
+        self.attention = fixture
+        if fixture is not None:
+            self._print("== Attend to fixture {} ==".format(fixture))
+
+    def _set_buttons(self, state, *names):
+        for name in names:
+            self.buttons[name] = state
+
+    def disable_all_buttons(self):
+        self._set_buttons(False, "pass", "fail", "reset", "abort")
+
+    def enable_all_buttons(self):
+        self._set_buttons(True, "pass", "fail", "reset", "abort")
+
+    def disable_test_buttons(self):
+        self._set_buttons(False, "pass", "fail")
+
+    def enable_test_buttons(self):
+        self._set_buttons(True, "pass", "fail")
+
+    def enable_test_buttons_delay(self, delay = 500):
+        self.enable_test_buttons()
+
+    def disable_control_buttons(self):
+        self._set_buttons(False, "reset", "abort")
+
+    def enable_control_buttons(self):
+        self._set_buttons(True, "reset", "abort")
+
+    def enable_reset_button(self):
+        self._set_buttons(True, "reset")
+
+    def disable_reset_button(self):
+        self._set_buttons(False, "reset")
+
+    def enable_abort_button(self):
+        self._set_buttons(True, "abort")
+
+    def disable_abort_button(self):
+        self._set_buttons(False, "abort")
+
+    def enable_pass_button(self):
+        self._set_buttons(True, "pass")
+
+    def enable_fail_button(self):
+        self._set_buttons(True, "fail")
+
+    def disable_pass_button(self):
+        self._set_buttons(False, "pass")
+
+    def disable_fail_button(self):
+        self._set_buttons(False, "fail")
+
+    def msgbox(self, title, text):
+        self._print("{}: {}".format(title, text))
+
+    def reset_dialogue(self):
+        return True
+
+    def abort_dialogue(self):
+        return True
+
+    def resume_dialogue(self, serial, description):
+        return False
+
+    def serial_dialogue(self):
+        # An unattended run can't be cancelled. Without a serial the board is recorded with an empty one.
+        return self.serial if self.serial is not None else ""
+
+    def set_reading_value(self, key, value):
+        pass
+
+    def update_readings(self, voltages):
+        pass
+
+    def update(self):
+        pass
+
+    @property
+    def duration(self):
+        return self._count
+
+    def reset_duration(self):
+        self._count = 0
+
+    def start_duration_count(self):
+        self._started = time.monotonic()
+
+    def stop_duration_count(self):
+        if self._started is not None:
+            self._count = int(time.monotonic() - self._started)
+            self._started = None
+
+    def clear_duration(self):
+        pass
+
+
 """
-This class is used to specify which suite of tests are to be run. It
-modifies the tests.ini file's [settings] selected_suite key with the chosen index.
-The PogoTestApp program then loads in the config and sets up the tests depending on the
-suite chosen.
+This class is used to specify which suite of tests are to be run. Given the suites as
+(index, name) pairs it leaves saving the choice to the caller, which is how PogoTestApp uses it
+through ATE.configuration. Without them it reads tests.ini itself and modifies the
+[settings] selected_suite key with the chosen index.
+
+With on_select, the form closes and calls on_select with the chosen index instead of ending
+the Tk main loop, so it can be shown over the main form to switch suite between boards.
 
 The classes specified in the ini file must exist (obviously).
 
@@ -415,22 +816,48 @@ class SuiteSelectionForm():
         if len(elm) != 1:
             return
 
-        self.config["settings"]["selected_suite"] = str(elm[0])
-        with open("tests.ini", "w") as configfile:
-            self.config.write(configfile)
+        self.selected = self.suites[elm[0]][0]
+
+        if self.on_select:
+            self.frm.destroy()
+            self.on_select(self.selected)
+            return
+
+        if self._save:
+            self.config["settings"]["selected_suite"] = self.selected
+            with open("tests.ini", "w") as configfile:
+                self.config.write(configfile)
+
+        # Leave a root we were given for the main form to reuse.
+        if self._owns_root:
             self.root.destroy()
+        else:
+            self.frm.destroy()
+        self.root.quit()
+
+    def cancel(self):
+        "Closes the form without changing the selected suite"
+        self.frm.destroy()
+        if not self.on_select:
             self.root.quit()
 
     def loop(self):
         self.root.mainloop()
 
-    def __init__(self):
+    def __init__(self, root = None, suites = None, on_select = None):
         self.config = configparser.ConfigParser()
-        self.root = tk.Tk()
+        self.selected = None
+        self.on_select = on_select
+        self._owns_root = root is None
+        self._save = suites is None
+        self.root = root or tk.Tk()
 
         font = ("Arial", 20)
 
-        self.config.read("tests.ini")
+        if suites is None:
+            self.config.read("tests.ini")
+            suites = list(self.config["suites"].items())
+        self.suites = suites
 
         # Create test suite selection window
         self.frm = tk.Toplevel(self.root)
@@ -447,7 +874,7 @@ class SuiteSelectionForm():
         self.frm.suite_list.pack(fill=tk.BOTH, expand=1)
         self.frm.suite_list.selection_anchor(0)
         
-        for k, v in self.config["suites"].items():
+        for k, v in self.suites:
             self.frm.suite_list.insert(tk.END, v)
 
         self.frm.btn = tk.Button(self.frm, text="BEGIN", command=self.select_suite)
@@ -455,5 +882,6 @@ class SuiteSelectionForm():
         self.frm.btn.pack()
 
         self.frm.wm_attributes("-topmost", 1)
+        self.frm.protocol("WM_DELETE_WINDOW", self.cancel)
 
         
\ No newline at end of file
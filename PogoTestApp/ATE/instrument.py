@@ -0,0 +1,202 @@
+"Low overhead timing histograms and counters for the suite, tests and hardware drivers"
+
+import threading
+from functools import wraps
+from time import perf_counter
+from ATE import trace
+
+# Instrumentation is off by default. While it and ATE.trace are off, timed functions and spans only cost a flag check.
+enabled = False
+
+# Histograms keyed by (category, name) and counters keyed by name.
+histograms = {}
+counters = {}
+
+_lock = threading.Lock()
+
+class Histogram(object):
+    "Durations bucketed by powers of two microseconds, plus count, total, min and max."
+
+    buckets = 40
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.minimum = None
+        self.maximum = 0.0
+        self.bins = [0] * self.buckets
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if self.minimum is None or seconds < self.minimum:
+            self.minimum = seconds
+        if seconds > self.maximum:
+            self.maximum = seconds
+        self.bins[min(int(seconds * 1000000).bit_length(), self.buckets - 1)] += 1
+
+    def percentile(self, fraction):
+        "Returns the upper bound in seconds of the bucket containing the given fraction (0 to 1) of samples"
+        if self.count == 0:
+            return None
+
+        target = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.bins):
+            seen += count
+            if seen >= target:
+                return min((1 << index) / 1000000, self.maximum)
+        return self.maximum
+
+    @property
+    def mean(self):
+        if self.count == 0:
+            return None
+        return self.total / self.count
+
+def reset():
+    "Clears all recorded timings and counters"
+    with _lock:
+        histograms.clear()
+        counters.clear()
+
+def add(name, seconds, category = "driver"):
+    "Adds a duration in seconds to the named histogram"
+    with _lock:
+        key = (category, name)
+        if key not in histograms:
+            histograms[key] = Histogram()
+        histograms[key].add(seconds)
+
+def count(name, amount = 1):
+    "Adds amount to the named counter"
+    with _lock:
+        counters[name] = counters.get(name, 0) + amount
+
+class _Span(object):
+    "Context manager which adds the time spent inside it to a histogram and records it to the trace"
+
+    def __init__(self, name, category):
+        self.name = name
+        self.category = category
+
+    def __enter__(self):
+        self.tracing = trace.enabled
+        if self.tracing:
+            trace.begin(self.name, self.category)
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        duration = perf_counter() - self.start
+        if enabled:
+            add(self.name, duration, self.category)
+        if self.tracing:
+            trace.end(self.name, self.category)
+        return False
+
+class _NullSpan(object):
+    "Shared do-nothing span returned while instrumentation is off"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_null_span = _NullSpan()
+
+def span(name, category = "step"):
+    "Returns a context manager timing its body into the named histogram. Use for suite phases and test steps"
+    if not enabled and not trace.enabled:
+        return _null_span
+    return _Span(name, category)
+
+def timed(name, category = "driver"):
+    "Decorator timing every call of a function into the named histogram. Use for hot driver calls"
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not enabled and not trace.enabled:
+                return function(*args, **kwargs)
+
+            with _Span(name, category):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+class Stopwatch(object):
+    "Records the time between named marks, e.g. to break down startup time. Each interval is also added to the 'startup' histograms"
+
+    def __init__(self, start = None):
+        self.start = start if start is not None else perf_counter()
+        self.last = self.start
+        self.marks = []
+        self.concurrent = []
+
+    def mark(self, name):
+        "Records the time since the previous mark (or the start) against name"
+        now = perf_counter()
+        self.marks.append((name, now - self.last))
+        self.last = now
+        if enabled:
+            add(name, self.marks[-1][1], "startup")
+
+    def record(self, name, seconds):
+        "Records work which ran alongside the marked sequence, e.g. on another thread. It is reported but not counted in the total"
+        self.concurrent.append((name, seconds))
+        if enabled:
+            add(name, seconds, "startup")
+
+    def elapsed(self):
+        "Seconds from the start to the latest mark"
+        return self.last - self.start
+
+    def report(self, exclude = ()):
+        "Returns a one line breakdown of the marks. Marks named in exclude (e.g. waiting for the operator) are listed but left out of the total"
+        total = sum(seconds for name, seconds in self.marks if name not in exclude)
+        parts = ["{} {:.3f}s".format(name, seconds) for name, seconds in self.marks]
+        result = "{} = {:.3f}s".format(", ".join(parts), total)
+        if self.concurrent:
+            result += " (concurrently: {})".format(", ".join("{} {:.3f}s".format(name, seconds) for name, seconds in self.concurrent))
+        return result
+
+def report():
+    "Returns a text report of every histogram, grouped by category with the most total time first, followed by the counters"
+    def ms(seconds):
+        if seconds is None:
+            return "-"
+        return "%.3f" % (seconds * 1000)
+
+    with _lock:
+        rows = [(key, histogram.count, histogram.total, histogram.mean, histogram.percentile(0.5), histogram.percentile(0.95), histogram.maximum) for key, histogram in histograms.items()]
+        counter_rows = sorted(counters.items())
+
+    lines = []
+    for category in sorted(set(row[0][0] for row in rows)):
+        lines.append("{:<40} {:>8} {:>11} {:>9} {:>9} {:>9} {:>9}".format(category.capitalize() + " timings (ms)", "Count", "Total", "Mean", "P50", "P95", "Max"))
+        for key, calls, total, mean, p50, p95, maximum in sorted((row for row in rows if row[0][0] == category), key = lambda row: -row[2]):
+            lines.append("{:<40} {:>8} {:>11} {:>9} {:>9} {:>9} {:>9}".format(key[1], calls, ms(total), ms(mean), ms(p50), ms(p95), ms(maximum)))
+        lines.append("")
+
+    if counter_rows:
+        lines.append("Counters")
+        for name, value in counter_rows:
+            lines.append("{:<40} {:>8}".format(name, value))
+
+    return "\n".join(lines)
+
+def snapshot():
+    "Returns the histograms as {category: {name: {count, total, mean, p50, p95, max}}} in seconds, and the counters"
+    with _lock:
+        timings = {}
+        for (category, name), histogram in histograms.items():
+            timings.setdefault(category, {})[name] = {
+                "count": histogram.count,
+                "total": histogram.total,
+                "mean": histogram.mean,
+                "p50": histogram.percentile(0.5),
+                "p95": histogram.percentile(0.95),
+                "max": histogram.maximum
+            }
+        return {"timings": timings, "counters": dict(counters)}
@@ -0,0 +1,127 @@
+"Crash-safe journal of the run in progress, so a run interrupted by a reboot or power loss can be resumed"
+
+import os
+import json
+import time
+import queue
+import threading
+
+class Journal(object):
+    """
+    Appends a JSON line for the start of a run and each completed step to a small file. A background thread
+    writes the records and fsyncs them in batches, so a step reaches the disk within sync_interval seconds
+    without the test or Tk threads waiting for it. When a run ends the file is emptied, so a journal with
+    records in it after a restart means the run was interrupted.
+    """
+
+    # Seconds the writer waits for more records before syncing a batch to disk.
+    sync_interval = 0.2
+
+    def __init__(self, path = "run.journal"):
+        self.path = path
+        self.syncs = 0
+
+        self._queue = queue.Queue()
+        self._writer = threading.Thread(target = self._write_loop, name = "Journal", daemon = True)
+        self._writer.start()
+
+    def begin(self, run_id, serial, variant, suite, tests):
+        "Records the start of a run of the named tests of suite (its index in tests.ini) on the board serial"
+        self._queue.put({"type": "begin", "run_id": run_id, "serial": serial, "variant": variant, "suite": suite, "tests": tests, "time": time.time()})
+
+    def step(self, position, name, state, failures = None):
+        "Records the state a step finished in"
+        self._queue.put({"type": "step", "position": position, "name": name, "state": state, "failures": list(failures or []), "time": time.time()})
+
+    def end(self, outcome):
+        "Records the end of the run and empties the journal"
+        self._queue.put({"type": "end", "outcome": outcome, "time": time.time()})
+
+    def flush(self):
+        "Blocks until every queued record is on the disk"
+        self._queue.join()
+
+    def close(self):
+        "Writes outstanding records and stops the writer thread"
+        if self._writer.is_alive():
+            self._queue.put(None)
+            self._writer.join()
+
+    def _write_loop(self):
+        running = True
+        with open(self.path, "a") as f:
+            while running:
+                batch = [self._queue.get()]
+                deadline = time.monotonic() + self.sync_interval
+                while True:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        batch.append(self._queue.get(timeout = remaining))
+                    except queue.Empty:
+                        break
+
+                try:
+                    for record in batch:
+                        if record is None:
+                            running = False
+                            continue
+
+                        f.write(json.dumps(record) + "\n")
+
+                        # The end record is synced before the journal is emptied, so a crash in between
+                        # still leaves a journal showing the run finished.
+                        if record["type"] == "end":
+                            self._sync(f)
+                            f.truncate(0)
+
+                    self._sync(f)
+                except OSError as e:
+                    print("Run journal write failed: %s" % e)
+                finally:
+                    for record in batch:
+                        self._queue.task_done()
+
+    def _sync(self, f):
+        f.flush()
+        os.fsync(f.fileno())
+        self.syncs += 1
+
+    def unfinished(self):
+        """
+        Returns the run left unfinished in the journal as a dictionary of run_id, serial, variant, suite, tests,
+        steps ({position: record}) and next (the first incomplete position), or None if there isn't one
+        """
+        try:
+            with open(self.path) as f:
+                lines = f.readlines()
+        except OSError:
+            return None
+
+        run = None
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A line torn by the power going off part way through writing it.
+                continue
+
+            if record["type"] == "begin":
+                run = dict(record, steps = {})
+            elif record["type"] == "step" and run is not None:
+                run["steps"][record["position"]] = record
+            elif record["type"] == "end":
+                run = None
+
+        if run is None:
+            return None
+
+        run["next"] = max(run["steps"]) + 1 if run["steps"] else 0
+        if run["next"] >= len(run["tests"]):
+            return None
+        return run
+
+    def discard(self):
+        "Forgets an unfinished run, e.g. when the operator chooses not to resume it"
+        self._queue.put({"type": "end", "outcome": "discarded", "time": time.time()})
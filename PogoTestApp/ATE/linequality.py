@@ -0,0 +1,125 @@
+"""
+Electrical quality of loopback lines: a digital output wired through the board under test to a digital input.
+
+A LineTest drives the output with a pseudo-random bit pattern and reads the input at the end of each bit period,
+counting the bits which didn't come back. It starts with no delay between bits, as fast as the GPIO can be driven,
+and lengthens the bit period until a pattern comes back clean, giving the fastest rate the line passes. It also
+times how long each edge takes to reach the input.
+
+The loops call RPi.GPIO directly rather than through digio's logged and instrumented functions, and write into
+buffers allocated before they start.
+"""
+
+from array import array
+from time import perf_counter
+
+from ATE import digio
+from ATE import datalog
+from ATE import instrument
+
+def prbs7(count, seed = 0x7F):
+    "Returns count bits of the PRBS7 sequence (x^7 + x^6 + 1) as a bytearray of 0s and 1s"
+    bits = bytearray(count)
+    state = seed & 0x7F or 0x7F
+    for index in range(count):
+        bit = ((state >> 6) ^ (state >> 5)) & 1
+        state = ((state << 1) | bit) & 0x7F
+        bits[index] = bit
+    return bits
+
+class Result(object):
+    "Outcome of a LineTest: bit errors at the fastest rate tried, the fastest clean rate and the propagation delay"
+
+    def __init__(self, name, bits, errors, rate, delay):
+        self.name = name
+        self.bits = bits
+        self.errors = errors    # errors at the fastest rate tried
+        self.rate = rate        # fastest clean rate in bits per second, or None if none was clean
+        self.delay = delay      # median seconds for an edge to reach the input, or None if an edge never arrived
+
+    @property
+    def passed(self):
+        return self.rate is not None and self.delay is not None
+
+    def __repr__(self):
+        return "Result(%r, errors = %d/%d, rate = %r, delay = %r)" % (self.name, self.errors, self.bits, self.rate, self.delay)
+
+class LineTest(object):
+    "Tests the line from output pin to input pin"
+
+    # Bits in each pattern.
+    bits = 256
+
+    # Bit periods tried in turn, in seconds, until one comes back clean. 0 toggles as fast as the GPIO allows.
+    periods = (0.0, 0.00001, 0.0001, 0.001)
+
+    # Edges timed for the propagation delay, and seconds to wait for each before giving up.
+    edges = 16
+    edge_timeout = 0.01
+
+    def __init__(self, name, output, input):
+        self.name = name
+        self.output = output
+        self.input = input
+
+    def errors(self, pattern, period, received):
+        "Drives pattern with period seconds per bit, reading each bit back into received. Returns the number of bits wrong"
+        output = digio.GPIO.output
+        read = digio.GPIO.input
+        out_pin = self.output
+        in_pin = self.input
+
+        count = len(pattern)
+        next_time = perf_counter()
+        for index in range(count):
+            output(out_pin, pattern[index])
+            if period:
+                next_time += period
+                while perf_counter() < next_time:
+                    pass
+            received[index] = 1 if read(in_pin) else 0
+
+        output(out_pin, 0)
+        return sum(1 for index in range(count) if received[index] != pattern[index])
+
+    def propagation(self):
+        "Returns the median seconds from setting the output to the input following it, or None if it didn't follow"
+        output = digio.GPIO.output
+        read = digio.GPIO.input
+        delays = array("d", bytes(8 * self.edges))
+
+        output(self.output, 0)
+        for index in range(self.edges):
+            level = (index + 1) % 2
+            start = perf_counter()
+            output(self.output, level)
+            while (1 if read(self.input) else 0) != level:
+                if perf_counter() - start > self.edge_timeout:
+                    output(self.output, 0)
+                    return None
+            delays[index] = perf_counter() - start
+
+        output(self.output, 0)
+        return sorted(delays)[self.edges // 2]
+
+    @instrument.timed("LineTest.run", category = "linequality")
+    def run(self):
+        "Runs the test and returns a Result"
+        pattern = prbs7(self.bits)
+        received = bytearray(self.bits)
+
+        first_errors = None
+        rate = None
+        for period in self.periods:
+            start = perf_counter()
+            errors = self.errors(pattern, period, received)
+            elapsed = perf_counter() - start
+            if first_errors is None:
+                first_errors = errors
+            if errors == 0:
+                rate = self.bits / elapsed
+                break
+
+        result = Result(self.name, self.bits, first_errors, rate, self.propagation())
+        datalog.log("line_quality", self.name, result.rate, repr(result))
+        return result
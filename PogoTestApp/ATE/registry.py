@@ -0,0 +1,153 @@
+"""
+Registry of test procedures by name, so tests.ini can name tests from modules other than ATE.tests.
+
+Procedures come from the modules listed in a registry (ATE.tests and any in the [plugins] section of tests.ini)
+and from installed packages' "pogo_ate.tests" entry points. Which module defines each name is cached in a
+manifest file, so only the modules holding a suite's tests are imported. A module is scanned again when its
+source file changes.
+"""
+
+import os
+import json
+import importlib
+import importlib.util
+
+# Installed packages can add procedures with entry points in this group, e.g. MyTest = my_package.tests:MyTest
+entry_point_group = "pogo_ate.tests"
+
+# Manifests written by an older version are rescanned. Version 1 listed TestProcedure itself as a test.
+_manifest_version = 2
+
+def register(name):
+    "Class decorator registering a procedure under name as well as its class name, e.g. to keep an old name in tests.ini working"
+    def decorator(cls):
+        cls._registry_names = cls.__dict__.get("_registry_names", ()) + (name,)
+        return cls
+    return decorator
+
+def _entry_points():
+    "Returns {name: 'module:attribute'} for the entry points in entry_point_group"
+    try:
+        from importlib import metadata
+    except ImportError:
+        return {}
+
+    points = metadata.entry_points()
+    if hasattr(points, "select"):
+        points = points.select(group = entry_point_group)
+    else:
+        points = points.get(entry_point_group, [])
+    return dict((point.name, point.value) for point in points)
+
+class Registry(object):
+    "Finds test procedure classes by name, importing only the modules which define the names asked for"
+
+    def __init__(self, modules = ("ATE.tests",), manifest_path = None):
+        self.modules = list(modules)
+        self.manifest_path = manifest_path
+
+        self._locations = None
+        self._entry_points = None
+
+    def _stamp(self, module):
+        "Returns [modification time, size] of a module's source file, or None if it can't be found"
+        try:
+            spec = importlib.util.find_spec(module)
+        except (ImportError, ValueError):
+            return None
+        if spec is None or not spec.origin or not os.path.isfile(spec.origin):
+            return None
+        stat = os.stat(spec.origin)
+        return [stat.st_mtime_ns, stat.st_size]
+
+    def _scan(self, module):
+        "Imports module and returns {name: attribute} for each procedure it defines"
+        from ATE.tests import TestProcedure
+
+        result = {}
+        for attribute, value in vars(importlib.import_module(module)).items():
+            if isinstance(value, type) and issubclass(value, TestProcedure) and value is not TestProcedure and value.__module__ == module:
+                result[attribute] = attribute
+                for name in value.__dict__.get("_registry_names", ()):
+                    result[name] = attribute
+        return result
+
+    def _load_manifest(self):
+        if not self.manifest_path:
+            return {}
+        try:
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if manifest.get("version") != _manifest_version:
+            return {}
+        return manifest.get("modules", {})
+
+    def _save_manifest(self, modules):
+        if not self.manifest_path:
+            return
+        try:
+            with open(self.manifest_path, "w") as f:
+                json.dump({"version": _manifest_version, "modules": modules}, f, indent = 2, sort_keys = True)
+        except OSError as e:
+            print("Test manifest not saved: %s" % e)
+
+    def locations(self):
+        "Returns {name: (module, attribute)} for every procedure in the registry's modules, from the manifest where it is up to date"
+        if self._locations is not None:
+            return self._locations
+
+        cached = self._load_manifest()
+        modules = {}
+        changed = False
+
+        for module in self.modules:
+            stamp = self._stamp(module)
+            entry = cached.get(module)
+            if stamp is None or entry is None or entry.get("stamp") != stamp:
+                entry = {"stamp": stamp, "tests": self._scan(module)}
+                changed = True
+            modules[module] = entry
+
+        if changed or set(cached) != set(modules):
+            self._save_manifest(modules)
+
+        # Earlier modules take precedence.
+        self._locations = {}
+        for module in reversed(self.modules):
+            for name, attribute in modules[module]["tests"].items():
+                self._locations[name] = (module, attribute)
+        return self._locations
+
+    def _entry_point(self, name):
+        if self._entry_points is None:
+            self._entry_points = _entry_points()
+        value = self._entry_points.get(name)
+        if value is None:
+            return None
+        module, _, attribute = value.partition(":")
+        return module.strip(), attribute.strip()
+
+    def locate(self, name):
+        "Returns (module, attribute) of the named procedure without importing it, or None if there is no such procedure"
+        return self.locations().get(name) or self._entry_point(name)
+
+    def __contains__(self, name):
+        return self.locate(name) is not None
+
+    def names(self):
+        "Returns the names of every procedure in the registry's modules"
+        return sorted(self.locations())
+
+    def resolve(self, name):
+        "Returns the named procedure class, importing its module if needed. Raises KeyError if there is no such procedure"
+        location = self.locate(name)
+        if location is None:
+            raise KeyError(name)
+
+        module, attribute = location
+        return getattr(importlib.import_module(module), attribute)
+
+# Registry of ATE.tests alone, used when no other is given.
+default = Registry()
@@ -0,0 +1,258 @@
+"Durable storage of test runs, steps and measurements"
+
+import sqlite3
+import threading
+import queue
+import json
+import uuid
+import time
+import statistics
+
+_schema = """
+CREATE TABLE IF NOT EXISTS runs (
+    id TEXT PRIMARY KEY,
+    serial TEXT,
+    variant TEXT,
+    started REAL,
+    finished REAL,
+    duration REAL,
+    outcome TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_serial ON runs (serial, started);
+CREATE INDEX IF NOT EXISTS runs_variant ON runs (variant, started);
+CREATE INDEX IF NOT EXISTS runs_started ON runs (started);
+
+CREATE TABLE IF NOT EXISTS steps (
+    run_id TEXT,
+    position INTEGER,
+    name TEXT,
+    description TEXT,
+    state TEXT,
+    started REAL,
+    duration REAL,
+    failures TEXT
+);
+CREATE INDEX IF NOT EXISTS steps_run ON steps (run_id, position);
+
+CREATE TABLE IF NOT EXISTS measurements (
+    run_id TEXT,
+    serial TEXT,
+    variant TEXT,
+    step TEXT,
+    name TEXT,
+    value REAL,
+    lower REAL,
+    upper REAL,
+    passed INTEGER,
+    samples INTEGER,
+    minimum REAL,
+    maximum REAL,
+    mean REAL,
+    stddev REAL,
+    duration REAL,
+    timestamp REAL
+);
+CREATE INDEX IF NOT EXISTS measurements_variant ON measurements (variant, name, timestamp);
+CREATE INDEX IF NOT EXISTS measurements_serial ON measurements (serial, timestamp);
+CREATE INDEX IF NOT EXISTS measurements_run ON measurements (run_id);
+CREATE INDEX IF NOT EXISTS measurements_timestamp ON measurements (timestamp);
+"""
+
+def sample_statistics(readings):
+    "Returns (samples, minimum, maximum, mean, stddev) for a list of readings, or Nones if there are no readings"
+    if not readings:
+        return 0, None, None, None, None
+
+    if len(readings) > 1:
+        stddev = statistics.pstdev(readings)
+    else:
+        stddev = 0.0
+
+    return len(readings), min(readings), max(readings), statistics.mean(readings), stddev
+
+class ResultsStore(object):
+    "Append-only results database. Writes are queued and committed in batches by a background thread so the test thread never waits on the disk."
+
+    # Maximum number of queued writes committed in a single transaction.
+    batch_size = 100
+
+    # Seconds the writer waits for more work before committing a partial batch.
+    flush_interval = 0.5
+
+    def __init__(self, path = "results.db"):
+        self.path = path
+        self._queue = queue.Queue()
+        self._runs = {}
+
+        # Create the schema and switch to WAL so readers don't block the writer.
+        connection = self._connect()
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.executescript(_schema)
+        connection.commit()
+        connection.close()
+
+        self._writer = threading.Thread(target = self._write_loop, name = "ResultsWriter", daemon = True)
+        self._writer.start()
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout = 10)
+        connection.row_factory = sqlite3.Row
+        return connection
+
+    def _write_loop(self):
+        "Writer thread. Commits queued statements in batches until close() sends None."
+        connection = self._connect()
+        connection.execute("PRAGMA synchronous=NORMAL")
+        running = True
+
+        while running:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout = remaining))
+                except queue.Empty:
+                    break
+
+            # Look for close()'s None before writing, so a failed statement earlier in the batch can't hide it.
+            running = None not in batch
+
+            try:
+                with connection:
+                    for item in batch:
+                        if item is not None:
+                            connection.execute(*item)
+            except sqlite3.Error as e:
+                print("Results store write failed: %s" % e)
+            finally:
+                for item in batch:
+                    self._queue.task_done()
+
+        connection.close()
+
+    def _put(self, sql, parameters):
+        self._queue.put((sql, parameters))
+
+    def begin_run(self, serial, variant):
+        "Records the start of a run for the board serial and suite variant and returns the new run id"
+        run_id = uuid.uuid4().hex
+        self._runs[run_id] = (serial, variant)
+        self._put("INSERT INTO runs (id, serial, variant, started) VALUES (?, ?, ?, ?)", (run_id, serial, variant, time.time()))
+        return run_id
+
+    def resume_run(self, run_id, serial, variant):
+        "Continues recording to a run begun before the application restarted"
+        self._runs[run_id] = (serial, variant)
+        self._put("INSERT OR IGNORE INTO runs (id, serial, variant, started) VALUES (?, ?, ?, ?)", (run_id, serial, variant, time.time()))
+
+    def end_run(self, run_id, outcome, duration = None):
+        "Records the outcome ('passed', 'failed' or 'aborted') and duration of a run"
+        self._put("UPDATE runs SET finished = ?, duration = ?, outcome = ? WHERE id = ?", (time.time(), duration, outcome, run_id))
+        self._runs.pop(run_id, None)
+
+    def record_step(self, run_id, position, name, description, state, started = None, duration = None, failures = None):
+        "Records the final state of a single test step in a run"
+        self._put("INSERT INTO steps (run_id, position, name, description, state, started, duration, failures) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                  (run_id, position, name, description, state, started, duration, json.dumps(failures or [])))
+
+    def record_measurement(self, run_id, step, name, value, lower = None, upper = None, passed = None, readings = None, duration = None):
+        "Records a measurement taken during a step. If readings are given, their sample statistics are stored alongside the value"
+        serial, variant = self._runs.get(run_id, (None, None))
+        samples, minimum, maximum, mean, stddev = sample_statistics(readings or [])
+
+        if passed is not None:
+            passed = int(bool(passed))
+
+        self._put("INSERT INTO measurements (run_id, serial, variant, step, name, value, lower, upper, passed, samples, minimum, maximum, mean, stddev, duration, timestamp) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                  (run_id, serial, variant, step, name, value, lower, upper, passed, samples, minimum, maximum, mean, stddev, duration, time.time()))
+
+    def flush(self):
+        "Blocks until every queued write has been committed"
+        self._queue.join()
+
+    def close(self):
+        "Commits outstanding writes and stops the writer thread"
+        if self._writer.is_alive():
+            self._queue.put(None)
+            self._writer.join()
+
+    # Queries. Each opens its own connection so it can be called from any thread while the writer is busy.
+
+    def last_run(self, serial):
+        "Returns the most recent run for the board serial as a dictionary including its steps and measurements, or None"
+        connection = self._connect()
+        try:
+            run = connection.execute("SELECT * FROM runs WHERE serial = ? ORDER BY started DESC LIMIT 1", (serial,)).fetchone()
+            if run is None:
+                return None
+
+            result = dict(run)
+            result["steps"] = [dict(row) for row in connection.execute("SELECT * FROM steps WHERE run_id = ? ORDER BY position", (run["id"],))]
+            result["measurements"] = [dict(row) for row in connection.execute("SELECT * FROM measurements WHERE run_id = ? ORDER BY timestamp", (run["id"],))]
+
+            for step in result["steps"]:
+                step["failures"] = json.loads(step["failures"])
+
+            return result
+        finally:
+            connection.close()
+
+    def measurements(self, name = None, variant = None, since = None, until = None, serial = None):
+        "Returns measurements called name (or all measurements if None), optionally filtered by variant, serial and a since/until timestamp window, oldest first"
+        sql = "SELECT * FROM measurements WHERE 1 = 1"
+        parameters = []
+
+        if name is not None:
+            sql += " AND name = ?"
+            parameters.append(name)
+
+        if variant is not None:
+            sql += " AND variant = ?"
+            parameters.append(variant)
+        if serial is not None:
+            sql += " AND serial = ?"
+            parameters.append(serial)
+        if since is not None:
+            sql += " AND timestamp >= ?"
+            parameters.append(since)
+        if until is not None:
+            sql += " AND timestamp < ?"
+            parameters.append(until)
+
+        sql += " ORDER BY timestamp"
+
+        connection = self._connect()
+        try:
+            return [dict(row) for row in connection.execute(sql, parameters)]
+        finally:
+            connection.close()
+
+    def runs(self, serial = None, variant = None, since = None, limit = None):
+        "Returns runs, optionally filtered by serial, variant and start time, newest first. limit returns only that many of the newest"
+        sql = "SELECT * FROM runs WHERE 1 = 1"
+        parameters = []
+
+        if serial is not None:
+            sql += " AND serial = ?"
+            parameters.append(serial)
+        if variant is not None:
+            sql += " AND variant = ?"
+            parameters.append(variant)
+        if since is not None:
+            sql += " AND started >= ?"
+            parameters.append(since)
+
+        sql += " ORDER BY started DESC"
+        if limit is not None:
+            sql += " LIMIT ?"
+            parameters.append(limit)
+
+        connection = self._connect()
+        try:
+            return [dict(row) for row in connection.execute(sql, parameters)]
+        finally:
+            connection.close()
@@ -0,0 +1,166 @@
+"Power-up self-test of the ADC chips, analogue channels and GPIO lines with the jig empty"
+
+import time
+import threading
+
+from ATE import adc, digio, datalog, instrument
+from ATE.const import *
+
+class Result(object):
+    "Outcome of one self-test check. keys are the reading labels the check covers and faults describes anything wrong."
+
+    def __init__(self, name, keys, faults, duration):
+        self.name = name
+        self.keys = keys
+        self.faults = faults
+        self.duration = duration
+
+    @property
+    def passed(self):
+        return not self.faults
+
+class SelfTest(object):
+    """
+    Checks the ATE itself before any board is loaded. Each ADC chip is probed and its channels read, and the GPIO
+    inputs, outputs and fixture loopbacks are checked. The checks are independent so they run at the same time,
+    and any still running after budget seconds are reported as faults.
+    """
+
+    # Seconds allowed for all the checks.
+    budget = 2.0
+
+    # Channels on each ADC chip, by I2C address.
+    chips = {
+        adc.addresses[0]: ("AD1", "AD2", "AD3", "AD4"),
+        adc.addresses[1]: ("AD5", "AD6", "AD7", "AD8")
+    }
+
+    # Voltage range (lower, upper) of each channel with the jig empty and every output off, unless limits.ini gives
+    # an "AD1 idle" style limit. These defaults are an assumption that nothing drives the channels then, not
+    # figures measured on a jig, so set the limits from a known good jig.
+    idle_voltages = dict(("AD%d" % channel, (0.0, 0.5)) for channel in range(1, 9))
+
+    # Inputs checked with the jig empty. Each is assumed to be pulled down and read low, unless limits.ini gives a
+    # "DIP5 idle = 1, 1" style limit for its level.
+    idle_inputs = {
+        "DIP1": DIP1_PWRUP_Delay,
+        "DIP2": DIP2_OTG_OK,
+        "DIP3": DIP3_Dplus_J5_3_OK,
+        "DIP4": DIP4_Dminus_J5_2_OK,
+        "DIP5": DIP5_5V_PWR,
+        "DIP6": DIP6_From_J7_4,
+        "DIP7": DIP7_J3_LINK_OK,
+        "DIP8": DIP8_LED_RD,
+        "DIP9": DIP9_LED_GN,
+        "DIP10": DIP10_USB_PERpins_OK,
+        "DIP11": DIP11_5V_ATE_in
+    }
+
+    # Pairs of (output key, output pin, input key, input pin) linked by the fixture itself rather than through a board.
+    # Each output is switched on and off and its input must follow. The current fixture has none.
+    loopbacks = []
+
+    def __init__(self, budget = None, limits = None):
+        if budget is not None:
+            self.budget = budget
+
+        # {measurement: (lower, upper)} from limits.ini, for the idle limits.
+        self.limits = limits or {}
+
+    def idle_voltage(self, key):
+        "Returns (lower, upper) volts for the channel with the jig empty"
+        return self.limits.get(key + " idle", self.idle_voltages[key])
+
+    def idle_level(self, key):
+        "Returns the level, 0 or 1, the input should read with the jig empty"
+        return int(self.limits.get(key + " idle", (0, 0))[0])
+
+    def check_adc(self, address, keys):
+        "Probes the ADC chip at address and reads each of its channels against idle_voltages"
+        if not adc.probe(address):
+            return ["ADC at 0x%02X does not respond" % address]
+
+        faults = []
+        channels = adc.get_all_channels()
+        for key in keys:
+            lower, upper = self.idle_voltage(key)
+            voltage = channels[key].read_voltage(fresh = True)
+            if not lower <= voltage <= upper:
+                faults.append("%s reads %.2fV, expected %.2fV to %.2fV" % (key, voltage, lower, upper))
+        return faults
+
+    def check_gpio(self):
+        "Reads every input against its idle level, then switches each loopback output and checks its input follows"
+        faults = []
+        for key, pin in self.idle_inputs.items():
+            level = self.idle_level(key)
+            if (1 if digio.read(pin) else 0) != level:
+                faults.append("%s is %s with the jig empty" % (key, "low" if level else "high"))
+
+        # Loopbacks share inputs with the idle check, so they run after it on the same thread.
+        for output_key, output, input_key, input in self.loopbacks:
+            digio.set_high(output)
+            high = digio.read(input)
+            digio.set_low(output)
+            low = digio.read(input)
+            if not high or low:
+                faults.append("%s does not follow %s" % (input_key, output_key))
+        return faults
+
+    def checks(self):
+        "Returns a list of (name, keys, function) for each independent check"
+        result = []
+        for address, keys in sorted(self.chips.items()):
+            result.append(("ADC 0x%02X" % address, keys, lambda address = address, keys = keys: self.check_adc(address, keys)))
+
+        gpio_keys = tuple(self.idle_inputs) + tuple(key for loopback in self.loopbacks for key in (loopback[0], loopback[2]))
+        result.append(("GPIO", gpio_keys, self.check_gpio))
+        return result
+
+    @instrument.timed("SelfTest.run", category = "step")
+    def run(self):
+        "Runs every check concurrently and returns a list of Result, one per check"
+        checks = self.checks()
+        started = time.monotonic()
+
+        # Each check runs on a daemon thread, so one hung on the I2C bus or a GPIO line can't keep the application
+        # from exiting. A check still running after the budget is left to finish in the background.
+        outcomes = [None] * len(checks)
+
+        def timed(index, function):
+            begin = time.monotonic()
+            try:
+                outcomes[index] = (function(), None, time.monotonic() - begin)
+            except Exception as e:
+                outcomes[index] = (None, e, time.monotonic() - begin)
+
+        threads = []
+        for index, (name, keys, function) in enumerate(checks):
+            thread = threading.Thread(target = timed, args = (index, function), name = "SelfTest " + name, daemon = True)
+            thread.start()
+            threads.append(thread)
+
+        deadline = started + self.budget
+        for thread in threads:
+            thread.join(max(0, deadline - time.monotonic()))
+
+        results = []
+        for (name, keys, function), outcome in zip(checks, outcomes):
+            if outcome is None:
+                results.append(Result(name, keys, ["%s did not finish within %gs" % (name, self.budget)], time.monotonic() - started))
+            elif outcome[1] is not None:
+                results.append(Result(name, keys, ["%s failed: %s" % (name, outcome[1])], outcome[2]))
+            else:
+                results.append(Result(name, keys, outcome[0], outcome[2]))
+
+            datalog.log("selftest", name, results[-1].passed, "; ".join(results[-1].faults))
+
+        return results
+
+def faults(results):
+    "Returns every fault found by a list of results"
+    return [fault for result in results for fault in result.faults]
+
+def labels(results):
+    "Returns a dictionary of reading label: OK or FAULT for the keys covered by results"
+    return dict((key, "OK" if result.passed else "FAULT") for result in results for key in result.keys)
@@ -0,0 +1,94 @@
+"""
+Timed output sequences, for stimulus patterns such as stepping the battery select bits or the thermal simulation
+outputs at known intervals.
+
+A Sequence is a list of (offset, states) steps, where offset is seconds from the start of the sequence and states
+is {pin: level}. play() runs the steps from their own thread against a monotonic clock, sleeping until just before
+each step and spinning for the rest, and records when each step was actually written.
+"""
+
+import os
+import threading
+from time import perf_counter, sleep
+
+from ATE import digio
+from ATE import datalog
+from ATE import instrument
+
+class Sequence(object):
+    "Plays (offset, {pin: level}) steps on the digital outputs at their offsets"
+
+    # Seconds before each step the thread stops sleeping and spins, as sleep() can overrun by about a millisecond.
+    spin = 0.002
+
+    # Real-time priority asked for while playing. Needs root or CAP_SYS_NICE; without it the thread runs at normal priority.
+    priority = 50
+
+    def __init__(self, steps):
+        self.steps = sorted(steps, key = lambda step: step[0])
+        if self.steps and self.steps[0][0] < 0:
+            raise ValueError("step offsets can't be negative")
+
+        # (scheduled offset, actual offset) of each step, in seconds from the start, once played.
+        self.timings = []
+        self.error = None
+        self._thread = None
+
+    @classmethod
+    def from_masks(cls, pins, steps):
+        "Builds a sequence from (offset, mask) steps, where bit n of mask is the level of pins[n]"
+        return cls([(offset, dict((pin, (mask >> bit) & 1) for bit, pin in enumerate(pins))) for offset, mask in steps])
+
+    def start(self):
+        "Starts playing on a background thread"
+        self.timings = []
+        self.error = None
+        self._thread = threading.Thread(target = self._play, name = "Sequence", daemon = True)
+        self._thread.start()
+
+    def wait(self, timeout = None):
+        "Waits for the sequence to finish and returns its timings. Raises the error the thread stopped with, if any"
+        self._thread.join(timeout)
+        if self.error:
+            raise self.error
+        return self.timings
+
+    @instrument.timed("Sequence.play", category = "sequence")
+    def play(self):
+        "Plays the sequence on its own thread and returns the timings when it has finished"
+        self.start()
+        return self.wait()
+
+    def _play(self):
+        try:
+            self._raise_priority()
+            start = perf_counter()
+            for offset, states in self.steps:
+                target = start + offset
+                remaining = target - perf_counter() - self.spin
+                if remaining > 0:
+                    sleep(remaining)
+                while perf_counter() < target:
+                    pass
+
+                actual = perf_counter() - start
+                digio.write(states)
+                self.timings.append((offset, actual))
+        except Exception as e:
+            self.error = e
+
+        datalog.log("sequence", "lateness", self.lateness(), "%d steps" % len(self.timings))
+
+    def _raise_priority(self):
+        # On Linux pid 0 means the calling thread.
+        if hasattr(os, "sched_setscheduler"):
+            try:
+                os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(self.priority))
+            except (OSError, ValueError):
+                pass
+
+    def lateness(self):
+        "Seconds the latest step was written after its offset, or None before the sequence has played"
+        if not self.timings:
+            return None
+        return max(actual - offset for offset, actual in self.timings)
@@ -0,0 +1,118 @@
+"""
+Publication of the latest readings to a memory-mapped file, so other processes on the controller can see them
+without opening the I2C bus.
+
+The file is SIZE bytes, little-endian:
+
+    offset  type        field
+    0       char[4]     magic, b"ATE1"
+    4       uint16      layout version, 1
+    6       uint16      number of analogue channels, 8
+    8       uint64      sequence, odd while a snapshot is being written
+    16      float64     timestamp, seconds since the epoch
+    24      float32[8]  AD1 to AD8 in volts
+    56      uint32      DIP bitmask, bit 0 is DIP1
+    60      uint32      DOP bitmask, bit 0 is DOP1
+
+Readers read the sequence, then the snapshot, then the sequence again, and use the snapshot if both sequences
+are the same even number. Otherwise the writer was part way through and they read again.
+"""
+
+import os
+import mmap
+import struct
+import tempfile
+import time
+
+MAGIC = b"ATE1"
+VERSION = 1
+CHANNELS = 8
+
+_header = struct.Struct("<4sHH")
+_sequence = struct.Struct("<Q")
+_snapshot = struct.Struct("<d%dfII" % CHANNELS)
+
+SEQUENCE_OFFSET = _header.size
+SNAPSHOT_OFFSET = SEQUENCE_OFFSET + _sequence.size
+SIZE = SNAPSHOT_OFFSET + _snapshot.size
+
+# Shared memory on the Raspberry Pi, or the temporary directory where there is no /dev/shm.
+default_path = os.path.join("/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(), "pogo_readings")
+
+def pack_bits(readings, prefix, count, high):
+    "Returns a bitmask of the readings named prefix1 to prefix<count> which equal high"
+    mask = 0
+    for index in range(count):
+        if readings.get("%s%d" % (prefix, index + 1)) == high:
+            mask |= 1 << index
+    return mask
+
+class Publisher(object):
+    "Writes readings snapshots to the shared file. publish() has the signature of an Acquisition subscriber."
+
+    def __init__(self, path = None):
+        self.path = path or default_path
+        self._count = 0
+
+        # The file is never truncated, as that would crash readers which still have it mapped from an earlier run.
+        self._file = open(self.path, "a+b")
+        if os.fstat(self._file.fileno()).st_size < SIZE:
+            self._file.truncate(SIZE)
+        self._map = mmap.mmap(self._file.fileno(), SIZE)
+        _header.pack_into(self._map, 0, MAGIC, VERSION, CHANNELS)
+        _sequence.pack_into(self._map, SEQUENCE_OFFSET, 0)
+
+    def publish(self, sequence, timestamp, readings):
+        "Writes a snapshot of readings. Only one thread may publish."
+        voltages = []
+        for index in range(CHANNELS):
+            value = readings.get("AD%d" % (index + 1))
+            voltages.append(value if isinstance(value, float) else float("nan"))
+
+        dip = pack_bits(readings, "DIP", 32, "High")
+        dop = pack_bits(readings, "DOP", 32, "On")
+
+        self._count += 2
+        _sequence.pack_into(self._map, SEQUENCE_OFFSET, self._count - 1)
+        _snapshot.pack_into(self._map, SNAPSHOT_OFFSET, timestamp, *(voltages + [dip, dop]))
+        _sequence.pack_into(self._map, SEQUENCE_OFFSET, self._count)
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+class Reader(object):
+    "Maps the shared file read-only and returns the latest snapshot"
+
+    def __init__(self, path = None):
+        self.path = path or default_path
+        self._file = open(self.path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), SIZE, access = mmap.ACCESS_READ)
+
+        magic, version, channels = _header.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError("%s is not a version %d readings file" % (self.path, VERSION))
+
+    @property
+    def sequence(self):
+        "Number of snapshots published. Cheap to poll for a new snapshot"
+        return _sequence.unpack_from(self._map, SEQUENCE_OFFSET)[0] // 2
+
+    def read(self, retries = 100):
+        "Returns (sequence, timestamp, voltages, dip, dop), or None if nothing has been published yet"
+        for attempt in range(retries):
+            before = _sequence.unpack_from(self._map, SEQUENCE_OFFSET)[0]
+            if before % 2 == 0:
+                values = _snapshot.unpack_from(self._map, SNAPSHOT_OFFSET)
+                if _sequence.unpack_from(self._map, SEQUENCE_OFFSET)[0] == before:
+                    if before == 0:
+                        return None
+                    return before // 2, values[0], list(values[1:1 + CHANNELS]), values[-2], values[-1]
+            time.sleep(0)
+
+        raise RuntimeError("%s is being written too often to read" % self.path)
+
+    def close(self):
+        self._map.close()
+        self._file.close()
@@ -0,0 +1,298 @@
+"""
+HTTP and WebSocket status server, so supervisors can see a jig's state without walking to it.
+
+    GET /status     current suite, test stage and state
+    GET /readings   latest readings snapshot
+    GET /results    most recent runs from the results database
+    GET /metrics    throughput over the last hour and timing histograms
+    GET /ws         WebSocket pushing status and readings as they change, at most once per push_interval
+
+The server runs its own asyncio event loop on a background thread and only reads the suite's state,
+so it never blocks the test or Tk threads.
+"""
+
+import json
+import time
+import base64
+import hashlib
+import asyncio
+import threading
+import traceback
+
+from ATE import instrument
+
+_websocket_guid = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+_reasons = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    500: "Internal Server Error",
+    503: "Service Unavailable"
+}
+
+class StatusServer(object):
+    "Serves the state of a TestSuite and Acquisition as JSON over HTTP and WebSocket"
+
+    # Interface and port to listen on. The default only accepts connections from the controller itself.
+    # Port 0 picks a free port, which is set in port once the server has started.
+    host = "127.0.0.1"
+    port = 8080
+
+    # Minimum seconds between WebSocket messages to each client.
+    push_interval = 1.0
+
+    # Maximum number of WebSocket clients at once.
+    max_clients = 8
+
+    # Number of runs returned by /results.
+    results_limit = 20
+
+    def __init__(self, suite, acquisition = None, host = None, port = None, push_interval = None):
+        self.suite = suite
+        self.acquisition = acquisition
+        if host is not None:
+            self.host = host
+        if port is not None:
+            self.port = port
+        if push_interval is not None:
+            self.push_interval = push_interval
+
+        self.clients = 0
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._started = threading.Event()
+        self._error = None
+
+    # State. These are called on the server thread and only read the suite and acquisition.
+
+    def status(self):
+        "Returns the suite, the current test and its state"
+        suite = self.suite
+        tests = list(suite.tests)
+        index = suite.current_test
+
+        result = {
+            "variant": suite.variant,
+            "serial": suite.serial,
+            "run_id": suite.run_id,
+            "stage": index,
+            "stages": len(tests),
+            "summary_shown": suite.summary_shown,
+            "test": None,
+            "time": time.time()
+        }
+
+        if 0 <= index < len(tests):
+            test = tests[index]
+            result["test"] = {"name": type(test).__name__, "description": test.description, "state": test.state, "started": test.started}
+
+        return result
+
+    def readings(self):
+        "Returns the latest readings snapshot, or None before the first"
+        if self.acquisition is None or self.acquisition.latest is None:
+            return None
+
+        sequence, timestamp, readings = self.acquisition.latest
+        return {"sequence": sequence, "timestamp": timestamp, "readings": readings}
+
+    def recent_results(self):
+        "Returns the most recent runs, newest first. Reads the database so it is run in an executor"
+        if self.suite.results is None:
+            return []
+        return self.suite.results.runs(limit = self.results_limit)
+
+    def metrics(self):
+        "Returns the runs completed and their yield over the last hour, and the instrument timings"
+        result = {"runs_last_hour": None, "passed_last_hour": None, "mean_duration": None}
+        if self.suite.results is not None:
+            runs = [run for run in self.suite.results.runs(since = time.time() - 3600) if run["finished"] is not None]
+            durations = [run["duration"] for run in runs if run["duration"] is not None]
+            result["runs_last_hour"] = len(runs)
+            result["passed_last_hour"] = sum(1 for run in runs if run["outcome"] == "passed")
+            result["mean_duration"] = sum(durations) / len(durations) if durations else None
+
+        if self.acquisition is not None and self.acquisition.latest is not None:
+            result["readings_sequence"] = self.acquisition.latest[0]
+
+        result.update(instrument.snapshot())
+        return result
+
+    # Server thread.
+
+    def start(self):
+        "Starts the server on a background thread and waits until it is listening"
+        self._thread = threading.Thread(target = self._run, name = "StatusServer", daemon = True)
+        self._thread.start()
+        self._started.wait()
+        if self._error:
+            raise self._error
+
+    def stop(self):
+        "Closes the server and its connections and waits for the thread to finish"
+        if self._loop is not None and self._loop.is_running():
+            self._loop.call_soon_threadsafe(self._loop.stop)
+        if self._thread:
+            self._thread.join()
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._server = self._loop.run_until_complete(asyncio.start_server(self._handle, self.host, self.port))
+            self.port = self._server.sockets[0].getsockname()[1]
+        except Exception as e:
+            self._error = e
+            self._started.set()
+            self._loop.close()
+            return
+
+        self._started.set()
+        try:
+            self._loop.run_forever()
+        finally:
+            self._server.close()
+            for task in asyncio.all_tasks(self._loop):
+                task.cancel()
+            self._loop.run_until_complete(asyncio.sleep(0))
+            self._loop.close()
+
+    async def _handle(self, reader, writer):
+        # Once a WebSocket is upgraded an error can only be logged, not answered with a status code.
+        upgraded = False
+        try:
+            request = await reader.readline()
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+
+            parts = request.decode("latin-1").split()
+            if len(parts) != 3:
+                await self._respond(writer, 400, {"error": "bad request"})
+                return
+
+            method, path = parts[0], parts[1].split("?")[0]
+            if method != "GET":
+                await self._respond(writer, 405, {"error": "only GET is supported"})
+                return
+
+            if path == "/ws":
+                upgraded = True
+                await self._websocket(reader, writer, headers)
+                return
+
+            routes = {
+                "/": lambda: {"endpoints": ["/status", "/readings", "/results", "/metrics", "/ws"]},
+                "/status": self.status,
+                "/readings": self.readings,
+                "/results": self.recent_results,
+                "/metrics": self.metrics
+            }
+            if path not in routes:
+                await self._respond(writer, 404, {"error": "not found"})
+                return
+
+            # Database queries run in the default executor so a slow one doesn't hold up other clients.
+            body = await self._loop.run_in_executor(None, routes[path])
+            await self._respond(writer, 200, body)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception as e:
+            # A failing query (e.g. a locked or corrupt database) is reported to the client and logged, not dropped silently.
+            print("Status server request failed: %r" % e)
+            traceback.print_exc()
+            if not upgraded:
+                try:
+                    await self._respond(writer, 500, {"error": str(e)})
+                except ConnectionError:
+                    pass
+        finally:
+            writer.close()
+
+    async def _respond(self, writer, code, body):
+        content = json.dumps(body, default = str).encode("utf-8")
+        writer.write(("HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\nConnection: close\r\n\r\n" % (code, _reasons[code], len(content))).encode("latin-1"))
+        writer.write(content)
+        await writer.drain()
+
+    # WebSocket (RFC 6455). Only unfragmented text messages are sent; client messages other than close are ignored.
+
+    async def _websocket(self, reader, writer, headers):
+        key = headers.get("sec-websocket-key")
+        if headers.get("upgrade", "").lower() != "websocket" or not key:
+            await self._respond(writer, 400, {"error": "expected a WebSocket upgrade"})
+            return
+        if self.clients >= self.max_clients:
+            await self._respond(writer, 503, {"error": "too many WebSocket clients"})
+            return
+
+        accept = base64.b64encode(hashlib.sha1((key + _websocket_guid).encode("ascii")).digest()).decode("ascii")
+        writer.write(("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\nSec-WebSocket-Accept: %s\r\n\r\n" % accept).encode("latin-1"))
+        await writer.drain()
+
+        self.clients += 1
+        closed = asyncio.ensure_future(self._await_close(reader))
+        try:
+            last = None
+            while not closed.done():
+                message = {"status": self.status(), "readings": self.readings()}
+
+                # Only push when something other than the clock has changed.
+                changed = (dict(message["status"], time = None), message["readings"] and message["readings"]["sequence"])
+                if changed != last:
+                    last = changed
+                    writer.write(_frame(0x1, json.dumps(message, default = str).encode("utf-8")))
+                    await writer.drain()
+
+                await asyncio.wait([closed], timeout = self.push_interval)
+
+            writer.write(_frame(0x8, b""))
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            closed.cancel()
+            self.clients -= 1
+
+    async def _await_close(self, reader):
+        "Reads client frames until a close frame or the connection ends"
+        try:
+            while True:
+                opcode, payload = await _read_frame(reader)
+                if opcode == 0x8:
+                    return
+        except (ConnectionError, asyncio.IncompleteReadError):
+            return
+
+def _frame(opcode, payload):
+    "Returns an unmasked server to client WebSocket frame"
+    length = len(payload)
+    if length < 126:
+        header = bytes([0x80 | opcode, length])
+    elif length < 65536:
+        header = bytes([0x80 | opcode, 126]) + length.to_bytes(2, "big")
+    else:
+        header = bytes([0x80 | opcode, 127]) + length.to_bytes(8, "big")
+    return header + payload
+
+async def _read_frame(reader):
+    "Reads one WebSocket frame and returns (opcode, unmasked payload)"
+    first, second = await reader.readexactly(2)
+    length = second & 0x7F
+    if length == 126:
+        length = int.from_bytes(await reader.readexactly(2), "big")
+    elif length == 127:
+        length = int.from_bytes(await reader.readexactly(8), "big")
+
+    mask = await reader.readexactly(4) if second & 0x80 else None
+    payload = await reader.readexactly(length)
+    if mask:
+        payload = bytes(byte ^ mask[index % 4] for index, byte in enumerate(payload))
+    return first & 0x0F, payload
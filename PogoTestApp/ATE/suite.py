@@ -1,3 +1,4 @@
+import time
 from enum import Enum
 from threading import Thread
 from ATE.adc import Channel
@@ -5,6 +6,8 @@ from ATE.gui import MainForm
 import ATE.digio as digio
 import ATE.const as const
 import ATE.version as version
+import ATE.instrument as instrument
+import ATE.fixtures as fixtures
 
 class TestSuite(object):
     "Suite of tests for the user to complete. Controls the running and state of tests. Call TestSuite.reset() before interacting with any tests. "
@@ -15,6 +18,33 @@ class TestSuite(object):
     timer = None
     summary_shown = False
 
+    # Optional ATE.results.ResultsStore. When set, every run, step and measurement is recorded to it.
+    results = None
+    run_id = None
+    serial = None
+
+    # Part number of the product variant under test, e.g. 4950-060-10-01
+    variant = None
+
+    # Optional ATE.analytics.Analytics updated with every measurement as it is recorded.
+    analytics = None
+
+    # Measurement limits of the loaded suite as {name: (lower, upper)}, from the limits file.
+    limits = {}
+
+    # Optional ATE.journal.Journal recording each completed step, so a run interrupted by a restart can be resumed.
+    journal = None
+
+    # Name of the fixture the suite tests boards in, and an optional ATE.fixtures.Station told when it needs the operator.
+    # Only needed when several fixtures share the controller.
+    fixture = None
+    station = None
+
+    def __init__(self):
+        self.tests = []
+        self.thread = None
+
+    @instrument.timed("suite.ready", category = "step")
     def ready(self):
         "Instructs the suite to show the intro text and await operator input."
         self.form.set_info_default()
@@ -25,35 +55,110 @@ class TestSuite(object):
         self.form.disable_abort_button()
         self.form.disable_test_buttons()
         self.form.clear_duration()
+        self.set_fixture_state("idle")
+
+    def set_fixture_state(self, state):
+        "Tells the station whether the fixture is idle, waiting for the operator (manual) or running on its own (automatic)"
+        if self.station:
+            self.station.update(self.fixture, state)
 
     def execute(self):
         "Processes any GUI updates for the current test and runs the current test's setUp() and run() methods in a thread"
 
-        thread = Thread(target = self._execute)
+        thread = Thread(target = self._execute, name = "Test%d" % self.current_test)
         thread.start()
+        self.thread = thread
 
     def _execute(self):
         "Thread worker for running GUI updates, executing the test and potentially advancing to the next test."
         
+        name = type(self.tests[self.current_test]).__name__
+        test = self.tests[self.current_test]
+
+        # The test's ADC reads are scheduled for this fixture, and the operator isn't needed until it has run.
+        fixtures.set_current(self.fixture)
+        self.set_fixture_state("automatic")
+
         # GUI isn't created when running Unit Tests so we check here before doing GUI operations.
         if self.form:
-            self.form.set_info_default()
-            self.form.enable_control_buttons()
-            self.form.update_current_test(self.tests[self.current_test])
+            with instrument.span("suite.prepare_form"):
+                self.form.set_info_default()
+                self.form.enable_control_buttons()
+                self.form.update_current_test(self.tests[self.current_test])
 
-            # We enable pass/fail buttons automatically after a delay if the test allows it and it's not going to auto advance on pass.
-            if self.tests[self.current_test].enable_pass_fail and not self.tests[self.current_test].auto_advance:
-                self.form.enable_test_buttons_delay()
-            else:
-                self.form.disable_test_buttons()
+                # We enable pass/fail buttons automatically after a delay if the test allows it and it's not going to auto advance on pass.
+                if self.tests[self.current_test].enable_pass_fail and not self.tests[self.current_test].auto_advance:
+                    self.form.enable_test_buttons_delay()
+                else:
+                    self.form.disable_test_buttons()
 
         self.tests[self.current_test].breakout = False
-        self.tests[self.current_test].setUp()
-        self.tests[self.current_test].run()
+        self.tests[self.current_test].started = time.time()
+
+        with instrument.span(name + ".setUp"):
+            self.tests[self.current_test].setUp()
+        with instrument.span(name + ".run"):
+            self.tests[self.current_test].run()
 
         # If the current test is set to advance on pass and it has passed, advance it!
         if self.tests[self.current_test].state == "passed" and self.tests[self.current_test].auto_advance:
             self.advance_test()
+        elif self.tests[self.current_test] is test:
+            # Waiting for the operator to carry out the step's instructions or press PASS or FAIL.
+            self.set_fixture_state("manual")
+
+    def run_unattended(self):
+        "Runs every test from the beginning to the summary without an operator, pressing PASS on any test which doesn't fail. Returns once the summary is shown"
+        self.current_test = -1
+        self.summary_shown = False
+        self.reset()
+
+        while not self.summary_shown:
+            thread = self.thread
+            thread.join()
+
+            # A test which auto advances has already started the next one.
+            if self.thread is not thread or self.summary_shown:
+                continue
+
+            if self.tests[self.current_test].state == "failed":
+                self.fail_test()
+            else:
+                self.pass_test()
+
+    def load(self, config, index):
+        "Adds the tests listed in the [suiteN] section of config (a ConfigParser of tests.ini) for suite index, followed by the completion message"
+        from ATE.configuration import suite_from_parser
+        self.configure(suite_from_parser(config, index))
+
+    def configure(self, suite_config):
+        "Replaces the tests with those of suite_config (an ATE.configuration.SuiteConfig), followed by the completion message"
+        import ATE.tests as tests
+
+        self.tests = []
+        self.selected_suite = int(suite_config.index)
+        self.variant = suite_config.variant
+        self.limits = suite_config.limits
+
+        for cls in suite_config.test_classes():
+            self.add_test(cls())
+
+        # Add a final "test" to show a generic completion message.
+        self.add_test(tests.TestEnd_TestsCompleted())
+
+    def switch_suite(self, suite_config):
+        "Loads suite_config in place of the current suite and shows the intro text, or leaves the last summary until the next reset. Returns False without changing anything while a test is running"
+        if not (self.current_test == -1 or self.summary_shown):
+            return False
+
+        with instrument.span("suite.switch"):
+            self.configure(suite_config)
+            if self.summary_shown:
+                # Keep the last board's summary on screen, e.g. when the ini files are edited. RESET shows the intro.
+                self.current_test = -1
+            else:
+                self.ready()
+        return True
 
     def add_test(self, test):
         "Adds an instance of tests.TestProcedure to the list of tests to run"
@@ -69,6 +174,7 @@ class TestSuite(object):
         "Sets the current test as failed. If the test aborts, summary is shown. If not, advances to the next test"
         self.tests[self.current_test].set_failed()
         if self.tests[self.current_test].aborts:
+            self.record_step()
             self.summary()
         else:
             self.advance_test()
@@ -78,6 +184,7 @@ class TestSuite(object):
         if self.form.abort_dialogue():
             self.form.disable_test_buttons()
             self.form.stop_duration_count()
+            self.record_step()
             self.summary()
 
     def reset(self):
@@ -91,8 +198,18 @@ class TestSuite(object):
 
         # If we've just loaded up after self.ready(), use the RESET button to initialise testing
         if self.current_test == -1:
+            # The serial identifies the board in the results and the journal. Cancelling the prompt goes back to the intro.
+            if (self.results or self.journal) and self.form:
+                serial = self.form.serial_dialogue()
+                if serial is None:
+                    self.ready()
+                    self.form.append_text_line("No serial number was entered, so testing has not started. Press RESET to try again.")
+                    return
+                self.serial = serial
+
             # Set up the digital I/O pins in case they've changed through previous tests.
-            digio.setup()
+            with instrument.span("suite.setup_io"):
+                digio.setup()
 
             if self.form:
                 self.form.reset_duration()
@@ -101,6 +218,12 @@ class TestSuite(object):
             # Reset any previous test results
             self.reset_test_results()
 
+            if self.results:
+                self.run_id = self.results.begin_run(self.serial, self.variant)
+
+            if self.journal:
+                self.journal.begin(self.run_id, self.serial, self.variant, self.selected_suite, [type(test).__name__ for test in self.tests])
+
             # Kick off the first test
             self.current_test = 0
             self.execute()
@@ -118,20 +241,100 @@ class TestSuite(object):
     def advance_test(self):
         "If tests are remaining in the queue, runs the current test's tearDown() method and advances to the next test. If no tests are remaining, shows summary"
 
+        self.record_step()
+
         # Check to see if we've got more groups to run. If we don't, show the summary.
         if self.current_test >= len(self.tests) -1:
             
-            self.form.stop_duration_count()
             # If our form is declared, run the summary method. If not, we're likely running from unit tests so ignore.
             if self.form:
+                self.form.stop_duration_count()
                 self.summary()
 
         else:
             # If we do have more tests, clean up the current test, advance the current test variable and execute the test.
-            self.tests[self.current_test].tearDown()
+            with instrument.span(type(self.tests[self.current_test]).__name__ + ".tearDown"):
+                self.tests[self.current_test].tearDown()
             self.current_test += 1
             self.execute()
 
+    def resume(self, unfinished):
+        "Continues a run interrupted by a restart at its first incomplete step. unfinished is the run returned by Journal.unfinished()"
+        with instrument.span("suite.setup_io"):
+            digio.setup()
+
+        if self.form:
+            self.form.reset_duration()
+            self.form.start_duration_count()
+
+        # Restore the state of the steps completed before the restart, for the summary.
+        self.reset_test_results()
+        for position, step in unfinished["steps"].items():
+            self.tests[position].state = step["state"]
+            self.tests[position].failure_log = list(step["failures"])
+
+        self.serial = unfinished["serial"]
+        self.run_id = unfinished["run_id"]
+        if self.results:
+            if self.run_id is None:
+                self.run_id = self.results.begin_run(self.serial, self.variant)
+            else:
+                self.results.resume_run(self.run_id, self.serial, self.variant)
+
+        self.summary_shown = False
+        self.current_test = unfinished["next"]
+        self.execute()
+
+    def record_step(self):
+        "Writes the current test's state to the journal and the results store, if they are configured"
+        test = self.tests[self.current_test]
+
+        if self.journal:
+            self.journal.step(self.current_test, type(test).__name__, test.state, test.failure_log)
+
+        if not self.results or self.run_id is None:
+            return
+
+        duration = None
+        if test.started is not None:
+            duration = time.time() - test.started
+
+        self.results.record_step(self.run_id, self.current_test, type(test).__name__, test.description, test.state, test.started, duration, test.failure_log)
+
+    def record_measurement(self, test, name, value, lower = None, upper = None, passed = None, readings = None):
+        "Writes a measurement taken by test to the results store and analytics, if they are configured"
+        if self.analytics:
+            self.analytics.update(self.variant, name, value, lower, upper, passed)
+
+        if not self.results or self.run_id is None:
+            return
+
+        self.results.record_measurement(self.run_id, type(test).__name__, name, value, lower, upper, passed, readings)
+
+    def end_run(self, outcome):
+        "Marks the current run as finished in the journal and the results store, if they are configured"
+        if self.journal:
+            self.journal.end(outcome)
+
+        if not self.results or self.run_id is None:
+            return
+
+        duration = None
+        if self.form:
+            duration = self.form.duration
+
+        self.results.end_run(self.run_id, outcome, duration)
+        self.run_id = None
+
+    def show_statistics(self):
+        "Shows the SPC statistics for the current variant in the information box when no test is running"
+        if not self.analytics or not (self.current_test == -1 or self.summary_shown):
+            return
+
+        self.form.set_info_default()
+        self.form.set_text("Measurement statistics for {}\n\n{}".format(self.variant, self.analytics.format_summary(self.variant)))
+
+    @instrument.timed("suite.summary", category = "step")
     def summary(self):
         "Writes a summary of the loaded tests and their results"
         #self.current_test = -1
@@ -141,7 +344,7 @@ class TestSuite(object):
         # Reset digital I/O back to defaults
         digio.setup()
 
-        results = "Test suite completed in {} seconds.".format(self.form._count)
+        results = "Test suite completed in {} seconds.".format(self.form.duration)
         failures = []
         passes = []
         not_run = []
@@ -171,10 +374,15 @@ class TestSuite(object):
 
         if len(failures) > 0:
             self.form.set_info_fail()
+            self.end_run("failed")
         elif len(failures) == 0 and len(passes) > 0:
             self.form.set_info_pass()
+            self.end_run("passed" if len(not_run) == 0 else "aborted")
+        else:
+            self.end_run("aborted")
 
         self.form.set_text(results)
         self.form.disable_test_buttons()
         self.summary_shown = True
+        self.set_fixture_state("idle")
 
@@ -6,6 +6,10 @@ from ATE.suite import TestSuite
 from ATE.adc import Channel
 import ATE.digio as digio
 import ATE.adc as adc
+import ATE.capture as capture
+import ATE.linequality as linequality
+import ATE.thermal as thermal
+import ATE.datalog as datalog
 from ATE.const import *
 
 class TestProcedure(object):
@@ -24,6 +28,9 @@ class TestProcedure(object):
     # suite will advance to the next test automatically.
     auto_advance = False
 
+    # Paths of images the test shows with append_image(). They are loaded when the suite starts.
+    images = []
+
     # If set to True, the pass/fail buttons will be enabled at the beginning of the test after a delay.
     # If set to False, the pass/fail buttons will be disabled. The test will need to enable them during execution.
     enable_pass_fail = True
@@ -32,6 +39,9 @@ class TestProcedure(object):
     state = "not_run"
     failure_log = []
 
+    # Time the test was last started, set by the suite.
+    started = None
+
     def setUp(self):
         "This method is called before run(). Tasks to be completed before the test itself begins should go here."
         pass
@@ -48,6 +58,7 @@ class TestProcedure(object):
         "Sets the current test as passed, enables the PASS button and disables the FAIL button."
         self.breakout = True
         self.state = "passed"
+        datalog.log("state", type(self).__name__, self.state)
 
         if self.suite.form:
             self.suite.form.enable_pass_button()
@@ -57,6 +68,7 @@ class TestProcedure(object):
         "Sets the current test as failed, enables the FAIL button and disables the PASS button."
         self.breakout = True
         self.state = "failed"
+        datalog.log("state", type(self).__name__, self.state)
 
         if self.suite.form:
             self.suite.form.disable_pass_button()
@@ -67,6 +79,7 @@ class TestProcedure(object):
         self.breakout = True
         self.failure_log = []
         self.state = "not_run"
+        datalog.log("state", type(self).__name__, self.state)
 
     def log_failure(self, text, print_to_screen = True):
         "Adds the specified text to the test's failure_log list and appends text to the form info label"
@@ -75,6 +88,14 @@ class TestProcedure(object):
         if print_to_screen:
             self.suite.form.append_text_line(text)
 
+    def record_measurement(self, name, value, lower = None, upper = None, passed = None, readings = None):
+        "Records a measurement taken by this test in the suite's results store. readings is an optional list of the raw samples behind value"
+        self.suite.record_measurement(self, name, value, lower, upper, passed, readings)
+
+    def limit(self, name, lower, upper):
+        "Returns (lower, upper) for the named measurement from the suite's limits file, or the lower and upper given if it has none"
+        return self.suite.limits.get(name, (lower, upper))
+
     def format_state(self):
         return {
             "passed": "Passed",
@@ -86,6 +107,7 @@ class TestProcedure(object):
 class TestXX_FakeTest(TestProcedure):
 
     description = "Fake test"
+    images = ["Resources/Untitled.gif"]
 
     def run(self):
 
@@ -176,11 +198,35 @@ class TestB2_FirstStage(TestProcedure):
 
     description = "First stage test"
 
+    # Rails captured as the pogo pins are switched on, with the voltage each counts as up at.
+    rails = {"AD1": 4.5, "AD2": 4.5, "AD8": 4.5}
+
     def run(self):
 
-        digio.set_high(DOP11_POGO_ON_GPIO)
-    
-        dig_inputs = digio.read_all_inputs()
+        # Switch on while capturing the rails, recording how quickly each came up and when.
+        # Rise times are only judged if the limits file has limits for them, e.g. "AD1 rise = 0.0, 0.05".
+        traces = capture.Capture(sorted(self.rails), window = 0.25).fire(DOP11_POGO_ON_GPIO)
+        rise_failures = []
+        for name in sorted(self.rails):
+            seconds = traces[name].rise_time()
+            reached = traces[name].crossing(self.rails[name])
+            if reached is not None:
+                self.record_measurement(name + " up at", reached)
+            lower, upper = self.limit(name + " rise", None, None)
+            if seconds is None:
+                # A rail which didn't step from its initial voltage has no rise time, which fails a judged rise.
+                if lower is not None:
+                    rise_failures.append("%s didn't rise" % name)
+                continue
+
+            passed = None
+            if lower is not None:
+                passed = lower <= seconds <= upper
+                if not passed:
+                    rise_failures.append("%s rose in %.1fms (>= %.1fms, <= %.1fms)" % (name, seconds * 1000, lower * 1000, upper * 1000))
+            self.record_measurement(name + " rise", seconds, lower, upper, passed)
+
+        dig_inputs = dict((key, 1 if value == "High" else 0) for key, value in digio.read_all_inputs().items())
         dig_expected = {
             "DIP1": 1,
             "DIP2": 0,
@@ -198,69 +244,49 @@ class TestB2_FirstStage(TestProcedure):
         if self.suite.selected_suite == 0 or self.suite.selected_suite == 2:
             dig_expected["DIP7"] = 1
 
-        if dig_inputs == dig_expected:
-            self.set_passed()
-        else:
+        failed = False
+        if dig_inputs != dig_expected:
+            failed = True
             self.suite.form.set_text("Failure on power up")
             if dig_inputs["DIP1"] == 0:
-                self.suite.form.append_text("Output failure")
+                self.suite.form.append_text_line("Output failure")
             if dig_inputs["DIP5"] == 0:
-                self.suite.form.append_text("Pogo failed to turn on")
+                self.suite.form.append_text_line("Pogo failed to turn on")
             if (self.suite.selected_suite == 0 or self.suite.selected_suite == 2) and dig_inputs["DIP7"] == 0:
-                self.suite.form.append_text("Link LK3 was not made")
+                self.suite.form.append_text_line("Link LK3 was not made")
             if (self.suite.selected_suite == 1 or self.suite.selected_suite == 3) and dig_inputs["DIP7"] == 1:
-                self.suite.form.append_text("Incorrect version entered?")
+                self.suite.form.append_text_line("Incorrect version entered?")
             if dig_inputs["DIP10"] == 0:
-                self.suite.form.append_text("Fault with J4 and J5 connectors")
+                self.suite.form.append_text_line("Fault with J4 and J5 connectors")
             if dig_inputs["DIP11"] == 0:
-                self.suite.form.append_text("Error with ATE")
-            self.set_failed()
+                self.suite.form.append_text_line("Error with ATE")
 
-        # Handle ADC channels
+        # Handle ADC channels. The limits given here are used when the limits file has none for the channel.
         channels = adc.get_all_channels()
-        adc_error = False
-
-        ad1b, ad1v = channels["AD1"].voltage_between(4.8, 5.2, 0.01)
-        if not ad1b:
-            self.suite.form.append_text("AD1: %d is out of bounds (>= 4.8, <= 5.2)" % ad1v)
-            adc_error = True
-
-        ad2b, ad2v = channels["AD2"].voltage_between(4.8, 5.2, 0.01)
-        if not ad2b:
-            self.suite.form.append_text("AD2: %d is out of bounds (>= 4.8, <= 5.2)" % ad2v)
-            adc_error = True
-
-        ad3b, ad3v = channels["AD3"].voltage_between(4.8, 5.2, 0.01)
-        if not ad3b:
-            self.suite.form.append_text("AD3: %d is out of bounds (>= 4.8, <= 5.2)" % ad3v)
-            adc_error = True
-
-        ad4b, ad4v = channels["AD4"].voltage_between(1.8, 3.2, 0.01)
-        if not ad4b:
-            self.suite.form.append_text("AD4: %d is out of bounds (>= 1.8, <= 3.2)" % ad4v)
-            adc_error = True
-
-        ad5b, ad5v = channels["AD5"].voltage_between(0.2, 1.5, 0.01)
-        if not ad5b:
-            self.suite.form.append_text("AD5: %d is out of bounds (>= 0.2, <= 1.5)" % ad5v)
-            adc_error = True
-    
-        ad6b, ad6v = channels["AD6"].voltage_between(0.2, 0.5, 0.01)
-        if not ad6b:
-            self.suite.form.append_text("AD6: %d is out of bounds (>= 0.2, <= 0.5)" % ad6v)
-            adc_error = True
-
-        ad7b, ad7v = channels["AD7"].voltage_between(0.1, 1.5, 0.01)
-        if not ad7b:
-            self.suite.form.append_text("AD7: %d is out of bounds (>= 0.1, <= 1.5)" % ad7v)
-            adc_error = True
-
-        ad8b, ad8v = channels["AD8"].voltage_between(4.75, 5.15, 0.01)
-        if not ad8b:
-            self.suite.form.append_text("AD8: %d is out of bounds (>= 4.75, <= 5.15)" % ad8v)
-            adc_error = True
-
-        if adc_error:
+        default_limits = [
+            ("AD1", 4.8, 5.2),
+            ("AD2", 4.8, 5.2),
+            ("AD3", 4.8, 5.2),
+            ("AD4", 1.8, 3.2),
+            ("AD5", 0.2, 1.5),
+            ("AD6", 0.2, 0.5),
+            ("AD7", 0.1, 1.5),
+            ("AD8", 4.75, 5.15)
+        ]
+
+        for name, lower, upper in default_limits:
+            lower, upper = self.limit(name, lower, upper)
+            between, voltage = channels[name].voltage_between(lower, upper, 0.01)
+            self.record_measurement(name, voltage, lower, upper, between)
+            if not between:
+                self.suite.form.append_text_line("%s: %.2f is out of bounds (>= %s, <= %s)" % (name, voltage, lower, upper))
+                failed = True
+
+        for text in rise_failures:
+            self.suite.form.append_text_line(text)
+            failed = True
+
+        if failed:
             self.set_failed()
         else:
             self.set_passed()
@@ -287,10 +313,108 @@ class TestB3_5_PowerMgmt_ThermalProtection(TestProcedure):
 
     description = "Power Management Board - Thermal Protection"
 
+    # Channel showing the board's protection reacting, and the voltage it falls below when it does.
+    response = "AD7"
+    threshold = 0.1
+
+    # (name, output, lower, upper) of each simulation and the temperature it should read as, in degrees C.
+    simulations = [
+        ("Hot", DOP8_Hot_sim, 45.0, 125.0),
+        ("Cold", DOP7_Cold_sim, -40.0, 0.0)
+    ]
+
+    # Temperature the NTC should read with neither simulation on.
+    ambient = (10.0, 40.0)
+
+    def run(self):
+
+        self.suite.form.set_text("Testing thermal protection")
+        failed = False
+
+        lower, upper = self.limit("NTC temperature", *self.ambient)
+        temperature = thermal.default_ntc.temperature(adc.get_channel("AD4").read_voltage(fresh = True))
+        passed = lower <= temperature <= upper
+        self.record_measurement("NTC temperature", temperature, lower, upper, passed)
+        if not passed:
+            failed = True
+            self.log_failure("NTC reads %.1fC (>= %.1fC, <= %.1fC)" % (temperature, lower, upper))
+
+        # Trip and recovery times are judged if the limits file has limits for them, e.g. "Hot trip time = 0, 0.1".
+        for name, pin, lower, upper in self.simulations:
+            reaction = thermal.ThermalCheck(name, pin, self.response, self.threshold).run()
+
+            lower, upper = self.limit(name + " temperature", lower, upper)
+            passed = lower <= reaction.temperature <= upper
+            self.record_measurement(name + " temperature", reaction.temperature, lower, upper, passed)
+            if not passed:
+                failed = True
+                self.log_failure("%s simulation reads %.1fC (>= %.1fC, <= %.1fC)" % (name, reaction.temperature, lower, upper))
+
+            for measurement, seconds, action in ((name + " trip time", reaction.trip_time, "trip"), (name + " recovery time", reaction.recovery_time, "recover")):
+                if seconds is None:
+                    failed = True
+                    self.log_failure("%s simulation: protection didn't %s" % (name, action))
+                    continue
+
+                lower, upper = self.limit(measurement, None, None)
+                passed = None
+                if lower is not None:
+                    passed = lower <= seconds <= upper
+                    if not passed:
+                        failed = True
+                        self.log_failure("%s: %.1fms is out of bounds (>= %.1fms, <= %.1fms)" % (measurement, seconds * 1000, lower * 1000, upper * 1000))
+                self.record_measurement(measurement, seconds, lower, upper, passed)
+
+        if failed:
+            self.set_failed()
+        else:
+            self.set_passed()
+
 class TestB4_1_ConnectionBoard_LineQuality(TestProcedure):
 
     description = "Connection Board - Line Quality"
-        
+
+    # (name, output, input) of each loopback through the connection board.
+    # DOP10_FLT_loop_back has no return input assigned in const.py yet, so only J7 is tested.
+    lines = [
+        ("J7", DOP9_TO_J7_1, DIP6_From_J7_4)
+    ]
+
+    def run(self):
+
+        self.suite.form.set_text("Testing line quality")
+        failed = False
+
+        # Rates and delays are judged if the limits file has limits for them, e.g. "J7 rate = 1000, 1e9".
+        for name, output, input in self.lines:
+            result = linequality.LineTest(name, output, input).run()
+            self.record_measurement(name + " errors", result.errors)
+
+            if not result.passed:
+                failed = True
+                if result.rate is None:
+                    self.log_failure("%s: %d of %d bits wrong even at the slowest rate" % (name, result.errors, result.bits))
+                if result.delay is None:
+                    self.log_failure("%s: input doesn't follow the output" % name)
+                continue
+
+            for measurement, value, scale, unit in ((name + " rate", result.rate, 0.001, "kbit/s"), (name + " delay", result.delay, 1000000, "us")):
+                lower, upper = self.limit(measurement, None, None)
+                passed = None
+                if lower is not None:
+                    passed = lower <= value <= upper
+                    if not passed:
+                        failed = True
+                        self.log_failure("%s: %.1f%s is out of bounds (>= %.1f, <= %.1f)" % (measurement, value * scale, unit, lower * scale, upper * scale))
+                self.record_measurement(measurement, value, lower, upper, passed)
+
+            self.suite.form.append_text_line("%s: %.1fkbit/s, %.1fus" % (name, result.rate / 1000, result.delay * 1000000))
+
+        if failed:
+            self.set_failed()
+        else:
+            self.set_passed()
+
 
 class TestEnd_TestsCompleted(TestProcedure):
     
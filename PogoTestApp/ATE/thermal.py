@@ -0,0 +1,131 @@
+"""
+Thermal protection testing: NTC temperature from the TP13 voltage (AD4), and the time the board takes to react
+when the cold or hot simulation output switches its NTC reading out of range and back.
+
+The NTC is assumed to be the lower leg of a divider from a reference voltage, so the TP13 voltage falls as the
+temperature rises. The temperature for each voltage is looked up in a table computed once from the NTC's beta
+equation and interpolated between its points.
+"""
+
+import math
+from array import array
+from bisect import bisect_left
+
+from ATE import capture
+from ATE import datalog
+from ATE import instrument
+
+# NumPy is optional. It is only used to convert whole traces to temperatures in one operation.
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+class NTC(object):
+    "Voltage to temperature table for an NTC thermistor below a fixed resistor"
+
+    def __init__(self, r25 = 10000.0, beta = 3435.0, r_fixed = 10000.0, v_ref = 5.0, low = -40.0, high = 125.0, step = 0.5):
+        self.r25 = r25
+        self.beta = beta
+        self.r_fixed = r_fixed
+        self.v_ref = v_ref
+
+        # Ascending voltages and their temperatures. The voltage falls as the temperature rises, so the
+        # table is built from the hottest point down.
+        count = int(round((high - low) / step)) + 1
+        self.temperatures = array("d", (high - index * step for index in range(count)))
+        self.voltages = array("d", (self.voltage(temperature) for temperature in self.temperatures))
+
+    def resistance(self, temperature):
+        "Returns the NTC's resistance at temperature in degrees C"
+        return self.r25 * math.exp(self.beta * (1.0 / (temperature + 273.15) - 1.0 / 298.15))
+
+    def voltage(self, temperature):
+        "Returns the divider voltage at temperature in degrees C"
+        resistance = self.resistance(temperature)
+        return self.v_ref * resistance / (resistance + self.r_fixed)
+
+    def temperature(self, voltage):
+        "Returns the temperature in degrees C for a divider voltage, limited to the table's range"
+        voltages = self.voltages
+        index = bisect_left(voltages, voltage)
+        if index <= 0:
+            return self.temperatures[0]
+        if index >= len(voltages):
+            return self.temperatures[-1]
+
+        lower, upper = voltages[index - 1], voltages[index]
+        fraction = (voltage - lower) / (upper - lower)
+        return self.temperatures[index - 1] + fraction * (self.temperatures[index] - self.temperatures[index - 1])
+
+    def temperatures_of(self, voltages):
+        "Returns the temperatures for a sequence of voltages"
+        if numpy is not None:
+            return numpy.interp(voltages, self.voltages, self.temperatures)
+        return [self.temperature(voltage) for voltage in voltages]
+
+# Table used by the tests unless another is given.
+default_ntc = NTC()
+
+class Reaction(object):
+    "Outcome of switching one simulation output on and off"
+
+    def __init__(self, name, temperature, trip_time, recovery_time):
+        self.name = name
+        self.temperature = temperature          # degrees C the NTC read while simulated
+        self.trip_time = trip_time              # seconds from the output switching on to the board reacting, or None
+        self.recovery_time = recovery_time      # seconds from the output switching off to the board recovering, or None
+
+    def __repr__(self):
+        return "Reaction(%r, %.1fC, trip %r, recovery %r)" % (self.name, self.temperature, self.trip_time, self.recovery_time)
+
+class ThermalCheck(object):
+    """
+    Switches a simulation output on and then off, capturing the NTC channel and the channel showing the board's
+    response. The board has reacted when the response channel crosses threshold (downwards unless rising).
+    """
+
+    # NTC channel.
+    ntc_channel = "AD4"
+
+    # Seconds captured after switching the output each way.
+    window = 0.5
+
+    def __init__(self, name, pin, response, threshold, rising = False, ntc = None):
+        self.name = name
+        self.pin = pin
+        self.response = response
+        self.threshold = threshold
+        self.rising = rising
+        self.ntc = ntc or default_ntc
+
+    def _reaction_time(self, traces, rising):
+        "Seconds from the NTC reading changing to the response crossing threshold, or None if it didn't or had already"
+        initial = traces[self.response].initial()
+        if (initial >= self.threshold) if rising else (initial <= self.threshold):
+            return None
+
+        ntc = traces[self.ntc_channel]
+        start, end = ntc.initial(), ntc.final()
+        switched = ntc.crossing((start + end) / 2, end > start) if end != start else 0.0
+        reacted = traces[self.response].crossing(self.threshold, rising)
+        if switched is None or reacted is None:
+            return None
+        return max(0.0, reacted - switched)
+
+    @instrument.timed("ThermalCheck.run", category = "thermal")
+    def run(self):
+        "Returns a Reaction"
+        channels = [self.ntc_channel, self.response]
+        trip = capture.Capture(channels, self.window)
+        tripped = trip.fire(self.pin, True)
+        temperature = self.ntc.temperature(tripped[self.ntc_channel].final())
+        trip_time = self._reaction_time(tripped, self.rising)
+
+        recover = capture.Capture(channels, self.window)
+        recovered = recover.fire(self.pin, False)
+        recovery_time = self._reaction_time(recovered, not self.rising)
+
+        reaction = Reaction(self.name, temperature, trip_time, recovery_time)
+        datalog.log("thermal", self.name, temperature, repr(reaction))
+        return reaction
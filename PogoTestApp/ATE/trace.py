@@ -0,0 +1,72 @@
+"Chrome trace-event recording of spans across threads, viewable in Perfetto or chrome://tracing"
+
+import os
+import json
+import threading
+from collections import deque
+from time import perf_counter
+
+# Tracing is off by default. Spans and timed functions in ATE.instrument record events here while it is on.
+enabled = False
+
+# Maximum number of events kept. The oldest events are discarded once the buffer is full.
+buffer_size = 200000
+
+_events = deque(maxlen = buffer_size)
+_thread_names = {}
+_origin = perf_counter()
+
+def start(size = None):
+    "Clears the buffer and starts recording events"
+    global enabled, _events, _origin
+
+    if size is not None:
+        _events = deque(maxlen = size)
+    else:
+        _events.clear()
+
+    _thread_names.clear()
+    _origin = perf_counter()
+    enabled = True
+
+def stop():
+    "Stops recording events. The buffer is kept until start() is called again"
+    global enabled
+    enabled = False
+
+def _record(phase, name, category):
+    tid = threading.get_ident()
+    if tid not in _thread_names:
+        _thread_names[tid] = threading.current_thread().name
+    # deque.append is atomic so no lock is needed between threads.
+    _events.append((phase, name, category, perf_counter(), tid))
+
+def begin(name, category = "ate"):
+    "Records the start of a span on the current thread"
+    _record("B", name, category)
+
+def end(name, category = "ate"):
+    "Records the end of the span most recently begun on the current thread"
+    _record("E", name, category)
+
+def instant(name, category = "ate"):
+    "Records a single point in time on the current thread"
+    _record("i", name, category)
+
+def events():
+    "Returns the recorded events as a list of Chrome trace-event dictionaries"
+    pid = os.getpid()
+    result = [{"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}} for tid, name in list(_thread_names.items())]
+
+    for phase, name, category, timestamp, tid in list(_events):
+        event = {"name": name, "cat": category, "ph": phase, "ts": (timestamp - _origin) * 1000000, "pid": pid, "tid": tid}
+        if phase == "i":
+            event["s"] = "t"
+        result.append(event)
+
+    return result
+
+def dump(path):
+    "Writes the buffer to path in Chrome trace-event JSON format"
+    with open(path, "w") as f:
+        json.dump({"traceEvents": events(), "displayTimeUnit": "ms"}, f)
@@ -0,0 +1,168 @@
+"Strip chart trend plots of the analogue channels"
+
+import tkinter as tk
+import tkinter.constants as tkc
+from array import array
+from collections import deque
+
+class History(object):
+    "Bounded ring buffer of samples for one channel. Once full, each new sample replaces the oldest."
+
+    def __init__(self, capacity = 3600):
+        self.capacity = capacity
+        self._samples = array("d", [0.0]) * capacity
+        self._next = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def append(self, value):
+        self._samples[self._next] = value
+        self._next = (self._next + 1) % self.capacity
+        self._count = min(self._count + 1, self.capacity)
+
+    def values(self):
+        "Returns the samples oldest first"
+        start = (self._next - self._count) % self.capacity
+        if start + self._count <= self.capacity:
+            return self._samples[start:start + self._count].tolist()
+        return (self._samples[start:] + self._samples[:self._next]).tolist()
+
+    def decimate(self, columns, samples_per_column = 1):
+        "Returns (minimum, maximum) for each of up to columns columns of samples_per_column samples, newest column last"
+        values = self.values()[-columns * samples_per_column:]
+
+        # Align columns to the newest sample so a partly filled column is the oldest one.
+        first = len(values) % samples_per_column
+        result = []
+        if first:
+            result.append((min(values[:first]), max(values[:first])))
+
+        for index in range(first, len(values), samples_per_column):
+            chunk = values[index:index + samples_per_column]
+            result.append((min(chunk), max(chunk)))
+
+        return result[-columns:]
+
+def columns_for(capacity, width):
+    "Returns the samples per pixel column which fit a history of capacity samples into width columns"
+    return max(1, -(-capacity // width))
+
+def scale_for(values, minimum_span = 0.05, margin = 0.1):
+    """
+    Returns (lower, upper) volts fitting values with margin of the span to spare at each end. The span is at least
+    minimum_span, so a steady rail isn't magnified into noise.
+    """
+    if not values:
+        return 0.0, minimum_span
+    low, high = min(values), max(values)
+    span = max(high - low, minimum_span)
+    middle = (low + high) / 2
+    return middle - span * (0.5 + margin), middle + span * (0.5 + margin)
+
+class TrendView(tk.Canvas):
+    """
+    Strip chart of a channel's history. Each pixel column is a vertical line from the minimum to the maximum of
+    samples_per_column samples, so drawing costs the same whatever the history length. New columns are added on
+    the right and existing ones moved left, rather than redrawing the whole chart.
+
+    By default the whole history fits the width, and the vertical scale fits the samples shown. The chart is
+    redrawn at a new scale when a sample falls outside it. Pass lower and upper to fix the scale.
+    """
+
+    def __init__(self, master, history, label, lower = None, upper = None, samples_per_column = None, width = 180, height = 70):
+        super().__init__(master, width = width, height = height, bg = "black", highlightthickness = 0)
+        self.history = history
+        self.label = label
+        self.fixed_scale = lower is not None and upper is not None
+        self.lower = lower
+        self.upper = upper
+        self.samples_per_column = samples_per_column or columns_for(history.capacity, width)
+        self.plot_width = width
+        self.plot_height = height
+
+        self._columns = deque()
+        self._column_min = None
+        self._column_max = None
+        self._column_samples = 0
+
+        self.redraw()
+
+    def _y(self, value):
+        fraction = (value - self.lower) / (self.upper - self.lower)
+        fraction = min(max(fraction, 0.0), 1.0)
+        return int(round((1 - fraction) * (self.plot_height - 1)))
+
+    def _draw_column(self, x, minimum, maximum):
+        return self.create_line(x, self._y(maximum), x, self._y(minimum) + 1, fill = "lightgreen", tags = "trace")
+
+    def redraw(self):
+        "Clears and draws the whole chart from the history, rescaling it unless the scale is fixed. Only needed when the chart is first shown or a sample is off the scale"
+        self.delete(tkc.ALL)
+        self._columns.clear()
+        self._column_samples = 0
+
+        columns = self.history.decimate(self.plot_width, self.samples_per_column)
+        if not self.fixed_scale:
+            self.lower, self.upper = scale_for([value for column in columns for value in column])
+
+        offset = self.plot_width - len(columns)
+        for index, (minimum, maximum) in enumerate(columns):
+            self._columns.append(self._draw_column(offset + index, minimum, maximum))
+
+        self.create_text(3, 2, anchor = tkc.NW, text = self.label, fill = "white", font = ("Arial", 8), tags = "label")
+        self._value_text = self.create_text(self.plot_width - 3, 2, anchor = tkc.NE, text = "", fill = "white", font = ("Arial", 8), tags = "label")
+        self.create_text(self.plot_width - 3, self.plot_height - 2, anchor = tkc.SE, text = "%.2f-%.2fV" % (self.lower, self.upper), fill = "gray", font = ("Arial", 7), tags = "label")
+
+    def add(self, value):
+        "Adds a sample to the current column. When the column is complete the chart scrolls left by one pixel and the column is drawn"
+        # The history already holds the sample, so redrawing at the new scale includes it.
+        if not self.fixed_scale and not self.lower <= value <= self.upper:
+            self.redraw()
+            self.itemconfigure(self._value_text, text = "%.2f" % value)
+            return
+
+        self.itemconfigure(self._value_text, text = "%.2f" % value)
+
+        if self._column_samples == 0:
+            self._column_min = self._column_max = value
+        else:
+            self._column_min = min(self._column_min, value)
+            self._column_max = max(self._column_max, value)
+        self._column_samples += 1
+
+        if self._column_samples < self.samples_per_column:
+            return
+
+        self._column_samples = 0
+        self.move("trace", -1, 0)
+        self._columns.append(self._draw_column(self.plot_width - 1, self._column_min, self._column_max))
+
+        while len(self._columns) > self.plot_width:
+            self.delete(self._columns.popleft())
+
+class TrendPanel(tk.Toplevel):
+    "Window of trend views for the selected analogue channels"
+
+    def __init__(self, master, histories, channels, names = None, samples_per_column = None):
+        super().__init__(master)
+        self.title("Trends")
+        self.geometry("800x480")
+        self.views = {}
+
+        for index, key in enumerate(channels):
+            name = names[key] if names else key
+            view = TrendView(self, histories[key], name, samples_per_column = samples_per_column)
+            view.grid(column = index % 4, row = index // 4, padx = 5, pady = 5)
+            self.views[key] = view
+
+        close = tk.Button(self, text = "CLOSE", font = "Arial 18 bold", command = self.destroy)
+        close.grid(column = 0, row = (len(channels) + 3) // 4, columnspan = 4, pady = 10)
+
+    def add(self, readings):
+        "Adds the new readings to each view showing them"
+        for key, view in self.views.items():
+            value = readings.get(key)
+            if isinstance(value, float):
+                view.add(value)
@@ -0,0 +1,191 @@
+"""
+Benchmarks
+
+Measures the speed of the ADC and GPIO drivers, the measurement helpers and complete simulated suite runs.
+Like UnitTests.py this runs without the ADC or GPIO hardware, using the simulation features and dummy modules.
+
+    python Benchmarks.py                          run everything and print the results
+    python Benchmarks.py --save baseline.json     also store the results as a baseline
+    python Benchmarks.py --compare baseline.json  flag anything slower than the baseline (exit code 1 on regression)
+"""
+
+import sys
+import json
+import argparse
+import configparser
+import statistics
+from time import perf_counter
+
+from ADCPi.ABE_ADCPi import ADCPi
+from ATE.adc import Channel
+from ATE import filters
+from ATE.suite import TestSuite
+from ATE.gui import HeadlessForm
+import ATE.digio as digio
+import RPiDummy.GPIODummy as GPIODummy
+
+class FakeBus(object):
+    "Stands in for smbus.SMBus. Returns a fixed conversion result, reporting it not ready for the first polls - 1 reads."
+
+    def __init__(self, reading = (0x07, 0xFF, 0x00, 0x00), polls = 1):
+        self.reading = list(reading)
+        self.polls = polls
+        self._remaining = polls
+
+    def write_byte(self, address, value):
+        pass
+
+    def read_i2c_block_data(self, address, config, length):
+        self._remaining -= 1
+        if self._remaining > 0:
+            return [0, 0, 0x80, 0x80]
+        self._remaining = self.polls
+        return self.reading
+
+def measure(function, repeat = 7, min_time = 0.05):
+    "Times function, calling it enough times per repeat to take at least min_time seconds. Returns a dictionary of per-call statistics in seconds"
+    # Find how many calls fit into min_time.
+    number = 1
+    while True:
+        start = perf_counter()
+        for i in range(number):
+            function()
+        elapsed = perf_counter() - start
+        if elapsed >= min_time:
+            break
+        number *= 2 if elapsed == 0 else max(2, min(10, int(min_time / elapsed) + 1))
+
+    timings = []
+    for r in range(repeat):
+        start = perf_counter()
+        for i in range(number):
+            function()
+        timings.append((perf_counter() - start) / number)
+
+    timings.sort()
+    quartile = max(1, len(timings) // 4)
+    return {
+        "calls": number * repeat,
+        "median": statistics.median(timings),
+        "min": timings[0],
+        "mean": statistics.mean(timings),
+        "stdev": statistics.stdev(timings) if len(timings) > 1 else 0.0,
+        "iqr": timings[-quartile] - timings[quartile - 1]
+    }
+
+def benchmarks(config_path = "tests.ini"):
+    "Returns a list of (name, function, repeat, min_time) to measure"
+    result = []
+
+    # ADCPi.read_raw decoding for each resolution, with and without waiting for the conversion.
+    for rate in (12, 18):
+        for polls in (1, 4):
+            adc = ADCPi(FakeBus(polls = polls), 0x68, 0x69, rate)
+            result.append(("ADCPi.read_raw %d bit, %d poll(s)" % (rate, polls), lambda adc = adc: adc.read_raw(5), 7, 0.05))
+        adc = ADCPi(FakeBus(), 0x68, 0x69, rate)
+        result.append(("ADCPi.read_voltage %d bit" % rate, lambda adc = adc: adc.read_voltage(3), 7, 0.05))
+
+    channel = Channel(5)
+    channel.set_simulation_mode(True)
+    channel.set_simulation_voltage(0.4)
+    result.append(("Channel.read_voltage", channel.read_voltage, 7, 0.05))
+    result.append(("Channel.voltage_between", lambda: channel.voltage_between(0.2, 1.5, 0.01), 7, 0.05))
+    result.append(("Channel.read_voltage_range 10 samples", lambda: channel.read_voltage_range(10), 7, 0.05))
+
+    filtered = Channel(6, pipeline = filters.Pipeline(16, [filters.Median(5)]))
+    filtered.set_simulation_mode(True)
+    filtered.set_simulation_voltage(0.4)
+    result.append(("Channel.read_voltage 16 samples, median 5", filtered.read_voltage, 7, 0.05))
+
+    digio.setup()
+    result.append(("digio.read_all_inputs", digio.read_all_inputs, 7, 0.05))
+    result.append(("digio.read_all_outputs", digio.read_all_outputs, 7, 0.05))
+
+    def dummy_input(links):
+        def run():
+            saved = list(GPIODummy._links)
+            GPIODummy._links[:] = [(output, input) for output, input in links]
+            try:
+                for i in range(100):
+                    GPIODummy.input(digio.DIP6_From_J7_4)
+            finally:
+                GPIODummy._links[:] = saved
+        return run
+
+    links = [(digio.DOP9_TO_J7_1, digio.DIP6_From_J7_4)]
+    many_links = [(pin, pin + 1) for pin in range(1, 38, 2) if digio.DIP6_From_J7_4 not in (pin, pin + 1)] + links
+    result.append(("GPIODummy.input x100, 1 link", dummy_input(links), 7, 0.05))
+    result.append(("GPIODummy.input x100, %d links" % len(many_links), dummy_input(many_links), 7, 0.05))
+
+    # Complete suites run without an operator, one per variant in tests.ini.
+    config = configparser.ConfigParser()
+    config.read(config_path)
+
+    def run_suite(index):
+        def run():
+            suite = TestSuite()
+            suite.form = HeadlessForm(echo = False)
+            suite.load(config, index)
+            suite.run_unattended()
+        return run
+
+    for index in config["suites"]:
+        result.append(("Suite %s (%s)" % (index, config["suites"][index].split()[0]), run_suite(index), 5, 0.2))
+
+    return result
+
+def compare(results, baseline, threshold):
+    "Returns the names of benchmarks whose median is more than threshold (a fraction) slower than the baseline"
+    regressions = []
+    for name, stats in results.items():
+        if name in baseline and stats["median"] > baseline[name]["median"] * (1 + threshold):
+            regressions.append(name)
+    return regressions
+
+def main(argv):
+    parser = argparse.ArgumentParser(description = "X231 PCBA ATE benchmarks")
+    parser.add_argument("--save", metavar = "FILE", help = "write the results to FILE as a baseline")
+    parser.add_argument("--compare", metavar = "FILE", help = "compare the results against the baseline in FILE")
+    parser.add_argument("--threshold", type = float, default = 0.15, help = "fraction slower than the baseline median counted as a regression (default 0.15)")
+    parser.add_argument("--filter", default = "", help = "only run benchmarks whose name contains this text")
+    parser.add_argument("--config", default = "tests.ini", help = "suite configuration to run")
+    args = parser.parse_args(argv)
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    results = {}
+    print("{:<45} {:>12} {:>12} {:>10} {:>10}".format("Benchmark", "Median (us)", "Min (us)", "IQR %", "Change %"))
+
+    for name, function, repeat, min_time in benchmarks(args.config):
+        if args.filter not in name:
+            continue
+
+        stats = measure(function, repeat, min_time)
+        results[name] = stats
+
+        change = ""
+        if name in baseline:
+            change = "%+.1f" % ((stats["median"] / baseline[name]["median"] - 1) * 100)
+            if name in compare({name: stats}, baseline, args.threshold):
+                change += " REGRESSION"
+
+        print("{:<45} {:>12.2f} {:>12.2f} {:>10.1f} {:>10}".format(name, stats["median"] * 1000000, stats["min"] * 1000000, stats["iqr"] / stats["median"] * 100 if stats["median"] else 0, change))
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent = 2, sort_keys = True)
+
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print("\n%d regression(s) against %s:" % (len(regressions), args.compare))
+        for name in regressions:
+            print("    " + name)
+        return 1
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,145 @@
+"""
+X231 PCBA Automatic Test Equipment Control Software
+Copyright (c) 2016 Captec Ltd
+
+Command line access to the ATE without the GUI.
+
+    python Headless.py run [--suite 0] [--serial SN] [--db results.db] [--trace trace.json] [--profile] [--fixtures 2]
+    python Headless.py stats [--db results.db] [--variant 4950-060-10-02] [--days 7]
+    python Headless.py selftest [--budget 2.0]
+"""
+
+import sys
+import time
+import argparse
+import threading
+
+from ATE import results, analytics, suite, gui, digio, instrument, trace, selftest, configuration, fixtures, adc
+
+def run(args):
+    "Runs a suite from tests.ini without an operator, passing any test which doesn't fail, and prints the summary"
+    # The fixtures would share one set of pins and channels, so several only make sense without the hardware.
+    if args.fixtures > 1 and not adc.simulation_mode:
+        print("--fixtures needs simulation mode: there is no separate pin and channel mapping for each fixture")
+        return 2
+
+    configs = configuration.ConfigService(args.config, args.limits)
+
+    index = args.suite
+    if index is None:
+        index = configs.selected
+
+    if args.profile:
+        instrument.enabled = True
+    if args.trace:
+        trace.start()
+
+    store = results.ResultsStore(args.db) if args.db else None
+
+    # With more than one fixture the suites run side by side, sharing the ADC bus in turn.
+    station = fixtures.Station() if args.fixtures > 1 else None
+    suites = []
+    for number in range(args.fixtures):
+        test_suite = suite.TestSuite()
+        serial = args.serial
+        if station:
+            test_suite.fixture = chr(ord("A") + number)
+            test_suite.station = station
+
+            # Each fixture holds a different board.
+            if serial:
+                serial = "%s-%s" % (serial, test_suite.fixture)
+
+        test_suite.form = gui.HeadlessForm(echo = not args.quiet, serial = serial)
+        if station:
+            station.listeners.append(test_suite.form.set_attention)
+        test_suite.configure(configs.suite(index))
+        test_suite.results = store
+        suites.append(test_suite)
+
+    digio.setup()
+    threads = [threading.Thread(target = test_suite.run_unattended, name = "Fixture%d" % number) for number, test_suite in enumerate(suites)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    if store:
+        store.close()
+
+    if args.trace:
+        trace.stop()
+        trace.dump(args.trace)
+    if args.profile:
+        print(instrument.report())
+
+    for test_suite in suites:
+        if station:
+            print("Fixture %s:" % test_suite.fixture)
+        print(test_suite.form.text)
+    if station and adc.bus_lock.grants:
+        print("ADC bus grants: %s" % ", ".join("%s %d" % (fixture, count) for fixture, count in sorted(adc.bus_lock.grants.items(), key = str)))
+
+    return 1 if any(test.state == "failed" for test_suite in suites for test in test_suite.tests) else 0
+
+def stats(args):
+    "Prints SPC statistics recomputed from the results database"
+    store = results.ResultsStore(args.db)
+    since = None
+    if args.days is not None:
+        since = time.time() - args.days * 24 * 3600
+
+    spc = analytics.Analytics()
+    spc.backfill(store, since = since)
+    store.close()
+
+    print(spc.format_summary(args.variant))
+    return 0
+
+def self_test(args):
+    "Runs the power-up self-test with the jig empty and prints the outcome of each check"
+    digio.setup()
+    limits = configuration.ConfigService(args.config, args.limits).suite().limits
+    results = selftest.SelfTest(args.budget, limits).run()
+
+    for result in results:
+        print("{:<10} {:<6} {:>8.1f} ms".format(result.name, "OK" if result.passed else "FAULT", result.duration * 1000))
+        for fault in result.faults:
+            print("    " + fault)
+
+    return 1 if selftest.faults(results) else 0
+
+def main(argv):
+    parser = argparse.ArgumentParser(description = "X231 PCBA ATE command line")
+    commands = parser.add_subparsers(dest = "command")
+    commands.required = True
+
+    run_parser = commands.add_parser("run", help = "run a suite without an operator, passing every test which doesn't fail")
+    run_parser.add_argument("--suite", help = "index of the suite in tests.ini (default: the selected suite)")
+    run_parser.add_argument("--config", default = "tests.ini", help = "suite configuration to read")
+    run_parser.add_argument("--limits", default = "limits.ini", help = "measurement limits to read")
+    run_parser.add_argument("--serial", help = "board serial to record results against")
+    run_parser.add_argument("--db", help = "record results to this database")
+    run_parser.add_argument("--trace", metavar = "FILE", help = "write a Chrome trace of the run to FILE")
+    run_parser.add_argument("--profile", action = "store_true", help = "print step and driver timings after the run")
+    run_parser.add_argument("--quiet", action = "store_true", help = "only print the summary")
+    run_parser.add_argument("--fixtures", type = int, default = 1, help = "run the suite in this many simulated fixtures at once, sharing the ADC (simulation mode only)")
+    run_parser.set_defaults(handler = run)
+
+    stats_parser = commands.add_parser("stats", help = "show SPC statistics (mean, Cp/Cpk, drift, yield) per measurement")
+    stats_parser.add_argument("--db", default = "results.db", help = "results database to read")
+    stats_parser.add_argument("--variant", help = "only show this variant's part number")
+    stats_parser.add_argument("--days", type = float, help = "only include measurements from the last DAYS days")
+    stats_parser.set_defaults(handler = stats)
+
+    selftest_parser = commands.add_parser("selftest", help = "check the ADC chips, analogue channels and GPIO lines with the jig empty")
+    selftest_parser.add_argument("--budget", type = float, help = "seconds allowed for the checks (default 2.0)")
+    selftest_parser.add_argument("--config", default = "tests.ini", help = "suite configuration to read")
+    selftest_parser.add_argument("--limits", default = "limits.ini", help = "measurement limits to read the idle limits from")
+    selftest_parser.set_defaults(handler = self_test)
+
+    args = parser.parse_args(argv)
+    return args.handler(args)
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
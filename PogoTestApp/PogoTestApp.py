@@ -6,108 +6,275 @@ Copyright (c) 2016 Captec Ltd
 
 try:
 
+    # Startup is timed from here so we can track how long the controller takes to become ready.
+    from time import perf_counter, time
+    boot = perf_counter()
+
     # Import our modules
-    from ATE import gui, tests, suite, const, version, adc, digio
+    from ATE import gui, suite, const, version, adc, digio, results, datalog, analytics, instrument, trace, acquisition, selftest, shm, status, configuration, journal, filters, tests
     import sys
+    import atexit
     import tkinter as tk
-    import configparser
     import importlib
     from threading import Thread
     from getopt import getopt, GetoptError
-    from time import sleep
 
-    # Show the suite selection form and keep it up until it gets closed by the user.
-    suite_selection = gui.SuiteSelectionForm()
-    suite_selection.loop()
+    startup = instrument.Stopwatch(boot)
+    startup.mark("imports")
+
+    # Process command args.
+    # -f = expand GUI to full screen
+    #     (This is used on the Raspberry Pi)
+    # -s <index> = run the suite with this index in tests.ini instead of asking the operator to choose
+    # -l <file> = trace every measurement, GPIO access and state change to file (.csv or .jsonl)
+    # -z = gzip rotated trace files
+    # -p = time startup, suite phases, test steps and driver calls and print a report on exit
+    # -t <file> = record a Chrome trace of the session and write it to file on exit (open it in Perfetto)
+    # -w <[host:]port> = serve the status, readings, results and metrics as JSON over HTTP and WebSocket
+    opts, args = getopt(sys.argv[1:], "fs:l:zpt:w:")
+    opts = dict(opts)
+
+    if "-t" in opts:
+        trace.start()
+        atexit.register(trace.dump, opts["-t"])
+
+    if "-p" in opts:
+        instrument.enabled = True
+        atexit.register(lambda: print(instrument.report()))
+
+    if "-l" in opts:
+        datalog.active = datalog.DataLogger(opts["-l"], compress = "-z" in opts)
+        atexit.register(datalog.active.close)
 
-    # Create our Tk instance for the form
+    # Create one Tk instance, used by both the suite selection and main forms.
     root = tk.Tk()
+    startup.mark("tk")
+
+    # Read and check the suites and limits once. They are reloaded whenever tests.ini or limits.ini change.
+    suite_configs = configuration.ConfigService("tests.ini", "limits.ini")
+
+    # Show the suite selection form and keep it up until it gets closed by the user, unless the suite was given on the command line.
+    if "-s" in opts:
+        suite_idx = opts["-s"]
+    else:
+        root.withdraw()
+        suite_selection = gui.SuiteSelectionForm(root, suite_configs.names())
+        suite_selection.loop()
+        root.deiconify()
+        suite_idx = suite_selection.selected
+        if suite_idx is not None:
+            suite_configs.select(suite_idx)
+        startup.mark("suite selection")
+
     main_frm = gui.MainForm(root)
 
-    # Create our test suite instance and link to the form
+    # Create our test suite instance and link to the form.
+    # Tests run on their own threads so they talk to the form through a proxy which applies their calls on the Tk thread.
     test_suite = suite.TestSuite()
-    test_suite.form = main_frm
+    test_suite.form = gui.FormProxy(main_frm)
 
     # Link the pass/fail/reset buttons to their actions
     test_suite.form.pass_btn["command"] = test_suite.pass_test
     test_suite.form.fail_btn["command"] = test_suite.fail_test
     test_suite.form.reset_action = test_suite.reset
     test_suite.form.abort_action = test_suite.abort
+    test_suite.form.stats_action = test_suite.show_statistics
 
     #test_suite.add_test(tests.TestXX_FakeTest())
 
-    # Read the configured selected suite by SuiteSelection.
-    config = configparser.ConfigParser()
-    config.read("tests.ini")
-    suite_idx = config["settings"]["selected_suite"]
+    # Use the selected suite if it wasn't chosen above.
+    if suite_idx is None:
+        suite_idx = suite_configs.selected
+
+    # Record every run to the results database. Outstanding writes are committed when we exit.
+    test_suite.results = results.ResultsStore("results.db")
+    atexit.register(test_suite.results.close)
+
+    # Journal each completed step so a run interrupted by a restart or power loss can be resumed.
+    test_suite.journal = journal.Journal("run.journal")
+    atexit.register(test_suite.journal.close)
+
+    # Keep SPC statistics for every measurement, starting from the last 30 days of history already recorded.
+    # The backfill runs on the Tk thread before the window opens, so it is bounded rather than reading the whole database.
+    test_suite.analytics = analytics.Analytics()
+    test_suite.analytics.backfill(test_suite.results, since = time() - 30 * 24 * 60 * 60)
+
+    # Add all the tests found in the suite, followed by a final "test" to show a generic completion message.
+    # The variant recorded against every result is the part number at the start of the suite name.
+    test_suite.configure(suite_configs.suite(suite_idx))
+
+    # Decode the images the suite's tests show before they are needed.
+    def preload_images():
+        main_frm.images.preload(path for test in test_suite.tests for path in test.images)
+
+    preload_images()
+
+    # Switch to another suite between boards, from the SUITE menu item, without restarting.
+    def switch_suite(index):
+        if test_suite.switch_suite(suite_configs.suite(index)):
+            suite_configs.select(index)
+            preload_images()
+
+    def choose_suite():
+        if test_suite.current_test == -1 or test_suite.summary_shown:
+            gui.SuiteSelectionForm(root, suite_configs.names(), on_select = switch_suite)
+
+    test_suite.form.suite_action = choose_suite
 
-    # Add all the tests found in the suite.
-    for idx, cls in config["suite%d" % int(suite_idx)].items():
-        test_suite.add_test(getattr(tests, cls)())
+    # Pick up edits to tests.ini and limits.ini. A changed suite is loaded once no test is running.
+    # An invalid edit is reported and the previous configuration stays in use.
+    applied_generation = suite_configs.generation
+    config_error = None
 
-    # Add a final "test" to show a generic completion message.
-    test_suite.add_test(tests.TestEnd_TestsCompleted())
+    def watch_config():
+        global applied_generation, config_error
+        try:
+            suite_configs.reload()
+            config_error = None
+        except configuration.ConfigError as e:
+            # Report each invalid edit once.
+            if str(e) != config_error:
+                config_error = str(e)
+                print("Configuration not reloaded:\n" + config_error)
+                main_frm.append_text_line("Configuration not reloaded: " + config_error)
+
+        if suite_configs.generation != applied_generation:
+            index = str(test_suite.selected_suite)
+            if index in suite_configs.suites and test_suite.switch_suite(suite_configs.suite(index)):
+                applied_generation = suite_configs.generation
+                preload_images()
+
+        root.after(1000, watch_config)
+
+    root.after(1000, watch_config)
+
+    startup.mark("suite")
 
     # Disable input buttons to start with
     main_frm.disable_all_buttons()
 
-    # Process command args.
-    # -f = expand GUI to full screen
-    #     (This is used on the Raspberry Pi)
-    opts, args = getopt(sys.argv, "f")
-
-    if args.count("-f") != 0:
+    if "-f" in opts:
         main_frm.fullscreen(root, True)
 
+    startup.mark("main form")
+
     # Set up our digital I/O before using it.
     digio.setup()
 
-    # Update all readings (A/D and GPIO I/O each second)
-    def update_readings():
-        readings = adc.read_all_voltages()
-        readings.update(digio.read_all_inputs())
-        readings.update(digio.read_all_outputs())
-        main_frm.update_readings(readings)
-        root.after(1000, update_readings)
+    readings_acquisition = acquisition.Acquisition(period = 0.5)
+
+    # Publish each snapshot to shared memory so other processes can see the readings without using the bus.
+    readings_publisher = shm.Publisher()
+    readings_acquisition.subscribers.append(readings_publisher.publish)
 
-    # Attempt to set "OK" on each label.
-    def readings_display_test():
-        main_frm.set_text("Initialising readings")
-        readings = adc.read_all_voltages()
-        readings.update(digio.read_all_inputs())
-        readings.update(digio.read_all_outputs())
+    if "-w" in opts:
+        host, _, port = opts["-w"].rpartition(":")
+        status_server = status.StatusServer(test_suite, readings_acquisition, host = host or None, port = int(port))
+        status_server.start()
+        print("Status server listening on %s:%d" % (status_server.host, status_server.port))
 
-        for reading in readings.items():
-            main_frm.set_reading_value(reading[0], "OK")
-            main_frm.update()
-            sleep(0.1)
+    # Check the ADC chips, analogue channels and GPIO lines with the jig empty, then allow testing to begin.
+    # This runs on its own thread while the rest of startup continues. Readings are only acquired once it has
+    # finished, so they don't compete for the bus or see the loopback outputs switching.
+    def power_up_self_test():
+        started = perf_counter()
+        try:
+            results = selftest.SelfTest(limits = suite_configs.suite().limits).run()
+            test_suite.form.update_readings(selftest.labels(results))
+            faults = selftest.faults(results)
+        except Exception as e:
+            # A self-test which can't run is a fault in itself; the operator can still reset and test.
+            faults = ["self-test failed to run: %r" % e]
 
-        main_frm.enable_reset_button()
+        try:
+            for fault in faults:
+                print("Self-test: " + fault)
+                test_suite.form.append_text_line("SELF-TEST FAULT: " + fault)
+            if faults:
+                test_suite.form.append_text_line("Check the ATE before loading a board.")
+            startup.record("self-test", perf_counter() - started)
+        finally:
+            readings_acquisition.start()
 
     # Channel conversion factor times the impedence conversion
     # Circuit impedence compensation = 1.1505
     # Voltage divider compensation = 1.575
-    adc.global_conversion_factor = (1.1505 * 1.575)
+    # with a different conversion factor for AD4.
+    # The display reuses a conversion for up to 0.25s; test measurements always convert again.
+    # V_bat and V_sense have narrow limits, so their test readings are the median filtered mean of 16 conversions.
+    # V_bat, V_sense and V_sys_out are well under half the ADC's range, so they auto-range the PGA.
+    adc.configure(
+        global_factor = 1.1505 * 1.575,
+        factors = {const.AD4_V_TP13_NTC: 1.1505 * 0.8710},
+        ttl = 0.25,
+        filters = {
+            "AD5": filters.Pipeline(16, [filters.Median(5)]),
+            "AD6": filters.Pipeline(16, [filters.Median(5)])
+            },
+        autorange = ("AD5", "AD6", "AD7")
+        )
 
-    # Different conversion factor for AD4.
-    adc.conversion_factors = {
-        const.AD4_V_TP13_NTC: 1.1505 * 0.8710
-        }
-
-    # Kick off the readings display test
-    readings_display_test()
-
-    # Kick off the reading updates.
-    update_readings_thread = Thread(target = update_readings)
-    update_readings_thread.start()
+    # Watch for reading updates. A/D and GPIO I/O are read on the acquisition thread
+    # and the form applies whichever readings have changed from the Tk thread.
+    main_frm.watch_readings(readings_acquisition.snapshots)
 
     # Kick off the test duration update thread.
-    update_duration_thread = Thread(target = test_suite.form.update_duration)
+    update_duration_thread = Thread(target = test_suite.form.update_duration, name = "UpdateDuration")
     update_duration_thread.start()
 
     # Make the suite ready and display the intro text.
     test_suite.ready()
 
+    # Kick off the self-test after the intro text, so any faults are listed below it.
+    self_test_thread = Thread(target = power_up_self_test, name = "SelfTest")
+    self_test_thread.start()
+
+    # Report the startup time once the first frame has been drawn and the self-test has finished.
+    def startup_complete():
+        if self_test_thread.is_alive():
+            root.after(10, startup_complete)
+            return
+
+        startup.mark("ready")
+        print("Startup: " + startup.report(exclude = ("suite selection",)))
+
+        # RESET is enabled once any interrupted run has been resumed or aborted, so a fresh run can't be started first.
+        try:
+            offer_resume()
+        finally:
+            test_suite.form.enable_reset_button()
+
+    # Offer to resume a run interrupted by a restart at its first incomplete step, if its suite still has the same tests.
+    def offer_resume():
+        unfinished = test_suite.journal.unfinished()
+        if unfinished is None:
+            return
+
+        index = str(unfinished["suite"])
+        if index in suite_configs.suites:
+            # Compare the suite's tests without loading it, so declining leaves the selected suite as it was.
+            classes = suite_configs.suite(index).test_classes() + [tests.TestEnd_TestsCompleted]
+            if [cls.__name__ for cls in classes] == unfinished["tests"]:
+                step = classes[unfinished["next"]]
+                if main_frm.resume_dialogue(unfinished["serial"], step.description or step.__name__):
+                    # Only continue on the same board: a different one would mix two boards' results in one run.
+                    serial = main_frm.serial_dialogue()
+                    if serial is None:
+                        test_suite.form.append_text_line("No serial number was entered, so the interrupted run was not resumed. It was aborted.")
+                    elif serial != unfinished["serial"]:
+                        test_suite.form.append_text_line("Board %s is not the interrupted run's board %s. The run was aborted." % (serial, unfinished["serial"]))
+                    else:
+                        if test_suite.selected_suite != int(index):
+                            switch_suite(index)
+                        test_suite.resume(unfinished)
+                        return
+
+        test_suite.journal.discard()
+        if unfinished["run_id"]:
+            test_suite.results.end_run(unfinished["run_id"], "aborted")
+
+    root.after_idle(startup_complete)
+
     # Process GUI events.
     root.mainloop()
 
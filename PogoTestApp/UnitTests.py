@@ -7,11 +7,46 @@ This script is designed to run without the ADC libraries and so uses the simulat
 
 import unittest
 import time
+import os
+import tempfile
 from math import ceil
 
 from ATE.tests import TestProcedure
 from ATE.suite import TestSuite
 from ATE.adc import Channel
+from ATE import adc
+from ATE import filters
+from ATE import capture
+from ATE import sequence
+from ATE import linequality
+from ATE import thermal
+from ATE import fixtures
+from ATE import tests
+from ATE.results import ResultsStore
+from ATE.gui import HeadlessForm, MainForm, FormProxy, ImageCache
+from ATE.acquisition import Acquisition
+from ATE.trend import History
+from ATE import trend
+from ATE import datalog
+from ATE import analytics
+from ATE import instrument
+from ATE import trace
+from ATE import selftest
+from ATE import shm
+from ATE.status import StatusServer
+from ATE import configuration
+from ATE import registry
+from ATE.journal import Journal
+import sys
+import socket
+import base64
+import urllib.request
+import urllib.error
+import sqlite3
+from ATE import digio
+import RPiDummy.GPIODummy as GPIODummy
+import json
+import threading
 
 class TestVoltageMethods(unittest.TestCase):
 
@@ -79,6 +114,494 @@ class TestVoltageMethods(unittest.TestCase):
         voltage, valid, readings = self.channel.read_voltage_range(5)
         self.assertTrue(valid)
 
+    def test_read_cache(self):
+        self.channel.ttl = 60
+        self.channel.set_simulation_voltage(1.0)
+        voltage, timestamp = self.channel.read()
+        self.assertEqual((1.0, timestamp), self.channel.last_reading())
+
+        # A change the channel can't see, as on hardware, is hidden until the TTL expires or a fresh read.
+        self.channel._simulation_voltage = 2.0
+        self.assertEqual(1.0, self.channel.read_voltage())
+        self.assertEqual(2.0, self.channel.read_voltage(fresh = True))
+
+        # Measurements always convert again.
+        self.channel._simulation_voltage = 3.0
+        self.assertTrue(self.channel.voltage_near(3.0, 0.0))
+
+        self.channel.ttl = 0
+        self.channel._simulation_voltage = 4.0
+        self.assertEqual(4.0, self.channel.read_voltage())
+
+    def test_slots(self):
+        with self.assertRaises(AttributeError):
+            self.channel.voltage = 1.0
+
+class TestChannelRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = (adc.global_conversion_factor, adc.conversion_factors, adc.read_ttl, adc.read_ttls, adc._channels)
+
+    def tearDown(self):
+        adc.global_conversion_factor, adc.conversion_factors, adc.read_ttl, adc.read_ttls, adc._channels = self.saved
+
+    def test_shared_channels(self):
+        adc.configure(global_factor = 1.0, factors = {}, ttl = 0.0, ttls = {"AD5": 0.5})
+        channels = adc.get_all_channels()
+        self.assertIs(channels["AD1"], adc.get_all_channels()["AD1"])
+        self.assertIs(channels["AD5"], adc.get_channel("AD5"))
+        self.assertEqual(0.5, channels["AD5"].ttl)
+        self.assertEqual(0.0, channels["AD1"].ttl)
+
+        # The dictionary is a copy, so callers can't replace the shared channels.
+        channels["AD1"] = None
+        self.assertIsNotNone(adc.get_channel("AD1"))
+
+    def test_configure(self):
+        adc.configure(global_factor = 2.0, factors = {4: 0.5})
+        self.assertEqual(2.0, adc.get_channel("AD1")._conversion_factor)
+        self.assertEqual(0.5, adc.get_channel("AD4")._conversion_factor)
+
+    def test_read_all_voltages(self):
+        adc.configure(ttl = 60)
+        for name, channel in adc.get_all_channels().items():
+            channel.set_simulation_mode(True)
+            channel.set_simulation_voltage(1.5)
+        self.assertEqual(dict((name, 1.5) for name in adc.channel_numbers), adc.read_all_voltages())
+
+        adc.get_channel("AD2")._simulation_voltage = 2.5
+        self.assertEqual(1.5, adc.read_all_voltages()["AD2"])
+        self.assertEqual(2.5, adc.read_all_voltages(fresh = True)["AD2"])
+
+class FakeADCPi(object):
+    "Stands in for the ADCPi driver, clipping each channel's voltage to the range of the PGA gain set"
+
+    def __init__(self, voltages):
+        self.voltages = voltages
+        self.gain = 1
+        self.gain_changes = 0
+        self.reads = []
+
+    def set_pga(self, gain):
+        self.gain = gain
+        self.gain_changes += 1
+
+    def read_voltage(self, channel):
+        self.reads.append((channel, self.gain))
+        limit = adc.full_scale / self.gain
+        return round(min(self.voltages[channel], limit) * self.gain / 0.001) * 0.001 / self.gain
+
+class TestAutorange(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = (getattr(adc, "adc", None), adc._gain)
+        self.driver = FakeADCPi({5: 0.3, 6: 0.3, 1: 3.0})
+        adc.adc = self.driver
+        adc._gain = 1
+
+    def tearDown(self):
+        adc.adc, adc._gain = self.saved
+
+    def channel(self, number, autorange = True):
+        channel = Channel(number, autorange = autorange)
+        channel.set_simulation_mode(False)
+        return channel
+
+    def test_choose_gain(self):
+        self.assertEqual(8, adc.choose_gain(0.3))
+        self.assertEqual(4, adc.choose_gain(1.0))
+        self.assertEqual(2, adc.choose_gain(2.0))
+        self.assertEqual(1, adc.choose_gain(4.8))
+        self.assertEqual(1, adc.choose_gain(6.0))
+
+    def test_first_read_chooses_gain(self):
+        channel = self.channel(5)
+        self.assertAlmostEqual(0.3, channel.read_voltage(fresh = True), 3)
+        self.assertEqual(8, channel.gain)
+        self.assertEqual([(5, 1), (5, 8)], self.driver.reads)
+
+        # The gain is reused without a conversion at x1.
+        channel.read_voltage(fresh = True)
+        self.assertEqual([(5, 1), (5, 8), (5, 8)], self.driver.reads)
+
+    def test_overrange(self):
+        channel = self.channel(5)
+        channel.read_voltage(fresh = True)
+        self.driver.voltages[5] = 1.5
+        self.assertAlmostEqual(1.5, channel.read_voltage(fresh = True), 3)
+        self.assertEqual(2, channel.gain)
+        self.assertEqual([(5, 8), (5, 1), (5, 2)], self.driver.reads[-3:])
+
+    def test_fixed_gain_channels(self):
+        low = self.channel(6)
+        high = self.channel(1, autorange = False)
+        low.read_voltage(fresh = True)
+        self.assertAlmostEqual(3.0, high.read_voltage(fresh = True), 3)
+        self.assertEqual((1, 1), self.driver.reads[-1])
+
+        # Reading the same gain again doesn't switch the PGA.
+        changes = self.driver.gain_changes
+        high.read_voltage(fresh = True)
+        self.assertEqual(changes, self.driver.gain_changes)
+
+class RampADCPi(object):
+    "Stands in for the ADCPi driver. Each channel ramps from 0V to its voltage over rise seconds after DOP11 goes high"
+
+    def __init__(self, voltages, delays, rise = 0.02):
+        self.voltages = voltages
+        self.delays = delays
+        self.rise = rise
+        self.on = None
+
+    def set_pga(self, gain):
+        pass
+
+    def read_voltage(self, channel):
+        time.sleep(0.0005)
+        if GPIODummy.input(digio.DOP11_POGO_ON_GPIO) and self.on is None:
+            self.on = time.perf_counter()
+        if self.on is None:
+            return 0.0
+        elapsed = time.perf_counter() - self.on - self.delays[channel]
+        return self.voltages[channel] * min(1.0, max(0.0, elapsed / self.rise))
+
+class TestCapture(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = (getattr(adc, "adc", None), adc._channels)
+        digio.setup()
+        adc.adc = RampADCPi({1: 5.0, 2: 5.0}, {1: 0.03, 2: 0.0})
+        adc.configure()
+        for channel in adc.get_all_channels().values():
+            channel.set_simulation_mode(False)
+
+    def tearDown(self):
+        digio.set_low(digio.DOP11_POGO_ON_GPIO)
+        adc.adc, adc._channels = self.saved
+
+    def test_fire(self):
+        result = capture.Capture(["AD1", "AD2"], window = 0.1)
+        traces = result.fire(digio.DOP11_POGO_ON_GPIO)
+        self.assertEqual(["AD1", "AD2"], sorted(traces))
+        self.assertLess(traces["AD1"].times[0], 0)
+        self.assertAlmostEqual(0.0, traces["AD1"].initial())
+        self.assertAlmostEqual(5.0, traces["AD1"].final())
+
+        # 10% to 90% of a 20ms linear ramp is 16ms.
+        self.assertAlmostEqual(0.016, traces["AD2"].rise_time(), delta = 0.005)
+        self.assertEqual(0.0, traces["AD2"].overshoot())
+
+        thresholds = {"AD1": 2.5, "AD2": 2.5}
+        self.assertEqual(["AD2", "AD1"], [name for name, seconds in result.order(thresholds)])
+        self.assertAlmostEqual(0.03, result.delay("AD2", "AD1", thresholds), delta = 0.005)
+
+    def test_on_edge_timeout(self):
+        self.assertIsNone(capture.Capture(["AD1"], window = 0.05).on_edge(digio.DIP6_From_J7_4, timeout = 0.05))
+
+    def test_holds_bus(self):
+        # A display read asked for during the capture waits until it has finished.
+        ended = []
+        def fire():
+            capture.Capture(["AD1"], window = 0.2).fire(digio.DOP11_POGO_ON_GPIO)
+            ended.append(time.perf_counter())
+        capturing = threading.Thread(target = fire)
+        capturing.start()
+        time.sleep(0.05)
+        adc.get_channel("AD2").convert()
+        converted = time.perf_counter()
+        capturing.join()
+        self.assertGreaterEqual(converted, ended[0])
+
+    def test_trace(self):
+        trace = capture.Trace("AD1", [-0.01, 0.0, 0.01, 0.02, 0.03, 0.04], [0.0, 0.0, 6.0, 5.0, 5.0, 5.0])
+        self.assertAlmostEqual(0.2, trace.overshoot())
+        self.assertAlmostEqual(0.005 * 5 / 6, trace.crossing(2.5) - 0.0)
+        self.assertIsNone(trace.crossing(7.0))
+
+        # A rail which never came up has no rise time rather than an instant one.
+        flat = capture.Trace("AD1", [-0.01, 0.0, 0.01, 0.02], [0.01, 0.02, 0.01, 0.02])
+        self.assertIsNone(flat.rise_time())
+
+class TestSequence(unittest.TestCase):
+
+    def setUp(self):
+        digio.setup()
+
+    def test_play(self):
+        pins = [digio.DOP12_BAT1_GPIO, digio.DOP13_BAT0_GPIO]
+        played = sequence.Sequence.from_masks(pins, [(0.02, 0b11), (0.0, 0b01), (0.04, 0b10)])
+        self.assertEqual({pins[0]: 1, pins[1]: 0}, played.steps[0][1])
+
+        timings = played.play()
+        self.assertEqual([0.0, 0.02, 0.04], [offset for offset, actual in timings])
+        for offset, actual in timings:
+            self.assertGreaterEqual(actual, offset)
+        self.assertLess(played.lateness(), 0.01)
+        self.assertEqual(0, digio.read(pins[0]))
+        self.assertEqual(1, digio.read(pins[1]))
+
+    def test_errors(self):
+        with self.assertRaises(ValueError):
+            sequence.Sequence([(-0.1, {})])
+
+        # A pin that doesn't exist stops the sequence, and the error is raised by wait().
+        played = sequence.Sequence([(0.0, {99: 1})])
+        with self.assertRaises(KeyError):
+            played.play()
+
+class TestLineQuality(unittest.TestCase):
+
+    def setUp(self):
+        digio.setup()
+
+    def tearDown(self):
+        if (digio.DOP9_TO_J7_1, digio.DIP6_From_J7_4) in GPIODummy._links:
+            GPIODummy._links.remove((digio.DOP9_TO_J7_1, digio.DIP6_From_J7_4))
+
+    def test_prbs7(self):
+        bits = linequality.prbs7(254)
+        self.assertEqual(bits[:127], bits[127:])
+        self.assertEqual(64, sum(bits[:127]))
+
+    def test_open_line(self):
+        result = linequality.LineTest("J7", digio.DOP9_TO_J7_1, digio.DIP6_From_J7_4).run()
+        self.assertFalse(result.passed)
+        self.assertEqual(sum(linequality.prbs7(256)), result.errors)
+        self.assertIsNone(result.rate)
+        self.assertIsNone(result.delay)
+
+    def test_procedure(self):
+        GPIODummy._short(digio.DOP9_TO_J7_1, digio.DIP6_From_J7_4)
+        result = linequality.LineTest("J7", digio.DOP9_TO_J7_1, digio.DIP6_From_J7_4).run()
+        self.assertTrue(result.passed)
+        self.assertEqual(0, result.errors)
+        self.assertGreater(result.rate, 0)
+
+        suite = TestSuite()
+        suite.form = HeadlessForm(echo = False)
+        test = tests.TestB4_1_ConnectionBoard_LineQuality()
+        test.suite = suite
+        suite.limits = {"J7 rate": (1e12, 1e13)}
+        test.run()
+        self.assertEqual("failed", test.state)
+
+        suite.limits = {}
+        test.run()
+        self.assertEqual("passed", test.state)
+
+class ThermalADCPi(object):
+    "Stands in for the ADCPi driver. AD4 follows the hot simulation output and AD7 drops 30ms later, recovering 20ms after it goes off"
+
+    def __init__(self):
+        self.changed = None
+        self.hot = False
+
+    def set_pga(self, gain):
+        pass
+
+    def read_voltage(self, channel):
+        time.sleep(0.0005)
+        hot = bool(GPIODummy.input(digio.DOP8_Hot_sim))
+        if hot != self.hot:
+            self.hot = hot
+            self.changed = time.perf_counter()
+        elapsed = time.perf_counter() - self.changed if self.changed else 1.0
+
+        if channel == 4:
+            return thermal.default_ntc.voltage(60.0 if hot else 25.0)
+        if hot:
+            return 0.0 if elapsed > 0.03 else 1.0
+        return 1.0 if elapsed > 0.02 else 0.0
+
+class TestThermal(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = (getattr(adc, "adc", None), adc._channels)
+        digio.setup()
+        adc.adc = ThermalADCPi()
+        adc.configure()
+        for channel in adc.get_all_channels().values():
+            channel.set_simulation_mode(False)
+
+    def tearDown(self):
+        digio.set_low(digio.DOP8_Hot_sim)
+        adc.adc, adc._channels = self.saved
+
+    def test_lookup(self):
+        ntc = thermal.NTC()
+        self.assertAlmostEqual(2.5, ntc.voltage(25.0))
+        for temperature in (-30.0, 0.0, 25.0, 47.3, 100.0):
+            self.assertAlmostEqual(temperature, ntc.temperature(ntc.voltage(temperature)), 1)
+
+        # Readings beyond the table are limited to its ends.
+        self.assertEqual(125.0, ntc.temperature(0.0))
+        self.assertEqual(-40.0, ntc.temperature(5.0))
+        self.assertAlmostEqual(25.0, list(ntc.temperatures_of([2.5, 1.0]))[0], 1)
+
+    def test_reaction(self):
+        check = thermal.ThermalCheck("Hot", digio.DOP8_Hot_sim, "AD7", 0.5)
+        check.window = 0.1
+        reaction = check.run()
+        self.assertAlmostEqual(60.0, reaction.temperature, 1)
+        self.assertAlmostEqual(0.03, reaction.trip_time, delta = 0.005)
+        self.assertAlmostEqual(0.02, reaction.recovery_time, delta = 0.005)
+
+    def test_no_reaction(self):
+        check = thermal.ThermalCheck("Hot", digio.DOP8_Hot_sim, "AD7", 0.5, rising = True)
+        check.window = 0.05
+        reaction = check.run()
+        self.assertIsNone(reaction.trip_time)
+
+class TestFixtures(unittest.TestCase):
+
+    def tearDown(self):
+        fixtures.set_current(None)
+
+    def test_fair_lock(self):
+        lock = fixtures.FairLock()
+        order = []
+        holding = threading.Event()
+        release = threading.Event()
+
+        def hold():
+            fixtures.set_current("A")
+            with lock:
+                holding.set()
+                release.wait()
+
+        def worker(fixture, count):
+            fixtures.set_current(fixture)
+            for index in range(count):
+                with lock:
+                    order.append(fixture)
+                    # Long enough for the other fixture to ask again before this one does.
+                    time.sleep(0.005)
+
+        holder = threading.Thread(target = hold)
+        holder.start()
+        holding.wait()
+
+        # A queues all its reads before B asks, but once the lock is free they alternate.
+        first = threading.Thread(target = worker, args = ("A", 3))
+        first.start()
+        while len(lock._waiting.get("A", ())) < 1:
+            time.sleep(0.001)
+        second = threading.Thread(target = worker, args = ("B", 3))
+        second.start()
+        while len(lock._waiting.get("B", ())) < 1:
+            time.sleep(0.001)
+
+        release.set()
+        for thread in (holder, first, second):
+            thread.join()
+
+        self.assertEqual(["B", "A", "B", "A", "B", "A"], order)
+        self.assertEqual({"A": 4, "B": 3}, lock.grants)
+        self.assertFalse(lock.locked())
+
+        with self.assertRaises(RuntimeError):
+            lock.release()
+
+    def test_station(self):
+        station = fixtures.Station()
+        notified = []
+        station.listeners.append(notified.append)
+
+        station.update("A", "manual")
+        station.update("B", "manual")
+        self.assertEqual("A", station.attention())
+
+        # While A runs its automated stages the operator is sent to B.
+        station.update("A", "automatic")
+        self.assertEqual("B", station.attention())
+        station.update("B", "automatic")
+        self.assertIsNone(station.attention())
+        self.assertEqual(["A", "B", None], notified)
+
+    def test_suites(self):
+        station = fixtures.Station()
+        suites = []
+        for name in ("A", "B"):
+            suite = TestSuite()
+            suite.form = HeadlessForm(echo = False)
+            suite.fixture = name
+            suite.station = station
+            suite.add_test(TestProcedure())
+            suites.append(suite)
+
+        station.listeners.append(suites[0].form.set_attention)
+        suites[0].ready()
+        suites[1].ready()
+        self.assertEqual("A", station.attention())
+        self.assertEqual("A", suites[0].form.attention)
+
+        suites[0].current_test = 0
+        suites[0].execute()
+        suites[0].thread.join()
+        self.assertEqual(("manual", "B"), (station.states["A"][0], station.attention()))
+        self.assertEqual("B", suites[0].form.attention)
+
+class TestFilters(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = filters.numpy
+
+    def tearDown(self):
+        filters.numpy = self.saved
+
+    def check(self):
+        block = [0.3, 0.31, 0.29, 2.5, 0.3, 0.3, 0.0, 0.31, 0.3]
+
+        # A spike and a dropout pull the mean well off but not the median.
+        self.assertAlmostEqual(0.5122, filters.Pipeline(9).filter(block), 4)
+        self.assertAlmostEqual(0.3, filters.Pipeline(9, [filters.Median(3)]).filter(block), 2)
+        averages = filters.MovingAverage(2).apply([0.3, 0.31, 0.33])
+        self.assertEqual(2, len(averages))
+        self.assertAlmostEqual(0.305, averages[0])
+        self.assertAlmostEqual(0.32, averages[1])
+        self.assertAlmostEqual(0.5 * 0.25 + 0.5 * (0.5 * 0.5 + 0.5 * 0.0), filters.LowPass(0.5).apply([0.0, 0.5, 0.25])[0])
+
+        # Blocks shorter than a window are filtered as a whole.
+        self.assertAlmostEqual(0.31, filters.Pipeline(1, [filters.Median(5)]).filter([0.31]))
+
+        samples = iter(block)
+        self.assertAlmostEqual(0.3, filters.Pipeline(9, [filters.Median(3), filters.MovingAverage(3)]).run(lambda: next(samples)), 2)
+
+    def test_numpy(self):
+        if filters.numpy is None:
+            self.skipTest("NumPy is not installed")
+        self.check()
+
+    def test_python(self):
+        filters.numpy = None
+        self.check()
+
+    def test_channel(self):
+        channel = Channel(5, pipeline = filters.Pipeline(8, [filters.Median(3)]))
+        channel.set_simulation_mode(True)
+        channel.set_simulation_voltage(0.35)
+        self.assertAlmostEqual(0.35, channel.read_voltage(fresh = True))
+
+        with self.assertRaises(ValueError):
+            filters.Pipeline(0)
+
+    def test_fresh_only(self):
+        class CountingPipeline(filters.Pipeline):
+            runs = 0
+            def run(self, convert):
+                self.runs += 1
+                return filters.Pipeline.run(self, convert)
+
+        pipeline = CountingPipeline(4)
+        channel = Channel(5, pipeline = pipeline)
+        channel.set_simulation_mode(True)
+        channel.set_simulation_voltage(0.35)
+        self.assertAlmostEqual(0.35, channel.read_voltage())
+        self.assertEqual(0, pipeline.runs)
+        self.assertAlmostEqual(0.35, channel.read_voltage(fresh = True))
+        self.assertEqual(1, pipeline.runs)
+        with self.assertRaises(ValueError):
+            filters.LowPass(0.0)
 
 class TestFunctionTests(unittest.TestCase):
 
@@ -122,5 +645,946 @@ class TestSuitePassOperation(unittest.TestCase):
 
         self.assertEqual("passed", suite.tests[1].state)
 
+class TestResultsStore(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = ResultsStore(os.path.join(self.directory.name, "results.db"))
+
+    def tearDown(self):
+        self.store.close()
+        self.directory.cleanup()
+
+    def test_last_run(self):
+        first = self.store.begin_run("SN001", "4950-060-10-01")
+        self.store.end_run(first, "failed")
+        second = self.store.begin_run("SN001", "4950-060-10-01")
+        self.store.record_step(second, 0, "Test00_Setup", "Setup 1 of 2", "passed", failures = [])
+        self.store.record_measurement(second, "TestB2_FirstStage", "AD5", 0.4, 0.2, 1.5, True, [0.39, 0.4, 0.41])
+        self.store.end_run(second, "passed", 42)
+        self.store.flush()
+
+        run = self.store.last_run("SN001")
+        self.assertEqual(second, run["id"])
+        self.assertEqual("passed", run["outcome"])
+        self.assertEqual(1, len(run["steps"]))
+        self.assertEqual(3, run["measurements"][0]["samples"])
+        self.assertAlmostEqual(0.4, run["measurements"][0]["mean"])
+        self.assertIsNone(self.store.last_run("SN002"))
+
+    def test_measurement_query(self):
+        for variant in ("4950-060-10-01", "4950-060-10-02"):
+            run_id = self.store.begin_run("SN001", variant)
+            self.store.record_measurement(run_id, "TestB2_FirstStage", "AD5", 0.4)
+            self.store.record_measurement(run_id, "TestB2_FirstStage", "AD6", 0.3)
+        self.store.flush()
+
+        readings = self.store.measurements("AD5", variant = "4950-060-10-02", since = time.time() - 7 * 24 * 3600)
+        self.assertEqual(1, len(readings))
+        self.assertEqual("SN001", readings[0]["serial"])
+        self.assertEqual([], self.store.measurements("AD5", since = time.time() + 60))
+
+    def test_close_after_failed_write(self):
+        # A statement which fails in the same batch as close()'s sentinel mustn't leave the writer waiting forever.
+        self.store._put("INSERT INTO missing (value) VALUES (?)", (1,))
+        closing = threading.Thread(target = self.store.close, daemon = True)
+        closing.start()
+        closing.join(5)
+        self.assertFalse(closing.is_alive())
+
+    def test_since_uses_index(self):
+        # The startup backfill reads a window of recent measurements and mustn't scan the whole table.
+        connection = self.store._connect()
+        plan = connection.execute("EXPLAIN QUERY PLAN SELECT * FROM measurements WHERE 1 = 1 AND timestamp >= ? ORDER BY timestamp", (0,)).fetchall()
+        connection.close()
+        self.assertIn("measurements_timestamp", " ".join(str(row[-1]) for row in plan))
+
+    def test_runs_limit(self):
+        for serial in ("SN001", "SN002", "SN003"):
+            self.store.begin_run(serial, "4950-060-10-01")
+        self.store.flush()
+
+        self.assertEqual(["SN003", "SN002"], [run["serial"] for run in self.store.runs(limit = 2)])
+        self.assertEqual(3, len(self.store.runs()))
+
+    def test_suite_records_run(self):
+        suite = TestSuite()
+        suite.results = self.store
+        suite.serial = "SN003"
+        suite.variant = "4950-060-10-01"
+        suite.add_test(TestProcedure())
+        suite.add_test(TestProcedure())
+
+        suite.reset()
+        suite.tests[0].record_measurement("AD1", 5.0, 4.8, 5.2, True)
+        suite.pass_test()
+        suite.pass_test()
+        self.store.flush()
+
+        run = self.store.last_run("SN003")
+        self.assertEqual(["passed", "passed"], [step["state"] for step in run["steps"]])
+        self.assertEqual("AD1", run["measurements"][0]["name"])
+
+    def test_serial_cancelled(self):
+        suite = TestSuite()
+        suite.results = self.store
+        suite.form = HeadlessForm(echo = False)
+        suite.form.serial_dialogue = lambda: None
+        suite.add_test(TestProcedure())
+
+        suite.reset()
+        self.assertEqual(-1, suite.current_test)
+        self.assertIsNone(suite.run_id)
+        self.assertIn("testing has not started", suite.form.text)
+        self.store.flush()
+        self.assertEqual([], self.store.runs())
+
+class TestDataLogger(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        datalog.active = None
+        self.directory.cleanup()
+
+    def test_channel_reads_logged(self):
+        path = os.path.join(self.directory.name, "trace.jsonl")
+        datalog.active = datalog.DataLogger(path)
+
+        channel = Channel(5)
+        channel.set_simulation_mode(True)
+        channel.set_simulation_voltage(0.4)
+        channel.read_voltage()
+        channel.voltage_between(0.2, 1.5, 0.01)
+
+        datalog.active.close()
+
+        with open(path) as f:
+            lines = f.read().splitlines()
+
+        self.assertEqual(3, len(lines))
+        self.assertIn("\"AD5\"", lines[0])
+        self.assertIn("voltage_between", lines[2])
+
+    def test_close_after_failed_write(self):
+        logger = datalog.DataLogger(os.path.join(self.directory.name, "trace.csv"))
+        logger.close()
+
+        # A write which fails in the same batch as close()'s sentinel mustn't leave the writer waiting forever.
+        def fail(item):
+            raise ValueError("unwritable")
+        logger._format = fail
+        logger.record("read", 1, 1)
+        logger._queue.put(None)
+        writer = threading.Thread(target = logger._write_loop, daemon = True)
+        writer.start()
+        writer.join(5)
+        self.assertFalse(writer.is_alive())
+
+    def test_drop_when_full(self):
+        logger = datalog.DataLogger(os.path.join(self.directory.name, "trace.csv"), queue_size = 1)
+
+        # Stop the writer so nothing drains the queue.
+        logger.close()
+        logger.record("read", 1, 1)
+        logger.record("read", 1, 1)
+
+        self.assertEqual(1, logger.dropped)
+
+    def test_rotation(self):
+        path = os.path.join(self.directory.name, "trace.csv")
+        logger = datalog.DataLogger(path, max_bytes = 200, backups = 2, compress = True)
+
+        for i in range(50):
+            logger.record("read", 1, i)
+            logger.flush()
+
+        logger.close()
+
+        self.assertTrue(os.path.exists(path + ".1.gz"))
+        self.assertTrue(os.path.exists(path + ".2.gz"))
+        self.assertFalse(os.path.exists(path + ".3.gz"))
+
+class TestAnalytics(unittest.TestCase):
+
+    values = [4.9, 5.0, 5.1, 5.0, 4.95, 5.05]
+
+    def test_series(self):
+        series = analytics.Series("4950-060-10-01", "AD1")
+        for value in self.values:
+            series.add(value, 4.8, 5.2, True)
+
+        self.assertAlmostEqual(5.0, series.mean)
+        self.assertAlmostEqual(0.0707107, series.stddev, places = 5)
+        self.assertAlmostEqual(0.4 / (6 * series.stddev), series.cp)
+        self.assertAlmostEqual(series.cp, series.cpk)
+        self.assertEqual(1.0, series.yield_rate)
+
+        # Readings creeping up towards the upper limit move the drift towards 1.
+        for i in range(20):
+            series.add(5.18, 4.8, 5.2, True)
+        self.assertGreater(series.drift, 0.7)
+        self.assertLess(series.cpk, series.cp)
+
+    def test_batch_matches_incremental(self):
+        series = analytics.Series(None, None)
+        for value in self.values:
+            series.add(value)
+
+        count, mean, m2, minimum, maximum, ewma = analytics.batch_statistics(self.values)
+        self.assertEqual(series.count, count)
+        self.assertAlmostEqual(series.mean, mean)
+        self.assertAlmostEqual(series._m2, m2)
+        self.assertAlmostEqual(series.ewma, ewma)
+        self.assertEqual((4.9, 5.1), (minimum, maximum))
+
+    def test_backfill(self):
+        with tempfile.TemporaryDirectory() as directory:
+            store = ResultsStore(os.path.join(directory, "results.db"))
+            run_id = store.begin_run("SN001", "4950-060-10-02")
+            for value in self.values:
+                store.record_measurement(run_id, "TestB2_FirstStage", "AD1", value, 4.8, 5.2, True)
+            store.flush()
+
+            spc = analytics.Analytics()
+            spc.backfill(store)
+            store.close()
+
+        row = spc.summary("4950-060-10-02")[0]
+        self.assertEqual(6, row["count"])
+        self.assertAlmostEqual(5.0, row["mean"])
+        self.assertEqual(4.8, row["lower"])
+        self.assertIn("AD1", spc.format_summary())
+
+class TestInstrumentation(unittest.TestCase):
+
+    def setUp(self):
+        instrument.reset()
+
+    def tearDown(self):
+        instrument.enabled = False
+        instrument.reset()
+
+    def test_disabled_records_nothing(self):
+        channel = Channel(1)
+        channel.set_simulation_mode(True)
+        channel.read_voltage()
+
+        with instrument.span("suite.phase"):
+            pass
+
+        self.assertEqual({}, instrument.histograms)
+
+    def test_timings(self):
+        instrument.enabled = True
+
+        channel = Channel(1)
+        channel.set_simulation_mode(True)
+        for i in range(10):
+            channel.read_voltage()
+
+        with instrument.span("TestProcedure.run"):
+            time.sleep(0.01)
+
+        instrument.count("ADCPi.read_raw polls", 3)
+
+        self.assertEqual(10, instrument.histograms[("driver", "Channel.read_voltage")].count)
+        histogram = instrument.histograms[("step", "TestProcedure.run")]
+        self.assertGreaterEqual(histogram.total, 0.01)
+        self.assertGreaterEqual(histogram.percentile(0.95), 0.005)
+
+        report = instrument.report()
+        self.assertIn("Step timings", report)
+        self.assertIn("Channel.read_voltage", report)
+        self.assertIn("ADCPi.read_raw polls", report)
+
+class TestTrace(unittest.TestCase):
+
+    def tearDown(self):
+        trace.stop()
+
+    def test_dump(self):
+        trace.start()
+
+        channel = Channel(1)
+        channel.set_simulation_mode(True)
+
+        def worker():
+            with instrument.span("TestProcedure.run"):
+                channel.read_voltage()
+
+        thread = threading.Thread(target = worker, name = "Test0")
+        thread.start()
+        thread.join()
+        trace.stop()
+
+        # Histograms are only kept when instrumentation itself is enabled.
+        self.assertEqual({}, instrument.histograms)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "trace.json")
+            trace.dump(path)
+            with open(path) as f:
+                events = json.load(f)["traceEvents"]
+
+        self.assertEqual(["B", "B", "E", "E"], [event["ph"] for event in events if event["ph"] != "M"])
+        self.assertEqual(["TestProcedure.run", "Channel.read_voltage"], [event["name"] for event in events if event["ph"] == "B"])
+        self.assertIn({"name": "Test0"}, [event["args"] for event in events if event["ph"] == "M"])
+        self.assertEqual(1, len(set(event["tid"] for event in events)))
+
+    def test_bounded(self):
+        trace.start(size = 10)
+        for i in range(100):
+            trace.instant("tick")
+        trace.stop()
+
+        self.assertEqual(10, len([event for event in trace.events() if event["ph"] == "i"]))
+
+class TestUnattendedRun(unittest.TestCase):
+
+    class FailingProcedure(TestProcedure):
+        description = "Failing test"
+        def run(self):
+            self.set_failed()
+
+    class AutoProcedure(TestProcedure):
+        auto_advance = True
+        def run(self):
+            self.set_passed()
+
+    def test_run_unattended(self):
+        suite = TestSuite()
+        suite.form = HeadlessForm(echo = False)
+        suite.add_test(TestProcedure())
+        suite.add_test(self.AutoProcedure())
+        suite.add_test(self.FailingProcedure())
+        suite.add_test(TestProcedure())
+
+        suite.run_unattended()
+
+        self.assertTrue(suite.summary_shown)
+        self.assertEqual(["passed", "passed", "failed", "passed"], [test.state for test in suite.tests])
+        self.assertIn("4/4 tests were run, of which 3 passed and 1 failed", suite.form.text)
+
+class TestBenchmarks(unittest.TestCase):
+
+    def test_measure_and_compare(self):
+        import Benchmarks
+        from ADCPi.ABE_ADCPi import ADCPi
+
+        adc = ADCPi(Benchmarks.FakeBus(polls = 3), 0x68, 0x69, 12)
+        self.assertEqual(0x7FF, adc.read_raw(1))
+        self.assertEqual(3, adc.poll_count)
+
+        stats = Benchmarks.measure(lambda: adc.read_raw(1), repeat = 3, min_time = 0.001)
+        self.assertGreater(stats["median"], 0)
+
+        baseline = {"read_raw": {"median": stats["median"] / 2}}
+        self.assertEqual(["read_raw"], Benchmarks.compare({"read_raw": stats}, baseline, 0.15))
+        self.assertEqual([], Benchmarks.compare({"read_raw": stats}, {"read_raw": stats}, 0.15))
+
+class TestAcquisition(unittest.TestCase):
+
+    class FakeVar(object):
+        def __init__(self):
+            self.sets = 0
+        def set(self, value):
+            self.value = value
+            self.sets += 1
+
+    def test_latest_snapshot_only(self):
+        acquisition = Acquisition()
+        published = []
+        acquisition.subscribers.append(lambda sequence, timestamp, readings: published.append(sequence))
+
+        acquisition.publish({"AD1": 1.0})
+        acquisition.publish({"AD1": 2.0})
+
+        self.assertEqual({"AD1": 2.0}, acquisition.snapshots.get_nowait())
+        self.assertTrue(acquisition.snapshots.empty())
+        self.assertEqual([1, 2], published)
+        self.assertEqual(2, acquisition.latest[0])
+
+    def test_read_all(self):
+        readings = Acquisition().read()
+        self.assertEqual(8 + 11 + 13, len(readings))
+
+    def test_thread(self):
+        acquisition = Acquisition(period = 0.01)
+        acquisition.start()
+        snapshot = acquisition.snapshots.get(timeout = 5)
+        acquisition.stop()
+        self.assertIn("DIP11", snapshot)
+
+    def test_form_applies_changes_only(self):
+        class Form(object):
+            _displayed_readings = None
+            _reading_rows = {"AD1": {"value": self.FakeVar()}, "AD2": {"value": self.FakeVar()}}
+
+        form = Form()
+        MainForm.update_readings(form, {"AD1": 1.0, "AD2": 2.0})
+        MainForm.update_readings(form, {"AD1": 1.0, "AD2": 2.5})
+
+        self.assertEqual(1, form._reading_rows["AD1"]["value"].sets)
+        self.assertEqual(2, form._reading_rows["AD2"]["value"].sets)
+        self.assertEqual(2.5, form._reading_rows["AD2"]["value"].value)
+
+class TestFormProxy(unittest.TestCase):
+
+    class FakeRoot(object):
+        def after(self, delay, function, *args):
+            pass
+
+    class RecordingForm(object):
+        _count = 7
+
+        def __init__(self):
+            self.root = TestFormProxy.FakeRoot()
+            self.calls = []
+
+        def __getattr__(self, name):
+            if name.startswith("_"):
+                raise AttributeError(name)
+            return lambda *args: self.calls.append((name,) + args)
+
+        def reset_dialogue(self):
+            return True
+
+    def setUp(self):
+        self.form = self.RecordingForm()
+        self.proxy = FormProxy(self.form)
+
+    def in_thread(self, function):
+        thread = threading.Thread(target = function)
+        thread.start()
+        thread.join()
+
+    def test_coalescing(self):
+        def test_thread():
+            self.proxy.set_text("one")
+            self.proxy.append_text_line("two")
+            self.proxy.enable_test_buttons()
+            self.proxy.set_text("three")
+            self.proxy.append_text_line("four")
+            self.proxy.disable_pass_button()
+            self.proxy.update()
+
+        self.in_thread(test_thread)
+
+        # Nothing is applied until the Tk thread processes the queue.
+        self.assertEqual([], self.form.calls)
+        self.proxy.flush()
+
+        self.assertEqual([("enable_fail_button",), ("set_text", "three"), ("append_text_line", "four"), ("disable_pass_button",)], self.form.calls)
+
+    def test_appends_kept(self):
+        def test_thread():
+            self.proxy.append_text_line("one")
+            self.proxy.append_image("image.gif")
+            self.proxy.append_text_line("two")
+            self.proxy.append_text_line("three")
+
+        self.in_thread(test_thread)
+        self.proxy.flush()
+
+        self.assertEqual([("append_text_line", "one"), ("append_image", "image.gif"), ("append_text_line", "two"), ("append_text_line", "three")], self.form.calls)
+
+    def test_tk_thread_calls_directly(self):
+        self.in_thread(lambda: self.proxy.set_stage_text("queued"))
+
+        self.assertTrue(self.proxy.reset_dialogue())
+        self.assertEqual([("set_stage_text", "queued")], self.form.calls)
+        self.assertEqual(7, self.proxy._count)
+
+        self.proxy.reset_action = "action"
+        self.assertEqual("action", self.form.reset_action)
+
+class TestTrendHistory(unittest.TestCase):
+
+    def test_ring(self):
+        history = History(5)
+        for value in range(8):
+            history.append(float(value))
+
+        self.assertEqual(5, len(history))
+        self.assertEqual([3.0, 4.0, 5.0, 6.0, 7.0], history.values())
+
+    def test_decimate(self):
+        history = History(100)
+        for value in [1.0, 5.0, 2.0, 3.0, 0.5, 4.0, 6.0]:
+            history.append(value)
+
+        # Columns are aligned to the newest sample.
+        self.assertEqual([(1.0, 1.0), (2.0, 5.0), (0.5, 3.0), (4.0, 6.0)], history.decimate(10, 2))
+        self.assertEqual([(0.5, 3.0), (4.0, 6.0)], history.decimate(2, 2))
+
+        # The number of columns is bounded however long the history is.
+        for value in range(1000):
+            history.append(float(value))
+        self.assertEqual(20, len(history.decimate(20, 5)))
+
+    def test_scale(self):
+        # The 3600 sample history fits 180 columns at 20 samples each.
+        self.assertEqual(20, trend.columns_for(3600, 180))
+        self.assertEqual(1, trend.columns_for(100, 180))
+
+        lower, upper = trend.scale_for([0.2, 0.5, 0.35])
+        self.assertAlmostEqual(0.17, lower)
+        self.assertAlmostEqual(0.53, upper)
+
+        # A steady rail is shown across the minimum span, not magnified into noise.
+        lower, upper = trend.scale_for([3.3, 3.3])
+        self.assertAlmostEqual(0.06, upper - lower)
+        self.assertAlmostEqual(3.3, (lower + upper) / 2)
+
+class TestImageCache(unittest.TestCase):
+
+    def test_decodes_once_and_evicts(self):
+        decoded = []
+        cache = ImageCache(capacity = 2, loader = lambda path: decoded.append(path) or object())
+
+        with tempfile.TemporaryDirectory() as directory:
+            paths = [os.path.join(directory, "%d.gif" % i) for i in range(3)]
+            for path in paths:
+                open(path, "w").close()
+
+            first = cache.get(paths[0])
+            self.assertIs(first, cache.get(paths[0]))
+            cache.get(paths[1])
+            cache.get(paths[0])
+            cache.get(paths[2])
+
+            # paths[1] was least recently used so it was evicted and is decoded again.
+            self.assertEqual(2, len(cache))
+            cache.get(paths[1])
+            self.assertEqual([paths[0], paths[1], paths[2], paths[1]], decoded)
+
+            self.assertIsNone(cache.get(os.path.join(directory, "missing.gif")))
+
+class TestStopwatch(unittest.TestCase):
+
+    def test_report(self):
+        stopwatch = instrument.Stopwatch()
+        time.sleep(0.01)
+        stopwatch.mark("imports")
+        stopwatch.mark("suite selection")
+        stopwatch.record("readings check", 0.5)
+
+        self.assertGreaterEqual(stopwatch.elapsed(), 0.01)
+        self.assertEqual(["imports", "suite selection"], [name for name, seconds in stopwatch.marks])
+
+        report = stopwatch.report(exclude = ("suite selection",))
+        self.assertTrue(report.startswith("imports "))
+        self.assertIn("(concurrently: readings check 0.500s)", report)
+
+class TestSelfTest(unittest.TestCase):
+
+    def setUp(self):
+        digio.setup()
+
+    def test_idle_jig_passes(self):
+        results = selftest.SelfTest().run()
+        self.assertEqual(["ADC 0x68", "ADC 0x69", "GPIO"], [result.name for result in results])
+        self.assertEqual([], selftest.faults(results))
+        self.assertEqual("OK", selftest.labels(results)["AD8"])
+
+    def test_idle_voltage_fault(self):
+        test = selftest.SelfTest()
+        test.idle_voltages = dict(test.idle_voltages, AD3 = (1.0, 2.0))
+        results = test.run()
+        self.assertEqual(["AD3 reads 0.00V, expected 1.00V to 2.00V"], selftest.faults(results))
+        self.assertEqual("FAULT", selftest.labels(results)["AD4"])
+        self.assertEqual("OK", selftest.labels(results)["AD5"])
+
+    def test_idle_limits(self):
+        test = selftest.SelfTest(limits = {"AD3 idle": (1.0, 2.0), "DIP5 idle": (1, 1)})
+        self.assertEqual(["AD3 reads 0.00V, expected 1.00V to 2.00V", "DIP5 is low with the jig empty"], selftest.faults(test.run()))
+
+    def test_loopback(self):
+        test = selftest.SelfTest()
+        test.loopbacks = [("DOP10", digio.DOP10_FLT_loop_back, "DIP5", digio.DIP5_5V_PWR)]
+        self.assertEqual(["DIP5 does not follow DOP10"], selftest.faults(test.run()))
+
+        GPIODummy._short(digio.DOP10_FLT_loop_back, digio.DIP5_5V_PWR)
+        try:
+            self.assertEqual([], selftest.faults(test.run()))
+        finally:
+            GPIODummy._links.remove((digio.DOP10_FLT_loop_back, digio.DIP5_5V_PWR))
+
+    def test_budget(self):
+        release = threading.Event()
+        test = selftest.SelfTest(budget = 0.05)
+        test.check_gpio = lambda: release.wait(5) and []
+
+        started = time.monotonic()
+        results = test.run()
+        release.set()
+
+        self.assertLess(time.monotonic() - started, 1.0)
+        self.assertEqual(["GPIO did not finish within 0.05s"], selftest.faults(results))
+
+class TestSharedReadings(unittest.TestCase):
+
+    def test_publish_and_read(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "readings")
+            publisher = shm.Publisher(path)
+            reader = shm.Reader(path)
+            self.assertEqual(64, os.path.getsize(path))
+            self.assertIsNone(reader.read())
+
+            readings = {"AD1": 1.25, "AD8": 4.5, "DIP1": "High", "DIP2": "Low", "DIP11": "High", "DOP13": "On", "DOP1": "Off"}
+            publisher.publish(7, 1000.5, readings)
+
+            sequence, timestamp, voltages, dip, dop = reader.read()
+            self.assertEqual(1, sequence)
+            self.assertEqual(1, reader.sequence)
+            self.assertEqual(1000.5, timestamp)
+            self.assertEqual(1.25, voltages[0])
+            self.assertEqual(4.5, voltages[7])
+            self.assertNotEqual(voltages[1], voltages[1])
+            self.assertEqual((1 << 0) | (1 << 10), dip)
+            self.assertEqual(1 << 12, dop)
+
+            reader.close()
+            publisher.close()
+
+    def test_acquisition_subscriber(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "readings")
+            publisher = shm.Publisher(path)
+            acquisition = Acquisition()
+            acquisition.subscribers.append(publisher.publish)
+            acquisition.publish(acquisition.read())
+            acquisition.publish(acquisition.read())
+
+            reader = shm.Reader(path)
+            self.assertEqual(2, reader.read()[0])
+            reader.close()
+            publisher.close()
+
+class TestStatusServer(unittest.TestCase):
+
+    def setUp(self):
+        self.suite = TestSuite()
+        self.suite.variant = "4950-060-10-01"
+        self.suite.add_test(self.Procedure())
+        self.suite.current_test = 0
+
+        self.acquisition = Acquisition()
+        self.acquisition.publish({"AD1": 1.5, "DIP1": "High"})
+
+        self.server = StatusServer(self.suite, self.acquisition, port = 0, push_interval = 0.01)
+        self.server.start()
+        self.url = "http://127.0.0.1:%d" % self.server.port
+
+    def tearDown(self):
+        self.server.stop()
+
+    class Procedure(TestProcedure):
+        description = "Check the pogo voltage"
+
+    def get(self, path):
+        with urllib.request.urlopen(self.url + path, timeout = 5) as response:
+            return json.loads(response.read().decode("utf-8"))
+
+    def test_http(self):
+        status = self.get("/status")
+        self.assertEqual("4950-060-10-01", status["variant"])
+        self.assertEqual("Procedure", status["test"]["name"])
+        self.assertEqual(1, status["stages"])
+
+        self.assertEqual(1.5, self.get("/readings")["readings"]["AD1"])
+        self.assertEqual([], self.get("/results"))
+        self.assertIn("timings", self.get("/metrics"))
+
+        with self.assertRaises(urllib.error.HTTPError) as context:
+            self.get("/missing")
+        self.assertEqual(404, context.exception.code)
+
+    def test_handler_error(self):
+        class BrokenStore(object):
+            def runs(self, **kwargs):
+                raise sqlite3.OperationalError("database is locked")
+        self.suite.results = BrokenStore()
+
+        with self.assertRaises(urllib.error.HTTPError) as context:
+            self.get("/results")
+        self.assertEqual(500, context.exception.code)
+        self.assertIn("database is locked", json.loads(context.exception.read().decode("utf-8"))["error"])
+
+    def test_websocket(self):
+        connection = socket.create_connection(("127.0.0.1", self.server.port), timeout = 5)
+        key = base64.b64encode(os.urandom(16)).decode("ascii")
+        connection.sendall(("GET /ws HTTP/1.1\r\nHost: localhost\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                            "Sec-WebSocket-Key: %s\r\nSec-WebSocket-Version: 13\r\n\r\n" % key).encode("ascii"))
+        stream = connection.makefile("rb")
+        self.assertIn(b"101", stream.readline())
+        while stream.readline() != b"\r\n":
+            pass
+
+        def read_message():
+            first, second = stream.read(2)
+            length = second & 0x7F
+            if length == 126:
+                length = int.from_bytes(stream.read(2), "big")
+            return json.loads(stream.read(length).decode("utf-8"))
+
+        self.assertEqual(1, read_message()["readings"]["sequence"])
+
+        # Nothing is pushed until the readings change.
+        self.acquisition.publish({"AD1": 1.6})
+        self.assertEqual(1.6, read_message()["readings"]["readings"]["AD1"])
+
+        # Masked close frame with an empty payload.
+        connection.sendall(bytes([0x88, 0x80, 1, 2, 3, 4]))
+        self.assertEqual(bytes([0x88, 0]), stream.read(2))
+        connection.close()
+
+class TestConfiguration(unittest.TestCase):
+
+    tests_ini = """[suites]
+0 = 4950-060-10-01 (Ethernet with battery backup)
+1 = 4950-060-10-02 (Ethernet without battery backup)
+
+[suite0]
+0 = Test00_Setup
+1 = TestB2_FirstStage
+
+[settings]
+selected_suite = 1
+"""
+
+    limits_ini = """[default]
+AD1 = 4.8, 5.2
+AD2 = 4.8, 5.2
+
+[4950-060-10-02]
+AD2 = 4.9, 5.1
+"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.tests_path = os.path.join(self.directory.name, "tests.ini")
+        self.limits_path = os.path.join(self.directory.name, "limits.ini")
+        self.write(self.tests_path, self.tests_ini)
+        self.write(self.limits_path, self.limits_ini)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, path, text):
+        # Move the modification time on, as a rewrite within the file system's timestamp resolution wouldn't be seen.
+        stamp = os.stat(path).st_mtime_ns + 1000000000 if os.path.exists(path) else None
+        with open(path, "w") as f:
+            f.write(text)
+        if stamp:
+            os.utime(path, ns = (stamp, stamp))
+
+    def test_suites(self):
+        configs = configuration.ConfigService(self.tests_path, self.limits_path)
+        self.assertEqual("1", configs.selected)
+        self.assertEqual([("0", "4950-060-10-01 (Ethernet with battery backup)"), ("1", "4950-060-10-02 (Ethernet without battery backup)")], configs.names())
+
+        suite = configs.suite("0")
+        self.assertEqual("4950-060-10-01", suite.variant)
+        self.assertEqual(["Test00_Setup", "TestB2_FirstStage"], suite.tests)
+        self.assertEqual((4.8, 5.2), suite.limits["AD2"])
+        self.assertEqual((4.9, 5.1), configs.suite().limits["AD2"])
+        self.assertEqual([], configs.suite("1").tests)
+
+    def test_reload(self):
+        configs = configuration.ConfigService(self.tests_path, self.limits_path)
+        self.assertFalse(configs.reload())
+
+        self.write(self.limits_path, self.limits_ini.replace("AD1 = 4.8, 5.2", "AD1 = 4.7, 5.3"))
+        self.assertTrue(configs.reload())
+        self.assertEqual(2, configs.generation)
+        self.assertEqual((4.7, 5.3), configs.suite("0").limits["AD1"])
+
+    def test_invalid_edit_keeps_configuration(self):
+        configs = configuration.ConfigService(self.tests_path, self.limits_path)
+        self.write(self.tests_path, self.tests_ini.replace("Test00_Setup", "Test99_Missing"))
+        self.write(self.limits_path, self.limits_ini.replace("AD1 = 4.8, 5.2", "AD1 = 5.2, 4.8"))
+
+        with self.assertRaises(configuration.ConfigError) as context:
+            configs.reload()
+        self.assertIn("Test99_Missing", str(context.exception))
+        self.assertIn("lower limit 5.2 is above upper limit 4.8", str(context.exception))
+        self.assertEqual(["Test00_Setup", "TestB2_FirstStage"], configs.suite("0").tests)
+
+    def test_select(self):
+        configs = configuration.ConfigService(self.tests_path, self.limits_path)
+        configs.select(0)
+        self.assertFalse(configs.reload())
+        self.assertEqual("0", configuration.ConfigService(self.tests_path, self.limits_path).selected)
+
+    def test_switch_suite(self):
+        configs = configuration.ConfigService(self.tests_path, self.limits_path)
+        suite = TestSuite()
+        suite.form = HeadlessForm(echo = False)
+        suite.configure(configs.suite("1"))
+        self.assertEqual(1, suite.selected_suite)
+        self.assertEqual(1, len(suite.tests))
+
+        suite.current_test = 0
+        self.assertFalse(suite.switch_suite(configs.suite("0")))
+
+        suite.current_test = -1
+        self.assertTrue(suite.switch_suite(configs.suite("0")))
+        self.assertEqual(0, suite.selected_suite)
+        self.assertEqual("4950-060-10-01", suite.variant)
+        self.assertEqual(3, len(suite.tests))
+        self.assertEqual((4.8, 5.2), suite.tests[1].limit("AD1", 0, 1))
+        self.assertEqual((0, 1), suite.tests[1].limit("AD9", 0, 1))
+
+        # The summary stays until RESET.
+        suite.form.set_text("Summary")
+        suite.current_test = 2
+        suite.summary_shown = True
+        self.assertTrue(suite.switch_suite(configs.suite("1")))
+        self.assertEqual("Summary", suite.form.text)
+        self.assertTrue(suite.summary_shown)
+        suite.reset()
+        self.assertFalse(suite.summary_shown)
+        self.assertEqual(-1, suite.current_test)
+        self.assertNotEqual("Summary", suite.form.text)
+
+class TestRegistry(unittest.TestCase):
+
+    plugin = """from ATE.tests import TestProcedure
+from ATE.registry import register
+
+@register("TestP1_OldName")
+class TestP1_Plugin(TestProcedure):
+    description = "Plugin test"
+"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.module = "pogo_plugin_%d" % id(self)
+        self.path = os.path.join(self.directory.name, self.module + ".py")
+        with open(self.path, "w") as f:
+            f.write(self.plugin)
+        self.manifest = os.path.join(self.directory.name, "tests.manifest.json")
+        sys.path.insert(0, self.directory.name)
+
+    def tearDown(self):
+        sys.path.remove(self.directory.name)
+        sys.modules.pop(self.module, None)
+        self.directory.cleanup()
+
+    def test_lazy_import(self):
+        first = registry.Registry(["ATE.tests", self.module], self.manifest)
+        self.assertEqual((self.module, "TestP1_Plugin"), first.locate("TestP1_OldName"))
+        self.assertIn("TestB2_FirstStage", first)
+        self.assertNotIn("TestProcedure", first)
+        self.assertTrue(os.path.exists(self.manifest))
+
+        # A new registry finds the names in the manifest without importing the plugin.
+        sys.modules.pop(self.module)
+        second = registry.Registry(["ATE.tests", self.module], self.manifest)
+        self.assertIn("TestP1_Plugin", second.names())
+        self.assertNotIn(self.module, sys.modules)
+
+        cls = second.resolve("TestP1_OldName")
+        self.assertEqual("Plugin test", cls.description)
+        self.assertIn(self.module, sys.modules)
+        self.assertNotIn("TestMissing", second)
+        with self.assertRaises(KeyError):
+            second.resolve("TestMissing")
+
+    def test_changed_module_rescanned(self):
+        registry.Registry([self.module], self.manifest).locations()
+
+        stamp = os.stat(self.path).st_mtime_ns + 1000000000
+        with open(self.path, "a") as f:
+            f.write("\nclass TestP2_Added(TestP1_Plugin):\n    pass\n")
+        os.utime(self.path, ns = (stamp, stamp))
+        sys.modules.pop(self.module)
+
+        self.assertIn("TestP2_Added", registry.Registry([self.module], self.manifest))
+
+    def test_configuration_plugins(self):
+        tests_path = os.path.join(self.directory.name, "tests.ini")
+        with open(tests_path, "w") as f:
+            f.write("[suites]\n0 = 4950-060-10-01 (Ethernet with battery backup)\n\n[suite0]\n0 = TestP1_OldName\n\n[plugins]\nmodules = %s\n" % self.module)
+
+        configs = configuration.ConfigService(tests_path, os.path.join(self.directory.name, "limits.ini"))
+        suite = TestSuite()
+        suite.configure(configs.suite("0"))
+        self.assertEqual("TestP1_Plugin", type(suite.tests[0]).__name__)
+        self.assertEqual("TestEnd_TestsCompleted", type(suite.tests[1]).__name__)
+
+class TestJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "run.journal")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    class Step(TestProcedure):
+        description = "Step"
+
+    def make_suite(self, journal):
+        suite = TestSuite()
+        suite.form = HeadlessForm(echo = False, serial = "SN1")
+        suite.variant = "4950-060-10-01"
+        suite.selected_suite = 0
+        suite.journal = journal
+        for i in range(3):
+            suite.add_test(self.Step())
+        return suite
+
+    def test_resume(self):
+        journal = Journal(self.path)
+        suite = self.make_suite(journal)
+        suite.reset()
+        suite.thread.join()
+        suite.fail_test()
+        suite.thread.join()
+
+        # The controller loses power during the second step.
+        journal.close()
+        self.assertLessEqual(journal.syncs, 2)
+
+        journal = Journal(self.path)
+        unfinished = journal.unfinished()
+        self.assertEqual("SN1", unfinished["serial"])
+        self.assertEqual(1, unfinished["next"])
+        self.assertEqual("failed", unfinished["steps"][0]["state"])
+
+        suite = self.make_suite(journal)
+        suite.resume(unfinished)
+        suite.thread.join()
+        self.assertEqual(1, suite.current_test)
+        self.assertEqual("failed", suite.tests[0].state)
+
+        suite.pass_test()
+        suite.thread.join()
+        suite.pass_test()
+        self.assertTrue(suite.summary_shown)
+
+        journal.flush()
+        self.assertIsNone(journal.unfinished())
+        self.assertEqual(0, os.path.getsize(self.path))
+        journal.close()
+
+    def test_torn_record(self):
+        with open(self.path, "w") as f:
+            f.write(json.dumps({"type": "begin", "run_id": None, "serial": "SN2", "variant": "V", "suite": 1, "tests": ["A", "B", "C"], "time": 0}) + "\n")
+            f.write(json.dumps({"type": "step", "position": 0, "name": "A", "state": "passed", "failures": [], "time": 0}) + "\n")
+            f.write('{"type": "step", "posi')
+
+        journal = Journal(self.path)
+        self.assertEqual(1, journal.unfinished()["next"])
+        journal.discard()
+        journal.flush()
+        self.assertIsNone(journal.unfinished())
+        journal.close()
+
 if __name__ == '__main__':
     unittest.main()